@@ -0,0 +1,112 @@
+# File: backend/app/batch_query.py
+
+import time
+import asyncio
+import logging
+from .scheduler import BATCH
+
+logger = logging.getLogger(__name__)
+
+
+def answer_sources(docs):
+    """The distinct sources of retrieved documents, each followed by the files holding near-identical copies."""
+    sources = []
+    for doc in docs:
+        sources.append(doc.metadata.get("source", "Unknown"))
+        sources.extend(doc.metadata.get("duplicate_sources", []))
+    return list(dict.fromkeys(sources))
+
+
+def retrieve_batch(questions, k, contexts, embed_workers=4):
+    """Retrieve the top-k documents for every question.
+
+    Each distinct question is embedded once per embedding model in use, and
+    each folder is searched once for all of them. With several folders the
+    hits are merged by distance, as for single queries.
+    """
+    unique = list(dict.fromkeys(questions))
+    vectors_by_spec = {}
+
+    merged = [[] for _ in unique]
+    for context in contexts:
+        embeddings = context.db_manager.embeddings
+        spec = getattr(embeddings, "spec", getattr(embeddings, "model", None))
+        if spec not in vectors_by_spec:
+            vectors_by_spec[spec] = context.db_manager.embed_queries(unique, workers=embed_workers)
+        vectors = vectors_by_spec[spec]
+        for i, hits in enumerate(context.db_manager.search_by_vectors(vectors, k=k)):
+            for doc, score in hits:
+                if len(contexts) > 1:
+                    doc.metadata["folder"] = context.path
+                merged[i].append((score, doc))
+    by_question = {}
+    for question, scored in zip(unique, merged):
+        scored.sort(key=lambda item: item[0])
+        by_question[question] = [doc for _, doc in scored[:k]]
+    return [by_question[question] for question in questions]
+
+
+def build_prompt(template, docs, question):
+    context = "\n".join([doc.page_content for doc in docs])
+    return template.format(context=context, question=question)
+
+
+async def run_batch(items, k, contexts, get_llm, template, concurrency=2, embed_workers=4,
+                    generate=True, scheduler=None):
+    """Answer `(id, question)` pairs, yielding one result dict per question as it completes.
+
+    Questions whose prompts are identical, because they are the same question
+    over the same retrieved context, share one generation. At most
+    `concurrency` generations run at a time, and with a `scheduler` each one
+    also waits for a generation slot behind interactive queries. The last
+    dict yielded is a summary with `"done": True`.
+    """
+    started = time.time()
+    ids = [item_id for item_id, _ in items]
+    questions = [question for _, question in items]
+    all_docs = await asyncio.to_thread(retrieve_batch, questions, k, contexts, embed_workers)
+    logger.info(f"Batch retrieval for {len(items)} questions took {time.time() - started:.2f}s")
+
+    prompts = [build_prompt(template, docs, question) for docs, question in zip(all_docs, questions)]
+    llm = await asyncio.to_thread(get_llm) if generate else None
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    generations = {}
+
+    async def generate_answer(prompt):
+        async with semaphore:
+            if scheduler is None:
+                return await llm.agenerate(prompt)
+            async with scheduler.slot(BATCH, bounded=False):
+                return await llm.agenerate(prompt)
+
+    async def answer(index):
+        docs = all_docs[index]
+        result = {"id": ids[index], "sources": answer_sources(docs)}
+        if not docs:
+            result["error"] = "No documents found"
+            return result
+        if generate:
+            prompt = prompts[index]
+            if prompt not in generations:
+                generations[prompt] = asyncio.ensure_future(generate_answer(prompt))
+            try:
+                # shield: a generation shared by several questions must outlive any one of them
+                result["answer"] = await asyncio.shield(generations[prompt])
+            except Exception as e:
+                logger.error(f"Error generating answer for question {ids[index]}: {str(e)}")
+                result["error"] = str(e)
+        else:
+            result["contexts"] = [doc.page_content for doc in docs]
+        return result
+
+    tasks = [asyncio.ensure_future(answer(i)) for i in range(len(items))]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        # On a client disconnect this also aborts the generations still running
+        for task in list(tasks) + list(generations.values()):
+            task.cancel()
+
+    yield {"done": True, "questions": len(items), "generations": len(generations),
+           "elapsed": round(time.time() - started, 3)}
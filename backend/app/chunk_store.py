@@ -0,0 +1,261 @@
+# File: backend/app/chunk_store.py
+
+import os
+import json
+import mmap
+import zlib
+import threading
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_FILE = "chunks.seg"
+INDEX_FILE = "chunks.idx"
+SOURCES_FILE = "sources.jsonl"
+COMPACT_MARKER = "compact.commit"
+
+# One fixed-size index row per chunk; the chunk id is the row number
+INDEX_DTYPE = np.dtype([("offset", "<u8"), ("length", "<u4"), ("source", "<u4"), ("flags", "<u4")])
+DELETED = 1
+COMPRESSED = 2
+
+
+class ChunkStore:
+    """Chunk texts and metadata in an append-only segment file.
+
+    Each chunk is one record in chunks.seg, optionally zlib-compressed, and
+    one fixed-size row in chunks.idx giving its offset, length, source and
+    flags. Reads go through an mmap of the segment, so fetching the k chunks
+    a search returns touches only those k records. Sources are interned in
+    sources.jsonl, which lets `list_sources` work from the index alone.
+
+    Deleting marks index rows; `compact` rewrites the segment without the
+    deleted records. Chunk ids never change, so vector stores can keep them.
+    """
+
+    def __init__(self, directory, compression=None, compact_ratio=0.5, compact_min_bytes=1 << 20):
+        if compression not in (None, "zlib"):
+            raise ValueError(f"Unsupported chunk compression: {compression}")
+        self.directory = directory
+        self.compression = compression
+        self.compact_ratio = compact_ratio
+        self.compact_min_bytes = compact_min_bytes
+        self._lock = threading.RLock()
+        self._mmap = None
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _finish_compaction(self):
+        """Complete or discard a compaction interrupted between writing and swapping its files."""
+        committed = os.path.exists(self._path(COMPACT_MARKER))
+        for name in (INDEX_FILE, SEGMENT_FILE):
+            tmp = self._path(name + ".tmp")
+            if os.path.exists(tmp):
+                if committed:
+                    os.replace(tmp, self._path(name))
+                else:
+                    os.remove(tmp)
+        if committed:
+            os.remove(self._path(COMPACT_MARKER))
+
+    def _load(self):
+        self._finish_compaction()
+        self.sources = []
+        if os.path.exists(self._path(SOURCES_FILE)):
+            with open(self._path(SOURCES_FILE), "rb") as f:
+                for line in f:
+                    if line.endswith(b"\n"):
+                        self.sources.append(json.loads(line))
+        self._source_ids = {source: i for i, source in enumerate(self.sources)}
+
+        index = np.fromfile(self._path(INDEX_FILE), dtype=INDEX_DTYPE) if os.path.exists(self._path(INDEX_FILE)) else None
+        self.index = index if index is not None else np.empty(0, dtype=INDEX_DTYPE)
+        # An append interrupted part way leaves a partial index row or unindexed segment bytes; drop them
+        valid = self.index["source"] < len(self.sources)
+        if not valid.all():
+            self.index = self.index[:np.argmin(valid)]
+        end = int((self.index["offset"] + self.index["length"]).max()) if len(self.index) else 0
+        for name, size in ((INDEX_FILE, len(self.index) * INDEX_DTYPE.itemsize), (SEGMENT_FILE, end)):
+            if os.path.exists(self._path(name)) and os.path.getsize(self._path(name)) > size:
+                logger.warning(f"Truncating incomplete tail of {self._path(name)}")
+                with open(self._path(name), "r+b") as f:
+                    f.truncate(size)
+        self.segment_bytes = end
+
+    def _source_id(self, source):
+        source_id = self._source_ids.get(source)
+        if source_id is None:
+            source_id = len(self.sources)
+            with open(self._path(SOURCES_FILE), "ab") as f:
+                f.write(json.dumps(source, ensure_ascii=False).encode("utf-8") + b"\n")
+            self.sources.append(source)
+            self._source_ids[source] = source_id
+        return source_id
+
+    def append(self, texts, metadatas):
+        """Store chunks and return their ids."""
+        with self._lock:
+            rows = np.zeros(len(texts), dtype=INDEX_DTYPE)
+            offset = self.segment_bytes
+            with open(self._path(SEGMENT_FILE), "ab") as f:
+                for i, (text, metadata) in enumerate(zip(texts, metadatas)):
+                    metadata = metadata or {}
+                    data = json.dumps([text, metadata], ensure_ascii=False).encode("utf-8")
+                    flags = 0
+                    if self.compression == "zlib":
+                        data = zlib.compress(data, 6)
+                        flags |= COMPRESSED
+                    f.write(data)
+                    rows[i] = (offset, len(data), self._source_id(metadata.get("source", "")), flags)
+                    offset += len(data)
+            # The index is written after the segment, so a row never points past the data
+            with open(self._path(INDEX_FILE), "ab") as f:
+                rows.tofile(f)
+            start = len(self.index)
+            self.index = np.concatenate([self.index, rows])
+            self.segment_bytes = offset
+            # The map does not cover the appended bytes; the next read maps the segment again
+            self._unmap()
+            return list(range(start, start + len(rows)))
+
+    def _unmap(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def _segment(self):
+        if self._mmap is None and self.segment_bytes:
+            with open(self._path(SEGMENT_FILE), "rb") as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._mmap
+
+    def get(self, ids):
+        """Return `(text, metadata)` for each id, or None for deleted or unknown ids."""
+        with self._lock:
+            segment = self._segment()
+            view = memoryview(segment) if segment is not None else None
+            chunks = []
+            for chunk_id in ids:
+                if not 0 <= chunk_id < len(self.index) or self.index[chunk_id]["flags"] & DELETED:
+                    chunks.append(None)
+                    continue
+                offset, length, _, flags = self.index[chunk_id].tolist()
+                data = view[offset:offset + length]
+                if flags & COMPRESSED:
+                    data = zlib.decompress(data)
+                text, metadata = json.loads(bytes(data) if isinstance(data, memoryview) else data)
+                chunks.append((text, metadata))
+            if view is not None:
+                view.release()
+            return chunks
+
+    def _live(self):
+        return (self.index["flags"] & DELETED) == 0
+
+    def list_sources(self):
+        live_sources = np.unique(self.index["source"][self._live()])
+        return set(self.sources[i] for i in live_sources)
+
+    def source_counts(self):
+        """Return `{source: live chunk count}`."""
+        counts = np.bincount(self.index["source"][self._live()], minlength=len(self.sources))
+        return {self.sources[i]: int(n) for i, n in enumerate(counts) if n}
+
+    def count(self, source=None):
+        live = self._live()
+        if source is not None:
+            source_id = self._source_ids.get(source)
+            if source_id is None:
+                return 0
+            live &= self.index["source"] == source_id
+        return int(np.count_nonzero(live))
+
+    def ids(self, source):
+        """The ids of the live chunks of `source`."""
+        source_id = self._source_ids.get(source)
+        if source_id is None:
+            return []
+        return np.flatnonzero(self._live() & (self.index["source"] == source_id)).tolist()
+
+    def delete(self, where=None):
+        """Mark chunks deleted by source (`{"source": ...}`), or all chunks if `where` is None."""
+        if where and set(where) != {"source"}:
+            raise ValueError(f"Chunks can only be deleted by source, got filter: {where}")
+        with self._lock:
+            if not where:
+                self.clear()
+                return []
+            source_id = self._source_ids.get(where["source"])
+            if source_id is None:
+                return []
+            rows = np.flatnonzero(self._live() & (self.index["source"] == source_id))
+            if len(rows):
+                self.index["flags"][rows] |= DELETED
+                index_file = np.memmap(self._path(INDEX_FILE), dtype=INDEX_DTYPE, mode="r+")
+                index_file["flags"][rows] = self.index["flags"][rows]
+                index_file.flush()
+                del index_file
+                self.maybe_compact()
+            return rows.tolist()
+
+    def dead_bytes(self):
+        return self.segment_bytes - int(self.index["length"][self._live()].sum())
+
+    def maybe_compact(self):
+        dead = self.dead_bytes()
+        if dead >= self.compact_min_bytes and dead >= self.compact_ratio * self.segment_bytes:
+            self.compact()
+
+    def compact(self):
+        """Rewrite the segment without deleted chunks, keeping every chunk id."""
+        with self._lock:
+            segment = self._segment()
+            index = self.index.copy()
+            live = np.flatnonzero(self._live())
+            offset = 0
+            tmp_segment = self._path(SEGMENT_FILE + ".tmp")
+            with open(tmp_segment, "wb") as f:
+                for row in live:
+                    start, length = int(index[row]["offset"]), int(index[row]["length"])
+                    f.write(segment[start:start + length])
+                    index[row]["offset"] = offset
+                    offset += length
+                f.flush()
+                os.fsync(f.fileno())
+            dead = ~self._live()
+            index["offset"][dead] = 0
+            index["length"][dead] = 0
+            tmp_index = self._path(INDEX_FILE + ".tmp")
+            with open(tmp_index, "wb") as f:
+                index.tofile(f)
+                f.flush()
+                os.fsync(f.fileno())
+
+            reclaimed = self.segment_bytes - offset
+            self._unmap()
+            # The marker commits the pair: once it exists a restart finishes both swaps, before it neither happens
+            with open(self._path(COMPACT_MARKER), "w"):
+                pass
+            os.replace(tmp_index, self._path(INDEX_FILE))
+            os.replace(tmp_segment, self._path(SEGMENT_FILE))
+            os.remove(self._path(COMPACT_MARKER))
+            self.index = index
+            self.segment_bytes = offset
+            logger.info(f"Compacted chunk store {self.directory}, reclaimed {reclaimed} bytes")
+
+    def close(self):
+        """Unmap the segment; it is mapped again on the next read."""
+        with self._lock:
+            self._unmap()
+
+    def clear(self):
+        with self._lock:
+            self._unmap()
+            for name in (SEGMENT_FILE, INDEX_FILE, SOURCES_FILE):
+                if os.path.exists(self._path(name)):
+                    os.remove(self._path(name))
+            self._load()
@@ -1,13 +1,65 @@
 # backend/app/components.py
 
-import os
-from .document_processor import DocumentProcessor
-from .db_manager import DBManager
+import threading
+import logging
 
-# Initialize components
-document_processor = DocumentProcessor()
-db_manager = DBManager("./data/db")
-documents_dir = os.path.abspath("./data/documents")
+logger = logging.getLogger(__name__)
 
-# Ensure documents directory exists
-os.makedirs(documents_dir, exist_ok=True)
\ No newline at end of file
+
+class Components:
+    """Shared application components, each built by its factory on first use.
+
+    Building the LLM handle, the embeddings client or the folder registry
+    pulls in heavy dependencies, so nothing is constructed until a request
+    (or the background warm start) actually needs it.
+    """
+
+    def __init__(self):
+        self._factories = {}
+        self._instances = {}
+        self._lock = threading.RLock()
+
+    def register(self, name, factory):
+        with self._lock:
+            self._factories[name] = factory
+
+    def get(self, name):
+        instance = self._instances.get(name)
+        if instance is not None:
+            return instance
+        with self._lock:
+            instance = self._instances.get(name)
+            if instance is None:
+                logger.info(f"Building component: {name}")
+                instance = self._factories[name]()
+                self._instances[name] = instance
+            return instance
+
+    def is_built(self, name):
+        return name in self._instances
+
+    def peek(self, name):
+        """Return the component if it was already built, without building it."""
+        return self._instances.get(name)
+
+    def rebuild(self, name):
+        """Replace a built component with a freshly built one.
+
+        Callers still holding the old instance keep using it, so work in
+        flight is not interrupted; a component not built yet stays lazy.
+        """
+        with self._lock:
+            if name not in self._instances:
+                return None
+            logger.info(f"Rebuilding component: {name}")
+            instance = self._factories[name]()
+            self._instances[name] = instance
+            return instance
+
+    def reset(self, name):
+        """Drop a built component so the next get() rebuilds it."""
+        with self._lock:
+            return self._instances.pop(name, None)
+
+
+components = Components()
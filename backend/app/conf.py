@@ -2,9 +2,12 @@
 
 import json
 import os
+import threading
+
+DEFAULT_CONFIG_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'config.json')
 
 class Config:
-    def __init__(self, config_file='config.json'):
+    def __init__(self, config_file=DEFAULT_CONFIG_FILE):
         self.config_file = config_file
         self.default_config = {
             "prompt_template": """<|start_header_id|>system<|end_header_id|>
@@ -23,6 +26,7 @@ Basandoti sul contesto fornito, rispondi alla domanda in modo conciso ma informa
             "model": "mistral:latest",
             "k": 5
         }
+        self._lock = threading.RLock()
         self.config = self.load_config()
 
     def load_config(self):
@@ -32,25 +36,44 @@ Basandoti sul contesto fornito, rispondi alla domanda in modo conciso ma informa
         return self.default_config.copy()
 
     def save_config(self):
-        with open(self.config_file, 'w') as f:
-            json.dump(self.config, f, indent=2)
+        # Written to a temporary file and renamed over config.json, so a crash
+        # never leaves a truncated config behind
+        with self._lock:
+            tmp = self.config_file + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(self.config, f, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.config_file)
+
+    def update(self, changes):
+        """Apply several settings with a single write; returns the keys whose value changed."""
+        with self._lock:
+            changed = {key for key, value in changes.items() if key not in self.config or self.config[key] != value}
+            if changed:
+                self.config.update({key: changes[key] for key in changed})
+                self.save_config()
+            return changed
 
     def get_prompt_template(self):
         return self.config.get('prompt_template', self.default_config['prompt_template'])
 
     def set_prompt_template(self, new_template):
-        self.config['prompt_template'] = new_template
-        self.save_config()
+        self.update({'prompt_template': new_template})
 
     def get(self, key, default=None):
         return self.config.get(key, default)
 
     def set(self, key, value):
-        self.config[key] = value
-        self.save_config()
+        self.update({key: value})
 
     def reset_to_default(self):
-        self.config = self.default_config.copy()
-        self.save_config()
+        """Restore the default prompt template, model and k; returns the keys whose value changed.
+
+        Every other setting survives a reset: folders are state, and the
+        embedding, chunking and vector store settings shape the indexes on
+        disk, so dropping them would rebuild every folder.
+        """
+        return self.update(self.default_config)
 
 config = Config()
\ No newline at end of file
@@ -1,59 +1,140 @@
+import os
+import asyncio
+import itertools
 import logging
-from langchain_community.embeddings import OllamaEmbeddings
-from langchain_community.vectorstores import Chroma
-from chromadb.config import Settings
-from langchain.schema import Document
+from collections import Counter
+from contextlib import contextmanager
+from .embeddings import get_embeddings
+
+# langchain and chromadb take most of the backend's import time, so they are
+# imported where first used rather than when the app starts. Storage engines
+# live in vector_stores.py, selected by the "vector_backend" setting; chunk
+# texts are kept in a ChunkStore and vector stores only hold their ids.
 
 logger = logging.getLogger(__name__)
 
+# Shared by every DBManager, so an index reopened after an LRU eviction or a
+# rollback never repeats a generation an earlier instance handed out
+_generations = itertools.count(1)
+
+
 class DBManager:
-    def __init__(self, persist_directory):
+    def __init__(self, persist_directory, embeddings=None, backend="chroma", vector_dtype="float16", chunk_compression=None,
+                 dedup_threshold=None):
         self.persist_directory = persist_directory
-        self.embeddings = OllamaEmbeddings(model="nomic-embed-text")
-        self.db = self._load_or_create_db()
+        # The embeddings client is stateless, so folders can share one instance
+        self.embeddings = embeddings or get_embeddings()
+        self.backend = backend
+        self.vector_dtype = vector_dtype
+        self.store = self._load_or_create_db()
+        # Changed on every write; cached search results are keyed by it
+        self.generation = next(_generations)
+        from .chunk_store import ChunkStore
+        self.chunks = ChunkStore(os.path.join(persist_directory, "chunks"), compression=chunk_compression)
+        from .source_registry import SourceRegistry
+        self.sources = SourceRegistry(os.path.join(persist_directory, "sources.sqlite3"))
+        if self.sources.is_empty() and self.chunks.count():
+            # A chunk store created before the source registry
+            self.sources.add_chunks(self.chunks.source_counts())
+        # Near-duplicate chunks are stored but not embedded; None turns detection off
+        self.dedup = None
+        if dedup_threshold is not None:
+            from .near_duplicates import NearDuplicateIndex
+            self.dedup = NearDuplicateIndex(self.sources, threshold=dedup_threshold)
 
     def _load_or_create_db(self):
+        from .vector_stores import create_vector_store
         try:
-            db = Chroma(
-                persist_directory=self.persist_directory,
-                embedding_function=self.embeddings,
-                client_settings=Settings(
-                    anonymized_telemetry=False,
-                    is_persistent=True
-                )
-            )
-            logger.info(f"Database loaded from or created in: {self.persist_directory}")
-            return db
+            store = create_vector_store(self.backend, self.persist_directory, dtype=self.vector_dtype)
+            logger.info(f"{self.backend} vector store loaded from or created in: {self.persist_directory}")
+            return store
         except Exception as e:
             logger.error(f"Error creating/loading database: {str(e)}")
             raise
 
     def similarity_search(self, query, k=4):
+        from langchain.schema import Document
         try:
-            # Reload the database before each search to ensure it's up to date
-            self.db = self._load_or_create_db()
-            
             logger.info(f"Performing similarity search for query: {query}")
-            results = self.db.similarity_search(query, k=k)
+            results = [doc for doc, _ in self.similarity_search_with_score(query, k=k)]
             logger.info(f"Similarity search returned {len(results)} results")
-            
-            valid_results = [doc for doc in results if doc.page_content is not None]
-            
-            if not valid_results:
+
+            if not results:
                 logger.warning("No valid results found after filtering")
                 return [Document(page_content="No relevant information found.", metadata={})]
-            
-            logger.info(f"Returning {len(valid_results)} valid results")
-            return valid_results
+
+            logger.info(f"Returning {len(results)} valid results")
+            return results
         except Exception as e:
             logger.error(f"Error during similarity search: {str(e)}", exc_info=True)
             return [Document(page_content=f"An error occurred during the search: {str(e)}", metadata={})]
 
-    def add_texts(self, texts, metadatas=None):
+    def preload(self):
+        """Load the persisted vector index into memory ahead of the first query."""
+        try:
+            self.store.preload()
+            logger.info(f"Preloaded vector index from {self.persist_directory}")
+        except Exception as e:
+            logger.warning(f"Could not preload vector index: {str(e)}")
+
+    def similarity_search_with_score(self, query, k=4):
+        """Return `(document, distance)` pairs, lower distance meaning closer."""
+        try:
+            return self.search_by_vectors([self.embeddings.embed_query(query)], k=k)[0]
+        except Exception as e:
+            logger.error(f"Error during similarity search: {str(e)}", exc_info=True)
+            raise
+
+    def embed_queries(self, queries, workers=4):
+        """Embed several queries, issuing up to `workers` embedding requests at once."""
+        if len(queries) <= 1 or workers <= 1:
+            return [self.embeddings.embed_query(query) for query in queries]
+        # The Ollama embeddings endpoint takes one prompt per request
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="embed") as executor:
+            return list(executor.map(self.embeddings.embed_query, queries))
+
+    async def aembed_query(self, query):
+        """Embed a query without blocking the event loop; cancelling the caller aborts the request."""
+        if hasattr(self.embeddings, "aembed_query"):
+            return await self.embeddings.aembed_query(query)
+        return await asyncio.to_thread(self.embeddings.embed_query, query)
+
+    def search_by_vectors(self, vectors, k=4):
+        """Search with several query vectors in one pass; returns `(document, distance)` pairs per query.
+
+        Chunks returned for more than one query are read from the chunk store once.
+        """
+        from langchain.schema import Document
+        all_hits = self.store.search(vectors, k=k)
+        chunk_ids = sorted(set(metadata["chunk"] for hits in all_hits for _, metadata, _ in hits if "chunk" in metadata))
+        chunks = dict(zip(chunk_ids, self.chunks.get(chunk_ids)))
+        duplicate_sources = self.dedup.duplicate_sources(chunk_ids) if self.dedup else {}
+        results = []
+        for hits in all_hits:
+            documents = []
+            for text, metadata, distance in hits:
+                if "chunk" in metadata:
+                    chunk_id = metadata["chunk"]
+                    chunk = chunks[chunk_id]
+                    if chunk is None:
+                        continue
+                    text, metadata = chunk
+                    if chunk_id in duplicate_sources:
+                        # Files whose near-identical copies of this chunk were stored without a vector
+                        metadata = dict(metadata, duplicate_sources=duplicate_sources[chunk_id])
+                # Indexes built before the chunk store keep their texts in the vector store
+                if text is not None:
+                    documents.append((Document(page_content=text, metadata=dict(metadata)), distance))
+            results.append(documents)
+        return results
+
+    def add_texts(self, texts, metadatas=None, ids=None):
         try:
             # Validate and clean the input data
             valid_texts = []
             valid_metadatas = []
+            valid_ids = [] if ids is not None else None
             for i, item in enumerate(texts):
                 if isinstance(item, tuple):
                     text, metadata = item
@@ -64,6 +145,8 @@ class DBManager:
                 if text is not None and isinstance(text, str) and text.strip() != "":
                     valid_texts.append(text)
                     valid_metadatas.append(metadata)
+                    if ids is not None:
+                        valid_ids.append(ids[i])
                 else:
                     logger.warning(f"Skipping invalid text at index {i}")
 
@@ -71,64 +154,229 @@ class DBManager:
                 logger.warning("No valid texts to add to the database")
                 return
 
-            self.db.add_texts(valid_texts, metadatas=valid_metadatas)
-            self.db.persist()
+            embeddings, plan = self._embed(valid_texts)
+            with self._write_transaction(valid_texts, embeddings, plan):
+                self._write_chunks(valid_ids, valid_texts, valid_metadatas, embeddings, plan)
             logger.info(f"Added {len(valid_texts)} texts to the database and persisted changes")
         except Exception as e:
             logger.error(f"Error adding texts to database: {str(e)}")
             raise
 
+    def _embed(self, texts, replacing=None):
+        """Embed the chunk texts that are not near-duplicates; returns their embeddings and the DedupPlan, if any.
+
+        Chunks of `replacing`, a source about to be removed, do not count as
+        stored copies.
+        """
+        plan = self.dedup.classify(texts, exclude_source=replacing) if self.dedup else None
+        unique = [texts[j] for j in plan.unique] if plan else texts
+        embeddings = list(self.embeddings.embed_documents(unique)) if unique else []
+        if plan and len(unique) < len(texts):
+            logger.info(f"Skipped embedding {len(texts) - len(unique)} of {len(texts)} near-duplicate chunks")
+        return embeddings, plan
+
+    @contextmanager
+    def _write_transaction(self, texts=(), embeddings=None, plan=None, removing=None, promoted=None):
+        """A registry transaction entered once everything written in it is embedded.
+
+        The model runs outside the transaction, so the registry is not locked
+        meanwhile. Texts of `plan` whose stored canonical chunk was removed
+        since they were classified are embedded (updating `embeddings` and
+        `plan` in place), as are the chunks removing the source `removing`
+        would promote to canonical (added to `promoted`), and the
+        transaction is entered again.
+        """
+        while True:
+            with self.sources.transaction():
+                lost = self.dedup.lost(plan) if plan else []
+                heads = [group[0] for group in self.dedup.orphans(removing)
+                         if group[0] not in promoted] if self.dedup and removing else []
+                if not lost and not heads:
+                    yield
+                    return
+            if lost:
+                embeddings[:] = plan.make_canonical(lost, embeddings, self.embeddings.embed_documents([texts[j] for j in lost]))
+            if heads:
+                found = [(head, chunk) for head, chunk in zip(heads, self.chunks.get(heads)) if chunk is not None]
+                vectors = self.embeddings.embed_documents([text for _, (text, _) in found]) if found else []
+                promoted.update({head: None for head in heads})
+                promoted.update({head: (chunk, vector) for (head, chunk), vector in zip(found, vectors)})
+
+    def _write_chunks(self, ids, texts, metadatas, embeddings, plan=None):
+        """Store chunks, and vectors for those `plan` did not find to be near-duplicates.
 
+        Call inside a `_write_transaction` for the same `plan`.
+        """
+        try:
+            with self.sources.transaction():
+                chunk_ids = self.chunks.append(texts, metadatas)
+                sources = [(metadata or {}).get("source", "") for metadata in metadatas]
+                keep = plan.unique if plan else list(range(len(texts)))
+                if plan:
+                    self.dedup.record(plan, chunk_ids, sources)
+                if keep:
+                    vector_metadatas = [dict(metadatas[j] or {}, chunk=chunk_ids[j]) for j in keep]
+                    self.store.upsert([ids[j] for j in keep] if ids else None, embeddings, None, vector_metadatas)
+                self.sources.add_chunks(Counter(sources))
+        finally:
+            # Changed after the write, so results cached while it ran are not reused
+            self.generation = next(_generations)
+
+    def _promote(self, groups, promoted):
+        """Give each group of orphaned near-duplicates a new canonical chunk, its first one.
+
+        `promoted` maps each first chunk to its `((text, metadata), embedding)`,
+        or to None if it no longer exists; see `_write_transaction`.
+        """
+        heads = [(group, promoted[group[0]]) for group in groups if promoted[group[0]] is not None]
+        if not heads:
+            return
+        self.store.upsert(None, [embedding for _, (_, embedding) in heads], None,
+                          [dict(metadata, chunk=group[0]) for group, ((_, metadata), _) in heads])
+        for group, ((text, metadata), _) in heads:
+            self.dedup.promote(group[0], metadata.get("source", ""), text, group[1:])
+        logger.info(f"Promoted {len(heads)} near-duplicate chunks whose canonical chunk was removed")
+
+    def dedup_stats(self):
+        """How many stored chunks are near-duplicates kept without a vector."""
+        chunks = self.chunks.count()
+        duplicates = self.dedup.count() if self.dedup else 0
+        return {
+            "enabled": self.dedup is not None,
+            "chunks": chunks,
+            "duplicates": duplicates,
+            "ratio": round(duplicates / chunks, 4) if chunks else 0.0,
+        }
 
     def get_all_sources(self):
         try:
-            results = self.db.get()
-            if results and 'metadatas' in results:
-                sources = set(meta.get('source', '') for meta in results['metadatas'] if meta and 'source' in meta)
+            if not self.sources.is_empty() or not self.store.count():
+                sources = self.sources.sources()
             else:
-                sources = set()
+                # An index built before the chunk store
+                sources = self.store.list_sources()
             logger.debug(f"All sources in database: {sources}")
             return sources
         except Exception as e:
             logger.error(f"Error getting all sources: {str(e)}")
             return set()
 
+    def get_source_files(self):
+        """Return `{source: (size, mtime, content_hash)}` as recorded when each source was ingested."""
+        return self.sources.files()
+
+    def _prepare_chunks(self, source, chunks):
+        # Chunks are texts or (text, metadata) pairs, as DocumentProcessor returns them
+        chunks = [item if isinstance(item, tuple) else (item, {}) for item in chunks]
+        return [(text, dict(metadata or {}, source=source)) for text, metadata in chunks
+                if isinstance(text, str) and text.strip()]
+
+    def index_source(self, source, chunks, size=None, mtime=None, content_hash=None):
+        """Replace the chunks of `source` and record the file they came from, in one transaction."""
+        chunks = self._prepare_chunks(source, chunks)
+        texts = [text for text, _ in chunks]
+        # Embed before the transaction, so the registry is not locked while the model runs
+        embeddings, plan = self._embed(texts, replacing=source) if texts else ([], None)
+        promoted = {}
+        try:
+            with self._write_transaction(texts, embeddings, plan, removing=source, promoted=promoted):
+                self.remove_documents({"source": source}, promoted)
+                if texts:
+                    self._write_chunks(None, texts, [metadata for _, metadata in chunks], embeddings, plan)
+                self.sources.record_file(source, size, mtime, content_hash)
+            logger.info(f"Indexed {len(texts)} chunks for source: {source}")
+        except Exception as e:
+            logger.error(f"Error indexing source {source}: {str(e)}")
+            raise
+
+    def ingest_source(self, source, chunks, journal, batch_size=256, size=None, mtime=None, content_hash=None):
+        """Add the chunks of `source` batch by batch, resuming after the batches `journal` has committed.
+
+        Used when building a new index, where a partly ingested file is not
+        visible to queries. Each batch is embedded, then written together with
+        its journal entry. Leftovers of a batch that was interrupted before it
+        committed, or of an older version of the file, are removed first.
+        """
+        chunks = self._prepare_chunks(source, chunks)
+        progress = journal.progress(source) or {"batches": 0, "chunks": 0, "content_hash": None}
+        # A crash inside a batch, even the first, leaves chunks the journal never counted
+        if (self.chunks.count(source) != progress["chunks"]
+                or progress["batches"] and progress["content_hash"] != content_hash):
+            logger.info(f"Discarding partly ingested chunks of {source}")
+            self.remove_documents({"source": source})
+            journal.reset(source)
+            progress = {"batches": 0, "chunks": 0}
+        elif progress["batches"]:
+            logger.info(f"Resuming {source} after {progress['batches']} committed batches")
+
+        try:
+            for start in range(progress["batches"] * batch_size, len(chunks), batch_size):
+                batch = chunks[start:start + batch_size]
+                texts = [text for text, _ in batch]
+                embeddings, plan = self._embed(texts)
+                with self._write_transaction(texts, embeddings, plan):
+                    self._write_chunks(None, texts, [metadata for _, metadata in batch], embeddings, plan)
+                    journal.batch_committed(source, len(batch), content_hash)
+            with self.sources.transaction():
+                self.sources.record_file(source, size, mtime, content_hash)
+                journal.file_committed(source)
+        except Exception as e:
+            logger.error(f"Error ingesting source {source}: {str(e)}")
+            raise
+        return len(chunks)
+
+    def count(self):
+        return self.store.count()
+
     def clear_database(self):
         logger.info("Clearing database...")
         try:
-            all_ids = self.db.get()['ids']
-            
-            if all_ids:
-                self.db._collection.delete(ids=all_ids)
-                self.db.persist()
-                logger.info(f"Deleted {len(all_ids)} documents from the database")
-            else:
-                logger.info("No documents to delete. Database is already empty.")
-            
+            try:
+                with self.sources.transaction():
+                    self.store.clear()
+                    self.chunks.clear()
+                    self.sources.clear()
+                    if self.dedup:
+                        self.dedup.clear()
+            finally:
+                self.generation = next(_generations)
             logger.info("Database cleared and changes persisted")
         except Exception as e:
             logger.error(f"Error clearing database: {str(e)}")
             raise
-    
-    def remove_documents(self, metadata_filter):
+
+    def remove_documents(self, metadata_filter, promoted=None):
+        """Remove a source's chunks; `promoted` passes chunks already embedded for promotion, see `_promote`."""
+        promoted = {} if promoted is None else promoted
         try:
-            self.db._collection.delete(where=metadata_filter)
-            self.db.persist()
+            try:
+                with self._write_transaction(removing=metadata_filter["source"], promoted=promoted):
+                    orphans = self.dedup.remove_source(metadata_filter["source"]) if self.dedup else []
+                    # Looked up in the chunk store, so the vector store need not scan its metadata
+                    self.store.delete_chunks(self.chunks.ids(metadata_filter["source"]), metadata_filter)
+                    self.chunks.delete(metadata_filter)
+                    self.sources.remove(metadata_filter["source"])
+                    if orphans:
+                        # Other files' copies of this file's chunks need a vector now
+                        self._promote(orphans, promoted)
+            finally:
+                self.generation = next(_generations)
             logger.info(f"Documents removed with filter: {metadata_filter} and changes persisted")
-            # Reload the database to ensure it's up to date
-            self.db = self._load_or_create_db()
         except Exception as e:
             logger.error(f"Error removing documents: {str(e)}")
             raise
 
+    def close(self):
+        """Release the index's files and connections; they are reopened if it is used again."""
+        self.store.close()
+        self.chunks.close()
+        self.sources.close()
+
     def recreate_database(self):
         logger.info("Recreating database...")
         try:
-            # Clear existing database
             self.clear_database()
-            # Create a new database instance
-            self.db = self._load_or_create_db()
             logger.info("Database recreated successfully")
         except Exception as e:
             logger.error(f"Error recreating database: {str(e)}")
-            raise
\ No newline at end of file
+            raise
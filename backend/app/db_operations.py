@@ -1,46 +1,316 @@
 # File: backend/app/db_operations.py
 
 import os
+import time
 import logging
-from .utils import is_valid_document
+from .conf import config
+from .scanner import scan_documents
+from .utils import content_hash
+from .ingest_queue import ingest_queue, INDEX, REMOVE, RECONCILE
 
 logger = logging.getLogger(__name__)
 
-def get_document_processor(documents_dir):
+def get_document_processor(documents_dir, cache_dir=None, chunk_size=None, chunk_overlap=None):
     from .document_processor import DocumentProcessor
-    return DocumentProcessor(documents_dir)
+    text_cache = None
+    if cache_dir and config.get("text_cache", True):
+        from .text_cache import TextCache
+        text_cache = TextCache(cache_dir, max_bytes=config.get("text_cache_mb", 512) * 1024 * 1024)
+    return DocumentProcessor(documents_dir,
+                             chunk_size=chunk_size or config.get("chunk_size", 1000),
+                             chunk_overlap=chunk_overlap if chunk_overlap is not None else config.get("chunk_overlap", 200),
+                             text_cache=text_cache,
+                             fatturapa=config.get("fatturapa_extractor", True))
 
-def get_db_manager(db_dir):
+def get_db_manager(db_dir, embeddings=None, backend=None, vector_dtype=None):
+    """Open the index in `db_dir`; the vector backend and dtype default to the current settings."""
     from .db_manager import DBManager
-    return DBManager(db_dir)
+    return DBManager(db_dir, embeddings,
+                     backend=backend or config.get("vector_backend", "chroma"),
+                     vector_dtype=vector_dtype or config.get("vector_dtype", "float16"),
+                     chunk_compression=config.get("chunk_compression"),
+                     dedup_threshold=config.get("dedup_threshold", 0.9) if config.get("dedup", True) else None)
 
-def cleanup_database(db_manager, document_processor, documents_dir):
+def find_documents(documents_dir):
+    """Return the set of document sources (paths relative to `documents_dir`), recursively."""
+    return set(scan_documents(documents_dir, workers=config.get("scan_workers", 0)))
+
+def index_file(db_manager, document_processor, documents_dir, source, stat=None, journal=None):
+    """Chunk one document and replace its chunks in the database; returns the chunk count.
+
+    `stat` is the `(size, mtime)` pair from a folder scan, if there was one.
+    With an ingestion `journal`, as when building a new index version, the
+    chunks are added in resumable batches instead of in one transaction.
+    """
+    path = os.path.join(documents_dir, source)
+    if stat is None:
+        st = os.stat(path)
+        stat = (st.st_size, st.st_mtime)
+    digest = content_hash(path)
+    chunks = document_processor.process_file(source, content_hash=digest)
+    if journal is not None:
+        return db_manager.ingest_source(source, chunks, journal, batch_size=config.get("ingest_batch_size", 256),
+                                        size=stat[0], mtime=stat[1], content_hash=digest)
+    db_manager.index_source(source, chunks, size=stat[0], mtime=stat[1], content_hash=digest)
+    return len(chunks)
+
+def diff_sources(current, indexed):
+    """Compare a folder scan with the source registry.
+
+    `current` maps sources to `(size, mtime)`, `indexed` maps them to
+    `(size, mtime, content_hash)`. Returns the sets of added, removed and
+    possibly changed sources; a changed size or mtime is enough to be listed.
+    """
+    added = set(current) - set(indexed)
+    removed = set(indexed) - set(current)
+    changed = set(source for source in set(current) & set(indexed)
+                  if tuple(current[source]) != tuple(indexed[source][:2]))
+    return added, removed, changed
+
+def rebuild_database(db_manager, document_processor, documents_dir, files, job=None):
+    """Recreate the database in place and index `files`, reporting progress on `job`.
+
+    `files` is a set of sources or a scan result mapping them to `(size, mtime)`.
+    Queries against `db_manager` see a partial index until this returns;
+    folders are rebuilt with migrate_index, which builds a new version instead.
+    """
+    stats = files if isinstance(files, dict) else {}
+    files = sorted(files)
+    if job:
+        job.set_total(len(files))
+        job.check_cancelled()
+
+    db_manager.recreate_database()
+
+    for file in files:
+        if job:
+            job.check_cancelled()
+            job.file_started(file)
+        logger.info(f"Adding document to database: {file}")
+        chunks = index_file(db_manager, document_processor, documents_dir, file, stats.get(file))
+        if job:
+            job.file_done(chunks)
+
+def needs_rebuild(db_manager):
+    """True for an index built before the source registry existed, which has nothing to diff against."""
+    return not db_manager.get_source_files() and db_manager.count() > 0
+
+def refresh_folder(context, job=None):
+    """Bring a folder's active index in line with its documents.
+
+    An index that cannot be updated incrementally is rebuilt as a new
+    version, so queries keep being answered from the old one meanwhile.
+    """
+    interrupted = context.versions.interrupted()
+    if interrupted:
+        logger.info(f"Resuming the interrupted build of index version {interrupted}")
+        migrate_index(context, job, version=interrupted)
+        if not context.embedding_mismatch() and not context.store_mismatch() and not context.chunking_mismatch():
+            return
+    if needs_rebuild(context.db_manager):
+        logger.info("Database has no source registry. Rebuilding it as a new index version...")
+        migrate_index(context, job)
+        return
+    if context.store_mismatch():
+        # An index cannot be read by another backend; opening it with one would look empty
+        backend, vector_dtype = context.store_for(context.version)
+        logger.info(f"Index version {context.version} is stored with {backend} ({vector_dtype}), not the configured "
+                    f"{config.get('vector_backend', 'chroma')}. Rebuilding it as a new index version...")
+        migrate_index(context, job)
+        return
+    if context.embedding_mismatch():
+        # Vectors of different models or sizes cannot be mixed in one index
+        model, dimensions = context.embeddings.spec
+        logger.info(f"Index version {context.version} was built with other embeddings than {model} "
+                    f"at {dimensions or 'full'} dimensions. Rebuilding it as a new index version...")
+        migrate_index(context, job)
+        return
+    if context.chunking_mismatch():
+        # Chunks from another chunker would be mixed with this one's as files change
+        logger.info(f"Index version {context.version} was chunked by an older chunker. Rebuilding it as a new index version...")
+        migrate_index(context, job)
+        return
+    if not ingest_queue.attached:
+        cleanup_database(context.db_manager, context.document_processor, context.path, job)
+        return
+
+    logger.info("Starting folder refresh")
+    current_files = scan_documents(context.path, workers=config.get("scan_workers", 0))
+    removed, to_index = plan_cleanup(context.db_manager, context.path, current_files)
+    if job:
+        job.set_total(len(to_index))
+        job.check_cancelled()
+
+    # Queued behind interactive and watcher work, so new files stay quick to appear
+    tasks = [ingest_queue.submit(context.path, source, REMOVE, RECONCILE) for source in removed]
+    callback = (lambda task: job.file_done(task.chunks)) if job else None
+    tasks += [ingest_queue.submit(context.path, source, INDEX, RECONCILE, callback=callback) for source in to_index]
+    ingest_queue.wait(tasks, job, priority=RECONCILE, callback=callback)
+    failed = [task for task in tasks if task.error]
+    if failed:
+        raise RuntimeError(f"{len(failed)} of {len(tasks)} documents could not be updated, "
+                           f"e.g. {failed[0].source}: {failed[0].error}")
+    logger.info("Folder refresh completed.")
+
+def plan_cleanup(db_manager, documents_dir, current_files):
+    """Diff a folder scan with the source registry; returns the sources to remove and to (re)index.
+
+    Touched files whose content did not change only get their registry row updated.
+    """
+    indexed_files = db_manager.get_source_files()
+    added, removed, changed = diff_sources(current_files, indexed_files)
+    logger.info(f"Folder diff: {len(added)} added, {len(removed)} removed, {len(changed)} with a new size or mtime")
+
+    to_index = sorted(added)
+    for source in sorted(changed):
+        # A touched file with the same content only needs its registry row updated
+        size, mtime = current_files[source]
+        path = os.path.join(documents_dir, source)
+        if content_hash(path) == indexed_files[source][2]:
+            db_manager.sources.record_file(source, size, mtime, indexed_files[source][2])
+        else:
+            to_index.append(source)
+    return sorted(removed), to_index
+
+def cleanup_database(db_manager, document_processor, documents_dir, job=None):
+    """Bring the database in line with the folder, reindexing only what changed."""
     logger.info("Starting database cleanup")
-    try:
-        current_files = set(f for f in os.listdir(documents_dir) 
-                            if os.path.isfile(os.path.join(documents_dir, f)) and is_valid_document(f))
-        db_documents = db_manager.get_all_sources()
-        
-        logger.debug(f"Current files in documents directory: {current_files}")
-        logger.debug(f"Documents in database before cleanup: {db_documents}")
-
-        # If there's any mismatch between files and database, recreate the database
-        if current_files != db_documents:
-            logger.info("Mismatch detected. Recreating database...")
-            db_manager.recreate_database()
-            
-            # Add all current documents to the new database
-            for file in current_files:
-                logger.info(f"Adding document to database: {file}")
-                file_path = os.path.join(documents_dir, file)
-                chunks = document_processor.process_file(file)
-                metadata = [{"source": file} for _ in chunks]
-                db_manager.add_texts(chunks, metadata)
-        
-        # Verify the database state after cleanup
-        final_db_documents = db_manager.get_all_sources()
-        logger.debug(f"Documents in database after cleanup: {final_db_documents}")
-        
+    current_files = scan_documents(documents_dir, workers=config.get("scan_workers", 0))
+
+    if needs_rebuild(db_manager):
+        logger.info("Database has no source registry. Recreating database...")
+        rebuild_database(db_manager, document_processor, documents_dir, current_files, job)
         logger.info("Database cleanup completed.")
-    except Exception as e:
-        logger.error(f"Error during database cleanup: {str(e)}", exc_info=True)
\ No newline at end of file
+        return
+
+    removed, to_index = plan_cleanup(db_manager, documents_dir, current_files)
+    if job:
+        job.set_total(len(to_index))
+        job.check_cancelled()
+
+    for source in removed:
+        logger.info(f"Removing document from database: {source}")
+        db_manager.remove_documents({"source": source})
+
+    for source in to_index:
+        if job:
+            job.check_cancelled()
+            job.file_started(source)
+        logger.info(f"Indexing document: {source}")
+        chunks = index_file(db_manager, document_processor, documents_dir, source, current_files[source])
+        if job:
+            job.file_done(chunks)
+
+    logger.info("Database cleanup completed.")
+
+def verify_index(db_manager, files):
+    """Check that a built index is complete and self-consistent; returns its counts.
+
+    Every file in `files` must have been ingested, and the chunk store and
+    the source registry must agree on the chunk count, with one vector per
+    chunk that is not a near-duplicate.
+    """
+    sources = db_manager.sources.list()
+    counts = {
+        "files": len(sources),
+        "vectors": db_manager.count(),
+        "chunks": db_manager.chunks.count(),
+        "duplicates": db_manager.dedup.count() if db_manager.dedup else 0,
+        "registry_chunks": sum(row["chunks"] or 0 for row in sources),
+    }
+    missing = set(files) - set(row["source"] for row in sources)
+    if missing:
+        raise RuntimeError(f"{len(missing)} files were not indexed, e.g. {sorted(missing)[0]}")
+    if not counts["vectors"] + counts["duplicates"] == counts["chunks"] == counts["registry_chunks"]:
+        raise RuntimeError(f"Index counts do not match: {counts}")
+    return counts
+
+def migrate_index(context, job=None, throttle=None, keep=None, version=None):
+    """Build a new index version of a folder from its documents, then switch queries to it.
+
+    The version is built with the current chunking and embedding settings
+    while the active one keeps serving queries. After each file the build sleeps
+    `throttle` times as long as the file took, leaving the embedding model
+    and CPU to interactive use. Progress is kept in an ingestion journal, and
+    passing an interrupted build's `version` resumes it after its last
+    committed batch. Files changed during the build are picked up by a final
+    incremental pass; the counts are then verified and the new version is
+    activated atomically. The `keep` most recent previous versions are kept
+    for rollback. A failed or cancelled build is deleted and the active
+    version is left untouched. `throttle` and `keep` default to the
+    migration_throttle and index_versions_keep settings.
+    """
+    from .ingest_journal import IngestJournal, COMMITTED
+    from .document_processor import CHUNKING_VERSION
+    throttle = config.get("migration_throttle", 0.5) if throttle is None else throttle
+    keep = config.get("index_versions_keep", 1) if keep is None else keep
+    versions = context.versions
+    if version is None:
+        model, dimensions = context.embeddings.spec
+        params = {
+            "chunk_size": config.get("chunk_size", 1000),
+            "chunk_overlap": config.get("chunk_overlap", 200),
+            "chunking": CHUNKING_VERSION,
+            "embedding_model": model,
+            "embedding_dimensions": dimensions,
+            "vector_backend": config.get("vector_backend", "chroma"),
+            "vector_dtype": config.get("vector_dtype", "float16"),
+        }
+        name = versions.create(params)
+    else:
+        name = version
+        params = versions.manifest(name).get("params", {})
+    db_manager = None
+    try:
+        db_manager = get_db_manager(versions.path(name), context.embeddings_for(name), *context.store_for(name))
+        document_processor = get_document_processor(context.path, context.text_cache_dir,
+                                                    params.get("chunk_size"), params.get("chunk_overlap"))
+        journal = IngestJournal(db_manager.sources)
+        files = scan_documents(context.path, workers=config.get("scan_workers", 0))
+        journal.plan(sorted(files))
+        if job:
+            job.set_total(len(files))
+        for source in sorted(files):
+            if job:
+                job.check_cancelled()
+            progress = journal.progress(source)
+            if progress and progress["state"] == COMMITTED:
+                # Committed before an interruption; changes since are picked up by the final pass
+                if job:
+                    job.file_done(progress["chunks"])
+                continue
+            if job:
+                job.file_started(source)
+            started = time.time()
+            chunks = index_file(db_manager, document_processor, context.path, source, files[source], journal)
+            if job:
+                job.file_done(chunks)
+            if throttle:
+                time.sleep((time.time() - started) * throttle)
+
+        logger.info(f"Index version {name} built, catching up with changes made during the build")
+        cleanup_database(db_manager, document_processor, context.path)
+        counts = verify_index(db_manager, find_documents(context.path))
+        journal.clear()
+        versions.update_manifest(name, status="ready", built_at=time.time(), counts=counts)
+    except (KeyboardInterrupt, SystemExit):
+        # The journal lets the next start resume this build
+        raise
+    except BaseException as e:
+        logger.error(f"Building index version {name} failed: {str(e)}")
+        if db_manager is not None:
+            db_manager.close()
+        versions.remove(name)
+        raise
+
+    context.swap(name, db_manager, document_processor)
+    removed = versions.gc(keep, in_use=context.open_versions())
+    if removed:
+        logger.info(f"Garbage-collected index versions: {', '.join(removed)}")
+    return name
+
+def reset_and_rescan(context, job=None):
+    """Rebuild a folder's index from scratch, swapping it in once complete."""
+    logger.info("Starting reset and rescan")
+    version = migrate_index(context, job)
+    logger.info(f"Reset and rescan completed, now serving index version {version}.")
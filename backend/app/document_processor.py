@@ -1,112 +1,233 @@
 import os
-import pdfplumber
 import xml.etree.ElementTree as ET
-from typing import List, Dict, Tuple
+from typing import Dict, Iterable, List, Tuple
+from .utils import relative_source
+from .fatturapa import is_fatturapa, extract_documents, chunk_documents
+
+# Changes whenever the same text and settings start producing other chunks;
+# index versions record it and are rebuilt when it differs.
+# 2: chunk_overlap is counted in characters rather than words.
+# 3: FatturaPA invoices get per-record chunks.
+CHUNKING_VERSION = 3
 
 class DocumentProcessor:
-    def __init__(self, documents_dir, chunk_size=1000, chunk_overlap=200):
+    def __init__(self, documents_dir, chunk_size=1000, chunk_overlap=200, text_cache=None, fatturapa=True):
         self.documents_dir = documents_dir
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
+        self.text_cache = text_cache
+        # FatturaPA invoices get compact per-record chunks instead of the generic XML path
+        self.fatturapa = fatturapa
 
     
-    def process_file(self, file_name):
+    def process_file(self, file_name, content_hash=None):
+        """Process a file based on its extension.
+
+        `file_name` is either a source path relative to the documents folder or
+        an absolute path inside it; chunks are tagged with the relative source.
+        With a text cache and the file's `content_hash`, the extracted text is
+        read from the cache when present and stored there otherwise, so only
+        chunking runs again.
+        """
         file_path = os.path.join(self.documents_dir, file_name)
-        """Process a file based on its extension."""
+        source = relative_source(file_path, self.documents_dir)
         _, ext = os.path.splitext(file_path)
-        if ext.lower() == '.pdf':
-            return self.process_pdf(file_path)
-        elif ext.lower() == '.xml':
-            return self.process_xml(file_path)
-        else:
+        kind = ext.lower().lstrip('.')
+        if kind not in ('pdf', 'xml'):
             raise ValueError(f"Unsupported file type: {ext}")
-
-    def process_pdf(self, file_path):
-        """Process a PDF file and return a list of text chunks with metadata."""
+        if kind == 'xml' and self.fatturapa and is_fatturapa(file_path):
+            kind = 'fatturapa'
+        if self.text_cache is None or not content_hash:
+            if kind == 'pdf':
+                return self.process_pdf(file_path, source)
+            if kind == 'fatturapa':
+                return self.process_fatturapa(file_path, source)
+            return self.process_xml(file_path, source)
+
+        records = self.text_cache.get(content_hash, kind)
+        if records is None:
+            extract = {'pdf': self.extract_pdf, 'xml': self.extract_xml, 'fatturapa': self.extract_fatturapa}[kind]
+            records = extract(file_path)
+            self.text_cache.put(content_hash, kind, records)
+        if kind == 'pdf':
+            return self.split_text("\n".join(records), source)
+        if kind == 'fatturapa':
+            return self.split_invoices(records, source)
+        return self.split_records(records, source)
+
+    def extract_pdf(self, file_path):
+        """Return the text of each page of a PDF, with whitespace normalized per line."""
         if not os.path.exists(file_path):
             raise FileNotFoundError(f"File not found: {file_path}")
 
+        import pdfplumber
+        pages = []
         with pdfplumber.open(file_path) as pdf:
-            text = ""
             for page in pdf.pages:
-                text += page.extract_text() + "\n"
-
-        return self.split_text(text, os.path.basename(file_path))
+                lines = (' '.join(line.split()) for line in (page.extract_text() or "").splitlines())
+                pages.append("\n".join(line for line in lines if line))
+        return pages
 
-    def process_xml(self, file_path):
-        """Process any XML file and return a list of text chunks with metadata."""
+    def extract_xml(self, file_path):
+        """Return the formatted records of an XML file, with whitespace normalized."""
         if not os.path.exists(file_path):
             raise FileNotFoundError(f"File not found: {file_path}")
 
         try:
-            tree = ET.parse(file_path)
-            root = tree.getroot()
-
-            flattened_data = self._flatten_xml(root)
-            formatted_text = self._format_flattened_data(flattened_data)
-            return self.split_text(formatted_text, os.path.basename(file_path))
+            records = (' '.join(record.split()) for record in self.iter_xml_records(file_path))
+            return [record for record in records if record]
         except ET.ParseError as e:
             raise ValueError(f"Error parsing XML file {file_path}: {str(e)}")
 
-    def _flatten_xml(self, element, parent_path=''):
-        """Recursively flatten XML into a dictionary of key-value pairs."""
-        items = {}
-        for child in element:
-            child_path = f"{parent_path}/{self._strip_namespace(child.tag)}" if parent_path else self._strip_namespace(child.tag)
-            if len(child) == 0:
-                items[child_path] = child.text.strip() if child.text else ''
-            else:
-                items.update(self._flatten_xml(child, child_path))
-        return items
+    def extract_fatturapa(self, file_path):
+        """Return the invoices of a FatturaPA file: header record, identity and lines of each."""
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(f"File not found: {file_path}")
 
-    def _strip_namespace(self, tag):
-        return tag.split('}')[-1] if '}' in tag else tag
+        try:
+            return extract_documents(file_path)
+        except ET.ParseError as e:
+            raise ValueError(f"Error parsing XML file {file_path}: {str(e)}")
 
-    def _format_flattened_data(self, data: Dict[str, str]) -> str:
-        """Format flattened data into the desired compact output format."""
-        formatted_output = []
-        current_group = None
-        current_group_data = {}
+    def process_pdf(self, file_path, source=None):
+        """Process a PDF file and return a list of text chunks with metadata."""
+        text = "\n".join(self.extract_pdf(file_path))
+        return self.split_text(text, source or os.path.basename(file_path))
+
+    def process_xml(self, file_path, source=None):
+        """Process any XML file and return a list of text chunks with metadata."""
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(f"File not found: {file_path}")
 
-        for key, value in data.items():
-            parts = key.split('/')
-            group = parts[-2] if len(parts) > 1 else 'root'
-            subkey = parts[-1]
+        try:
+            records = self.iter_xml_records(file_path)
+            return self.split_records(records, source or os.path.basename(file_path))
+        except ET.ParseError as e:
+            raise ValueError(f"Error parsing XML file {file_path}: {str(e)}")
 
-            if group != current_group:
-                if current_group_data:
-                    formatted_output.append(self._format_group(current_group, current_group_data))
-                current_group = group
-                current_group_data = {}
+    def process_fatturapa(self, file_path, source=None):
+        """Process a FatturaPA invoice file into one chunk per header and per group of lines."""
+        return self.split_invoices(self.extract_fatturapa(file_path), source or os.path.basename(file_path))
+
+    def split_invoices(self, documents, source_file: str) -> List[Tuple[str, Dict]]:
+        """Chunk extracted invoices, adding the source and chunk index to their typed metadata."""
+        return [(text, dict(metadata, source=source_file, chunk_index=i))
+                for i, (text, metadata) in enumerate(chunk_documents(documents, self.chunk_size))]
+
+    def iter_xml_records(self, file_path):
+        """Stream an XML file and yield one formatted record per element group.
+
+        Each element that has child elements is a group; its leaf children are
+        emitted as "group: key: value ..." when the group closes, so nested
+        groups come before their parent's own fields. Repeated siblings (e.g.
+        FatturaPA DettaglioLinee) each produce their own record instead of
+        overwriting each other. A group is detached from its parent as soon
+        as it is emitted, so memory stays bounded on multi-hundred-MB exports
+        whatever their record count.
+        """
+        names = {}
+
+        def name(tag):
+            local = names.get(tag)
+            if local is None:
+                local = names[tag] = self._strip_namespace(tag)
+            return local
+
+        # The open elements, root first
+        path = []
+        for event, elem in ET.iterparse(file_path, events=("start", "end")):
+            if event == "start":
+                path.append(elem)
+                continue
+            path.pop()
+            if len(elem) == 0:
+                # A leaf stays with its group until the group closes
+                continue
+            # A group has just closed. Its nested groups were already emitted
+            # and detached, so only its own leaves are left.
+            fields = []
+            for child in elem:
+                text = child.text
+                if text and len(child) == 0:
+                    text = text.strip()
+                    if text:
+                        fields.append((name(child.tag), text))
+            if fields:
+                # The root's own fields are not prefixed with its name
+                yield self._format_record(name(elem.tag), fields, not path)
+            if path:
+                # The parser reads ahead, so later siblings may already be attached;
+                # the earlier ones are leaves, the groups having been detached.
+                path[-1].remove(elem)
+
+    def _format_record(self, group, fields, is_root):
+        body = ' '.join(f"{k}: {v}" for k, v in fields)
+        return body if is_root else f"{group}: {body}"
 
-            if value is not None and value.strip() != "":
-                current_group_data[subkey] = value
+    def _strip_namespace(self, tag):
+        return tag.split('}')[-1] if '}' in tag else tag
 
-        if current_group_data:
-            formatted_output.append(self._format_group(current_group, current_group_data))
+    def split_records(self, records: Iterable[str], source_file: str) -> List[Tuple[str, Dict]]:
+        """Pack whole records into chunks of up to chunk_size characters.
 
-        return ' '.join(formatted_output)
+        A record is only split when it is longer than chunk_size on its own,
+        so repeated XML records are never cut in the middle.
+        """
+        chunks = []
+        current = []
+        current_len = 0
+
+        def flush():
+            if current:
+                chunks.append((' '.join(current), {"source": source_file, "chunk_index": len(chunks)}))
+
+        for record in records:
+            record = ' '.join(record.split())
+            if not record:
+                continue
+            if len(record) > self.chunk_size:
+                flush()
+                current, current_len = [], 0
+                for chunk_text, _ in self.split_text(record, source_file):
+                    chunks.append((chunk_text, {"source": source_file, "chunk_index": len(chunks)}))
+                continue
+            if current and current_len + 1 + len(record) > self.chunk_size:
+                flush()
+                current, current_len = [], 0
+            current_len += len(record) + (1 if current else 0)
+            current.append(record)
 
-    def _format_group(self, group: str, data: Dict[str, str]) -> str:
-        """Format a group of related data into a string."""
-        if group == 'root':
-            return ' '.join(f"{k}: {v}" for k, v in data.items())
-        return f"{group}: " + ' '.join(f"{k}: {v}" for k, v in data.items())
+        flush()
+        return chunks
 
     def split_text(self, text: str, source_file: str) -> List[Tuple[str, Dict]]:
         """Split the text into chunks with metadata."""
         chunks = []
         words = text.split()
         current_chunk = []
+        # Length of ' '.join(current_chunk), tracked incrementally
+        current_len = -1
 
         for i, word in enumerate(words):
-            if len(' '.join(current_chunk)) + len(word) > self.chunk_size and current_chunk:
+            if current_len + len(word) > self.chunk_size and current_chunk:
                 chunk_text = ' '.join(current_chunk)
                 if chunk_text.strip():  # Only add non-empty chunks
                     chunks.append((chunk_text, {"source": source_file, "chunk_index": len(chunks)}))
-                overlap_start = max(0, len(current_chunk) - self.chunk_overlap)
-                current_chunk = current_chunk[overlap_start:]
+                # Carry over trailing words up to chunk_overlap characters (see
+                # CHUNKING_VERSION). Counted in words, the default 200 exceeded a
+                # whole 1000-character chunk and every following word emitted a
+                # new chunk.
+                overlap = []
+                overlap_len = -1
+                for w in reversed(current_chunk):
+                    if overlap_len + len(w) + 1 > self.chunk_overlap:
+                        break
+                    overlap.append(w)
+                    overlap_len += len(w) + 1
+                current_chunk = overlap[::-1]
+                current_len = overlap_len
             current_chunk.append(word)
+            current_len += len(word) + 1
 
         if current_chunk:
             chunk_text = ' '.join(current_chunk)
@@ -0,0 +1,89 @@
+# File: backend/app/embeddings.py
+
+import asyncio
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = "nomic-embed-text"
+
+
+def get_embeddings(model=None, dimensions=None):
+    """The embeddings client for `model` (default: the embedding_model setting).
+
+    `dimensions` (default: the embedding_dimensions setting) truncates every
+    vector to its first `dimensions` components; None keeps the model's full
+    output.
+    """
+    from .conf import config
+    from langchain_community.embeddings import OllamaEmbeddings
+    model = model or config.get("embedding_model", DEFAULT_MODEL)
+    if dimensions is None:
+        dimensions = config.get("embedding_dimensions")
+    return EmbeddingModel(OllamaEmbeddings(model=model), model, dimensions)
+
+
+def index_spec(params):
+    """The `(model, dimensions)` an index was built with, from its version manifest params.
+
+    Indexes built before the embedding model was recorded used the default
+    model at full size.
+    """
+    return params.get("embedding_model") or DEFAULT_MODEL, params.get("embedding_dimensions")
+
+
+class EmbeddingModel:
+    """An embeddings client whose vectors are cut to a fixed number of dimensions.
+
+    Matryoshka-trained models such as nomic-embed-text put the most
+    information in the leading components, so a prefix of 256 or 512 of
+    them, renormalised to unit length, is a smaller embedding of the same
+    text rather than a broken one. Indexes built from truncated vectors take
+    proportionally less memory and are faster to search.
+    """
+
+    def __init__(self, client, model, dimensions=None):
+        if dimensions is not None and dimensions < 1:
+            raise ValueError(f"Embedding dimensions must be positive, got {dimensions}")
+        self.client = client
+        self.model = model
+        self.dimensions = dimensions
+
+    @property
+    def spec(self):
+        return self.model, self.dimensions
+
+    @property
+    def base_url(self):
+        return getattr(self.client, "base_url", None)
+
+    def truncate(self, vectors):
+        """Cut vectors to `dimensions` components and renormalise them; a single vector stays a list."""
+        if self.dimensions is None:
+            return vectors
+        array = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+        if array.size == 0:
+            return vectors
+        if array.shape[1] < self.dimensions:
+            raise ValueError(f"{self.model} returns {array.shape[1]} dimensions, fewer than the {self.dimensions} configured")
+        array = array[:, :self.dimensions]
+        norms = np.linalg.norm(array, axis=1, keepdims=True)
+        array = array / np.where(norms == 0, 1, norms)
+        return array[0].tolist() if np.ndim(vectors) == 1 else array.tolist()
+
+    def embed_query(self, text):
+        return self.truncate(self.client.embed_query(text))
+
+    def embed_documents(self, texts):
+        return self.truncate(self.client.embed_documents(texts)) if texts else []
+
+    async def aembed_query(self, text):
+        """Embed a query without blocking the event loop; cancelling the caller aborts the request."""
+        if self.base_url is None:
+            return self.truncate(await asyncio.to_thread(self.client.embed_query, text))
+        from .ollama_client import get_client
+        # Same prompt as OllamaEmbeddings.embed_query, so vectors match the synchronous path
+        instruction = getattr(self.client, "query_instruction", "") or ""
+        return self.truncate(await get_client(self.base_url).embed(self.model, f"{instruction}{text}"))
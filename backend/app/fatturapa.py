@@ -0,0 +1,276 @@
+# File: backend/app/fatturapa.py
+
+import xml.etree.ElementTree as ET
+import logging
+
+logger = logging.getLogger(__name__)
+
+# FatturaPA 1.2 (ordinaria and semplificata) and the older 1.1 namespace
+NAMESPACES = (
+    "http://ivaservizi.agenziaentrate.gov.it/docs/xsd/fatture/",
+    "http://www.fatturapa.gov.it/sdi/fatturapa/",
+)
+ROOT_TAGS = {"FatturaElettronica", "FatturaElettronicaSemplificata"}
+
+DOCUMENT_TYPES = {
+    "TD01": "Fattura",
+    "TD02": "Acconto su fattura",
+    "TD03": "Acconto su parcella",
+    "TD04": "Nota di credito",
+    "TD05": "Nota di debito",
+    "TD06": "Parcella",
+    "TD07": "Fattura semplificata",
+    "TD08": "Nota di credito semplificata",
+    "TD24": "Fattura differita",
+    "TD25": "Fattura differita",
+}
+
+
+def _local(tag):
+    return tag.rsplit("}", 1)[-1]
+
+
+def _namespace(tag):
+    return tag[1:].split("}", 1)[0] if tag.startswith("{") else ""
+
+
+def _find(elem, path):
+    """The first element at `path` (local names separated by "/") below `elem`, ignoring namespaces."""
+    for step in path.split("/"):
+        if elem is None:
+            return None
+        elem = next((child for child in elem if _local(child.tag) == step), None)
+    return elem
+
+
+def _findall(elem, name):
+    return [child for child in elem if _local(child.tag) == name] if elem is not None else []
+
+
+def _text(elem, path):
+    found = _find(elem, path)
+    if found is None or not found.text:
+        return None
+    return " ".join(found.text.split()) or None
+
+
+def _number(value):
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def is_fatturapa(file_path):
+    """True if the XML file's root element is a FatturaPA invoice in one of its namespaces."""
+    try:
+        for _, elem in ET.iterparse(file_path, events=("start",)):
+            return _local(elem.tag) in ROOT_TAGS and _namespace(elem.tag).startswith(NAMESPACES)
+    except ET.ParseError:
+        return False
+    return False
+
+
+def _party(elem):
+    """Name, VAT number and town of a CedentePrestatore or CessionarioCommittente."""
+    if elem is None:
+        return {}
+    # The semplificata schema nests these differently, or not at all
+    registry = _find(elem, "DatiAnagrafici")
+    registry = registry if registry is not None else elem
+    names = _find(registry, "Anagrafica")
+    if names is None:
+        names = _find(registry, "AltriDatiIdentificativi")
+    names = names if names is not None else registry
+    ids = _find(registry, "IdentificativiFiscali")
+    ids = ids if ids is not None else registry
+    name = _text(names, "Denominazione") or " ".join(filter(None, [_text(names, "Nome"), _text(names, "Cognome")])) or None
+    code = _text(ids, "IdFiscaleIVA/IdCodice")
+    vat = (_text(ids, "IdFiscaleIVA/IdPaese") or "") + code if code else None
+    town = _text(elem, "Sede/Comune") or _text(names, "Sede/Comune")
+    province = _text(elem, "Sede/Provincia") or _text(names, "Sede/Provincia")
+    return {
+        "name": name,
+        "vat": vat,
+        "tax_code": _text(ids, "CodiceFiscale"),
+        "town": f"{town} ({province})" if town and province else town,
+    }
+
+
+def _describe_party(label, party):
+    parts = [party.get("name")]
+    if party.get("vat"):
+        parts.append(f"P.IVA {party['vat']}")
+    elif party.get("tax_code"):
+        parts.append(f"C.F. {party['tax_code']}")
+    parts.append(party.get("town"))
+    parts = [part for part in parts if part]
+    return f"{label}: {', '.join(parts)}." if parts else None
+
+
+def _line(elem, position):
+    """One DettaglioLinee (or semplificata DatiBeniServizi) as `[number, text, amount]`."""
+    number = _text(elem, "NumeroLinea") or str(position)
+    description = _text(elem, "Descrizione") or ""
+    quantity, unit = _text(elem, "Quantita"), _text(elem, "UnitaMisura")
+    price = _text(elem, "PrezzoUnitario")
+    total = _text(elem, "PrezzoTotale") or _text(elem, "Importo")
+    vat = _text(elem, "AliquotaIVA") or _text(elem, "DatiIVA/Aliquota")
+    text = f"{number}) {description}"
+    if quantity and price:
+        text += f"; {quantity}{' ' + unit if unit else ''} x {price}"
+    if total:
+        text += f" = {total}"
+    if vat:
+        text += f"; IVA {vat}%"
+    elif _text(elem, "Natura"):
+        text += f"; natura {_text(elem, 'Natura')}"
+    codes = [_text(code, "CodiceValore") for code in _findall(elem, "CodiceArticolo")]
+    if any(codes):
+        text += f"; cod. {', '.join(code for code in codes if code)}"
+    return [int(number) if number.isdigit() else position, text, _number(total)]
+
+
+def _document(body, header):
+    """The header record and identity of one FatturaElettronicaBody."""
+    general = _find(body, "DatiGenerali/DatiGeneraliDocumento")
+    doc_type = _text(general, "TipoDocumento")
+    number, date = _text(general, "Numero"), _text(general, "Data")
+    currency = _text(general, "Divisa") or "EUR"
+    total = _text(general, "ImportoTotaleDocumento")
+    supplier, customer = header.get("supplier", {}), header.get("customer", {})
+
+    title = DOCUMENT_TYPES.get(doc_type, f"Documento {doc_type}" if doc_type else "Fattura")
+    prefix = " ".join(filter(None, [title, f"n. {number}" if number else None, f"del {date}" if date else None]))
+    sentences = [prefix + "."]
+    sentences.append(_describe_party("Fornitore", supplier))
+    sentences.append(_describe_party("Cliente", customer))
+    if total:
+        sentences.append(f"Totale documento: {total} {currency}.")
+    causali = [" ".join(c.text.split()) for c in _findall(general, "Causale") if c.text and c.text.strip()]
+    if causali:
+        sentences.append(f"Causale: {' '.join(causali)}.")
+    withholding = _find(general, "DatiRitenuta")
+    if withholding is not None and _text(withholding, "ImportoRitenuta"):
+        sentences.append(f"Ritenuta: {_text(withholding, 'ImportoRitenuta')} ({_text(withholding, 'AliquotaRitenuta') or '?'}%).")
+    for name, label in (("DatiOrdineAcquisto", "Ordine"), ("DatiContratto", "Contratto"), ("DatiDDT", "DDT")):
+        references = []
+        for ref in _findall(_find(body, "DatiGenerali"), name):
+            identifier = _text(ref, "IdDocumento") or _text(ref, "NumeroDDT")
+            ref_date = _text(ref, "Data") or _text(ref, "DataDDT")
+            if identifier:
+                references.append(f"{identifier}{' del ' + ref_date if ref_date else ''}")
+        if references:
+            sentences.append(f"{label}: {'; '.join(references)}.")
+
+    summaries = []
+    taxable_total, tax_total = 0.0, 0.0
+    for summary in _findall(_find(body, "DatiBeniServizi"), "DatiRiepilogo"):
+        rate = _text(summary, "AliquotaIVA")
+        taxable, tax = _text(summary, "ImponibileImporto"), _text(summary, "Imposta")
+        taxable_total += _number(taxable) or 0.0
+        tax_total += _number(tax) or 0.0
+        nature = _text(summary, "Natura")
+        summaries.append(f"{rate}%{' ' + nature if nature else ''} imponibile {taxable} imposta {tax}")
+    if summaries:
+        sentences.append(f"Riepilogo IVA: {'; '.join(summaries)}.")
+
+    payments = []
+    for payment in _findall(body, "DatiPagamento"):
+        for detail in _findall(payment, "DettaglioPagamento"):
+            fields = [_text(detail, "ModalitaPagamento"),
+                      f"scadenza {_text(detail, 'DataScadenzaPagamento')}" if _text(detail, "DataScadenzaPagamento") else None,
+                      f"importo {_text(detail, 'ImportoPagamento')}" if _text(detail, "ImportoPagamento") else None,
+                      f"IBAN {_text(detail, 'IBAN')}" if _text(detail, "IBAN") else None]
+            payments.append(" ".join(field for field in fields if field))
+    if payments:
+        sentences.append(f"Pagamento: {'; '.join(payments)}.")
+
+    # Typed fields; None values are left out, as vector stores reject them
+    identity = {
+        "document_type": doc_type,
+        "invoice_number": number,
+        "invoice_date": date,
+        "supplier": supplier.get("name"),
+        "supplier_vat": supplier.get("vat"),
+        "customer": customer.get("name"),
+        "customer_vat": customer.get("vat"),
+    }
+    identity = {key: value for key, value in identity.items() if value is not None}
+    metadata = dict(identity, record="header", currency=currency)
+    if _number(total) is not None:
+        metadata["total"] = _number(total)
+    if summaries:
+        metadata["taxable"] = round(taxable_total, 2)
+        metadata["tax"] = round(tax_total, 2)
+    if supplier.get("name"):
+        prefix += f", {supplier['name']}"
+    return {
+        "header": [" ".join(sentence for sentence in sentences if sentence), metadata],
+        "prefix": prefix,
+        "identity": identity,
+    }
+
+
+def extract_documents(file_path):
+    """Parse a FatturaPA file into one dict per invoice body, ready for `chunk_documents`.
+
+    The file is streamed: the transmission envelope is dropped, attachments
+    are discarded as soon as they are parsed, and each body is cleared once
+    extracted, so a large batch ("lotto") of invoices is read in bounded memory.
+    """
+    header = {}
+    lines = []
+    documents = []
+    for _, elem in ET.iterparse(file_path, events=("end",)):
+        name = _local(elem.tag)
+        if name == "FatturaElettronicaHeader":
+            header = {"supplier": _party(_find(elem, "CedentePrestatore")),
+                      "customer": _party(_find(elem, "CessionarioCommittente"))}
+            elem.clear()
+        elif name == "DettaglioLinee" or (name == "DatiBeniServizi" and _find(elem, "Descrizione") is not None):
+            lines.append(_line(elem, len(lines) + 1))
+            elem.clear()
+        elif name == "Allegati":
+            # Base64 attachments, often larger than the invoice itself
+            elem.clear()
+        elif name == "FatturaElettronicaBody":
+            document = _document(elem, header)
+            document["lines"] = lines
+            documents.append(document)
+            lines = []
+            elem.clear()
+    return documents
+
+
+def chunk_documents(documents, chunk_size=1000):
+    """One chunk per invoice header, then the invoice's lines packed into chunks of up to `chunk_size`.
+
+    Every line chunk starts with the invoice's short identity ("Fattura n. 12
+    del 2024-03-01, ACME S.r.l.") so it is retrievable on its own, and no
+    line is ever split. Returns `(text, metadata)` pairs.
+    """
+    chunks = []
+    for document in documents:
+        text, metadata = document["header"]
+        chunks.append((text, dict(metadata, lines=len(document["lines"]))))
+        prefix = f"{document['prefix']} - righe:"
+        group = []
+        group_len = len(prefix)
+        for line in document["lines"]:
+            if group and group_len + 1 + len(line[1]) > chunk_size:
+                chunks.append(_lines_chunk(document, prefix, group))
+                group, group_len = [], len(prefix)
+            group.append(line)
+            group_len += len(line[1]) + 1
+        if group:
+            chunks.append(_lines_chunk(document, prefix, group))
+    return chunks
+
+
+def _lines_chunk(document, prefix, group):
+    amounts = [amount for _, _, amount in group if amount is not None]
+    metadata = dict(document["identity"], record="lines", first_line=group[0][0], last_line=group[-1][0])
+    if amounts:
+        metadata["amount"] = round(sum(amounts), 2)
+    return f"{prefix} {' '.join(text for _, text, _ in group)}", metadata
@@ -1,75 +1,119 @@
 # File: backend/app/file_watcher.py
 import threading
-import time
-from watchdog.observers import Observer
-from watchdog.events import FileSystemEventHandler
 import os
 import logging
-from .db_operations import cleanup_database
+from .scanner import scan_documents
+from .ingest_queue import ingest_queue, INDEX, REMOVE, WATCHER
+from .utils import is_indexable_path, relative_source
 
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
-class DocumentHandler(FileSystemEventHandler):
-    def __init__(self, db_manager, document_processor, documents_dir):
-        self.db_manager = db_manager
-        self.document_processor = document_processor
+class DocumentHandler:
+    def __init__(self, documents_dir, get_folder):
+        # Components are looked up per event so a folder whose store was
+        # closed by the registry is transparently reopened.
         self.documents_dir = documents_dir
+        self.get_folder = get_folder
+
+    def dispatch(self, event):
+        # Same contract as watchdog's FileSystemEventHandler.dispatch, so
+        # watchdog is only imported once a folder is actually watched.
+        handler = getattr(self, f"on_{event.event_type}", None)
+        if handler is not None:
+            handler(event)
+
+    @property
+    def db_manager(self):
+        return self.get_folder(self.documents_dir).db_manager
 
     def on_created(self, event):
-        if not event.is_directory:
+        if event.is_directory:
+            # Files copied in together with a new directory may land before the
+            # recursive watch on it is in place, so index what is already there.
+            logger.info(f"New directory detected: {event.src_path}")
+            self._process_directory(event.src_path)
+        elif is_indexable_path(event.src_path, self.documents_dir):
             logger.info(f"New file detected: {event.src_path}")
             self._process_file(event.src_path)
 
     def on_modified(self, event):
-        if not event.is_directory:
+        if not event.is_directory and is_indexable_path(event.src_path, self.documents_dir):
             logger.info(f"File modified: {event.src_path}")
             self._process_file(event.src_path)
 
+    def on_moved(self, event):
+        logger.info(f"Moved: {event.src_path} -> {event.dest_path}")
+        if event.is_directory:
+            self._remove_directory_from_db(event.src_path)
+            self._process_directory(event.dest_path)
+        else:
+            if is_indexable_path(event.src_path, self.documents_dir):
+                self._remove_file_from_db(event.src_path)
+            if is_indexable_path(event.dest_path, self.documents_dir):
+                self._process_file(event.dest_path)
+
     def _process_file(self, file_path):
-        try:
-            logger.info(f"Starting to process file: {file_path}")
-            chunks = self.document_processor.process_file(file_path)
-            logger.info(f"File processed, got {len(chunks)} chunks")
-            metadata = {"source": os.path.basename(file_path)}
-            self.db_manager.add_texts(chunks, [metadata] * len(chunks))
-            logger.info(f"Processed and added to database: {file_path}")
-        except Exception as e:
-            logger.error(f"Error processing file {file_path}: {str(e)}", exc_info=True)
+        # The ingest queue skips files whose size and mtime are already indexed
+        ingest_queue.submit(self.documents_dir, relative_source(file_path, self.documents_dir), INDEX, WATCHER)
+
+    def _process_directory(self, dir_path):
+        if not is_indexable_path(os.path.join(dir_path, "_.pdf"), self.documents_dir):
+            return
+        prefix = relative_source(dir_path, self.documents_dir) + "/"
+        for source in sorted(scan_documents(dir_path)):
+            self._process_file(os.path.join(self.documents_dir, prefix + source))
 
     def on_deleted(self, event):
-        if not event.is_directory:
+        if event.is_directory:
+            logger.info(f"Directory deleted: {event.src_path}")
+            self._remove_directory_from_db(event.src_path)
+        elif is_indexable_path(event.src_path, self.documents_dir):
             logger.info(f"File deleted: {event.src_path}")
             self._remove_file_from_db(event.src_path)
 
     def _remove_file_from_db(self, file_path):
-        try:
-            filename = os.path.basename(file_path)
-            logger.info(f"Removing file from database: {filename}")
-            self.db_manager.remove_documents({"source": filename})
-            logger.info(f"Removed from database: {filename}")
-        except Exception as e:
-            logger.error(f"Error removing file {file_path} from database: {str(e)}", exc_info=True)
+        ingest_queue.submit(self.documents_dir, relative_source(file_path, self.documents_dir), REMOVE, WATCHER)
+
+    def _remove_directory_from_db(self, dir_path):
+        # Not every platform reports the files inside a removed or moved-away
+        # directory, so drop every source stored under its prefix.
+        prefix = relative_source(dir_path, self.documents_dir) + "/"
+        for source in self.db_manager.get_all_sources():
+            if source.startswith(prefix):
+                self._remove_file_from_db(os.path.join(self.documents_dir, source))
 
 class FileWatcher:
-    def __init__(self, path_to_watch, db_manager, document_processor):
-        self.path_to_watch = path_to_watch
-        self.handler = DocumentHandler(db_manager, document_processor, path_to_watch)
-        self.observer = Observer()
-        self.stop_event = threading.Event()
-
-    def run(self):
-        self.observer.schedule(self.handler, self.path_to_watch, recursive=False)
-        self.observer.start()
-        try:
-            while not self.stop_event.is_set():
-                self.stop_event.wait(1)
-        finally:
-            self.observer.stop()
-            self.observer.join()
+    """A single observer thread shared by every watched folder."""
+
+    def __init__(self):
+        self.observer = None
+        self.watches = {}
+        self.lock = threading.Lock()
+
+    def watch(self, path, handler):
+        with self.lock:
+            if path in self.watches:
+                return
+            if self.observer is None:
+                from watchdog.observers import Observer
+                self.observer = Observer()
+            self.watches[path] = self.observer.schedule(handler, path, recursive=True)
+            if not self.observer.is_alive():
+                self.observer.start()
+            logger.info(f"Watching folder: {path}")
+
+    def unwatch(self, path):
+        with self.lock:
+            watch = self.watches.pop(path, None)
+            if watch is not None:
+                self.observer.unschedule(watch)
+                logger.info(f"Stopped watching folder: {path}")
 
     def stop(self):
-        self.stop_event.set()
-        if self.observer.is_alive():
-            self.observer.stop()
-            self.observer.join()
\ No newline at end of file
+        with self.lock:
+            self.watches.clear()
+            if self.observer is not None and self.observer.is_alive():
+                self.observer.stop()
+                self.observer.join()
+            self.observer = None
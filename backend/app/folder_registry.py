@@ -0,0 +1,221 @@
+# File: backend/app/folder_registry.py
+
+import os
+import threading
+import logging
+from collections import OrderedDict
+from .db_operations import get_db_manager, get_document_processor
+from .embeddings import get_embeddings, index_spec
+from .file_watcher import DocumentHandler
+from .index_versions import IndexVersions
+from .ingest_queue import ingest_queue
+
+logger = logging.getLogger(__name__)
+
+DB_DIR_NAME = '.raggy_db'
+
+
+class FolderContext:
+    """The open components serving one document folder."""
+
+    def __init__(self, path, embeddings=None):
+        self.path = path
+        self.db_dir = os.path.join(path, DB_DIR_NAME)
+        os.makedirs(self.db_dir, exist_ok=True)
+        self.text_cache_dir = os.path.join(self.db_dir, 'text_cache')
+        # The configured embeddings, which new index versions are built with
+        self.embeddings = embeddings or get_embeddings()
+        self.versions = IndexVersions(self.db_dir)
+        self.version = self.versions.active()
+        self.db_manager, self.document_processor = self._open_version(self.version)
+        # The version swapped out last, as (version, db_manager, document_processor), left open for requests still using it
+        self.retired = None
+
+    def embeddings_for(self, version):
+        """An embeddings client producing the vectors `version` was built with."""
+        spec = index_spec(self.versions.manifest(version).get('params', {}))
+        if spec == getattr(self.embeddings, 'spec', None):
+            return self.embeddings
+        return get_embeddings(*spec)
+
+    def embedding_mismatch(self):
+        """True when the active version was built with another embedding model or size than configured."""
+        return index_spec(self.versions.manifest(self.version).get('params', {})) != getattr(self.embeddings, 'spec', None)
+
+    def store_for(self, version):
+        """The `(vector backend, dtype)` `version` was built with.
+
+        Versions from before these were recorded are recognised by their
+        files; an index with no vector store yet uses the current settings.
+        """
+        from .conf import config
+        from .vector_stores import detect_vector_backend
+        params = self.versions.manifest(version).get('params', {})
+        backend = params.get('vector_backend') or detect_vector_backend(self.versions.path(version))
+        return (backend or config.get('vector_backend', 'chroma'),
+                params.get('vector_dtype') or config.get('vector_dtype', 'float16'))
+
+    def store_mismatch(self):
+        """True when the active version is stored in another vector backend or dtype than configured."""
+        from .conf import config
+        backend, vector_dtype = self.store_for(self.version)
+        if backend != config.get('vector_backend', 'chroma'):
+            return True
+        # Only the quantized backend stores vectors at the configured precision
+        return backend == 'quantized' and vector_dtype != config.get('vector_dtype', 'float16')
+
+    def chunking_mismatch(self):
+        """True when the active version was chunked by another chunker than the current one.
+
+        Versions from before the chunker was versioned count as version 1.
+        """
+        from .document_processor import CHUNKING_VERSION
+        return self.versions.manifest(self.version).get('params', {}).get('chunking', 1) != CHUNKING_VERSION
+
+    def _open_version(self, version):
+        # Files are chunked, and queries embedded, with the settings the version was built with
+        params = self.versions.manifest(version).get('params', {})
+        document_processor = get_document_processor(self.path, self.text_cache_dir,
+                                                     params.get('chunk_size'), params.get('chunk_overlap'))
+        return get_db_manager(self.versions.path(version), self.embeddings_for(version), *self.store_for(version)), document_processor
+
+    def swap(self, version, db_manager, document_processor):
+        """Activate `version` and serve it from `db_manager`.
+
+        Requests already running keep the components they started with, so
+        the replaced version stays open until the next swap, which closes it.
+        """
+        self.versions.activate(version)
+        previous = self.retired
+        self.retired = (self.version, self.db_manager, self.document_processor)
+        self.db_manager, self.document_processor, self.version = db_manager, document_processor, version
+        if previous is not None and previous[1] is not db_manager:
+            self._close_manager(previous[1])
+        logger.info(f"Folder {self.path} now serves index version {version}")
+
+    def activate_version(self, version):
+        """Switch to an existing version, e.g. to roll back a migration."""
+        if self.retired is not None and self.retired[0] == version:
+            # Rolling back to the version just replaced: it is still open
+            _, db_manager, document_processor = self.retired
+        else:
+            db_manager, document_processor = self._open_version(version)
+            db_manager.preload()
+        self.swap(version, db_manager, document_processor)
+
+    def open_versions(self):
+        """The versions whose stores are open, which must not be garbage-collected."""
+        return {self.version} | ({self.retired[0]} if self.retired is not None else set())
+
+    def _close_manager(self, db_manager):
+        try:
+            db_manager.close()
+        except Exception as e:
+            logger.warning(f"Error closing store for folder {self.path}: {str(e)}")
+
+    def close(self):
+        """Release the open index; a request still holding this context reopens what it uses."""
+        self._close_manager(self.db_manager)
+        if self.retired is not None:
+            self._close_manager(self.retired[1])
+            self.retired = None
+
+
+class FolderRegistry:
+    """Registered document folders with a bounded LRU of open stores.
+
+    Every registered folder is watched through one shared FileWatcher, but
+    only the `max_open` most recently used folders keep a DBManager open;
+    others are reopened on demand.
+    """
+
+    def __init__(self, file_watcher, max_open=4, get_embeddings=None):
+        self.file_watcher = file_watcher
+        self.max_open = max(1, max_open)
+        # Called when a store is opened, so the embeddings client is only built when needed
+        self.get_embeddings = get_embeddings
+        self.folders = []
+        self.active = None
+        self._open = OrderedDict()
+        self._lock = threading.RLock()
+        # Document writes from watchers and refreshes run on the ingest queue's worker
+        ingest_queue.attach(self.get)
+
+    def register(self, path):
+        path = os.path.abspath(path)
+        with self._lock:
+            if path not in self.folders:
+                self.folders.append(path)
+                self.file_watcher.watch(path, DocumentHandler(path, self.get))
+                logger.info(f"Registered folder: {path}")
+        return path
+
+    def unregister(self, path):
+        path = os.path.abspath(path)
+        with self._lock:
+            if path not in self.folders:
+                return False
+            self.folders.remove(path)
+            self.file_watcher.unwatch(path)
+            ingest_queue.drop_folder(path)
+            context = self._open.pop(path, None)
+            if context is not None:
+                context.close()
+            if self.active == path:
+                self.active = None
+            logger.info(f"Unregistered folder: {path}")
+            return True
+
+    def activate(self, path, open_store=True):
+        """Register `path` if needed and make it the default folder for requests."""
+        path = self.register(path)
+        with self._lock:
+            self.active = path
+        if open_store:
+            self.get(path)
+        return path
+
+    def is_registered(self, path):
+        return os.path.abspath(path) in self.folders
+
+    def open_folders(self):
+        with self._lock:
+            return list(self._open)
+
+    def set_embeddings(self, embeddings):
+        """Make `embeddings` the configured embeddings of every open folder."""
+        with self._lock:
+            for context in self._open.values():
+                context.embeddings = embeddings
+
+    def is_open(self, path):
+        return os.path.abspath(path) in self._open
+
+    def get(self, path=None):
+        """Return the FolderContext for `path` (default: the active folder), opening it if needed."""
+        path = os.path.abspath(path) if path else self.active
+        if path is None:
+            raise ValueError("No folder selected")
+        with self._lock:
+            context = self._open.get(path)
+            if context is not None:
+                self._open.move_to_end(path)
+                return context
+            if path not in self.folders:
+                raise KeyError(f"Folder not registered: {path}")
+
+            logger.info(f"Opening store for folder: {path}")
+            context = FolderContext(path, self.get_embeddings() if self.get_embeddings else None)
+            self._open[path] = context
+            while len(self._open) > self.max_open:
+                evicted, evicted_context = self._open.popitem(last=False)
+                logger.info(f"Closing least recently used store: {evicted}")
+                evicted_context.close()
+            return context
+
+    def close(self):
+        with self._lock:
+            self.file_watcher.stop()
+            for context in self._open.values():
+                context.close()
+            self._open.clear()
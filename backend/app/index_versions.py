@@ -0,0 +1,178 @@
+# File: backend/app/index_versions.py
+
+import os
+import json
+import time
+import shutil
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+BASE = "base"
+ACTIVE_FILE = "ACTIVE"
+VERSIONS_DIR = "versions"
+MANIFEST_FILE = "version.json"
+HISTORY_FILE = "history.json"
+SEQUENCE_FILE = "sequence"
+
+
+def _write_json(path, data):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class IndexVersions:
+    """The index versions of one folder, and which of them serves queries.
+
+    Each version is a complete index (vector store, chunk store and source
+    registry) in `versions/vN` under the folder's database directory. The
+    ACTIVE file names the version in use and is only ever replaced with
+    os.replace, so a crash leaves either the old or the new version active.
+    Without an ACTIVE file the index kept directly in the database directory,
+    as built before versioning, is active under the name "base"; it is never
+    garbage-collected.
+    """
+
+    def __init__(self, db_dir):
+        self.db_dir = db_dir
+        self.versions_dir = os.path.join(db_dir, VERSIONS_DIR)
+        self._lock = threading.Lock()
+
+    def path(self, name):
+        return self.db_dir if name == BASE else os.path.join(self.versions_dir, name)
+
+    def active(self):
+        try:
+            with open(os.path.join(self.db_dir, ACTIVE_FILE), encoding="utf-8") as f:
+                name = f.read().strip()
+        except FileNotFoundError:
+            return BASE
+        if name != BASE and not os.path.isdir(self.path(name)):
+            logger.error(f"Active index version {name} is missing, falling back to {BASE}")
+            return BASE
+        return name
+
+    def names(self):
+        if not os.path.isdir(self.versions_dir):
+            return []
+        names = [name for name in os.listdir(self.versions_dir)
+                 if name.startswith("v") and name[1:].isdigit() and os.path.isdir(self.path(name))]
+        return sorted(names, key=lambda name: int(name[1:]))
+
+    def manifest(self, name):
+        if name == BASE:
+            return {"status": "ready"}
+        try:
+            with open(os.path.join(self.path(name), MANIFEST_FILE), encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {"status": "unknown"}
+
+    def update_manifest(self, name, **fields):
+        manifest = self.manifest(name)
+        manifest.update(fields)
+        _write_json(os.path.join(self.path(name), MANIFEST_FILE), manifest)
+        return manifest
+
+    def history(self):
+        try:
+            with open(os.path.join(self.versions_dir, HISTORY_FILE), encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return [self.active()]
+
+    def _last_number(self):
+        try:
+            with open(os.path.join(self.versions_dir, SEQUENCE_FILE), encoding="utf-8") as f:
+                recorded = int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            recorded = 0
+        existing = self.names()
+        return max(recorded, int(existing[-1][1:]) if existing else 0)
+
+    def create(self, params=None):
+        """Create an empty version directory for a build; returns its name.
+
+        Names are never reused, even after a version is removed: stores
+        cached per path, such as Chroma's, must not mistake a new version
+        for a deleted one.
+        """
+        with self._lock:
+            os.makedirs(self.versions_dir, exist_ok=True)
+            number = self._last_number() + 1
+            with open(os.path.join(self.versions_dir, SEQUENCE_FILE), "w", encoding="utf-8") as f:
+                f.write(str(number))
+                f.flush()
+                os.fsync(f.fileno())
+            name = f"v{number}"
+            os.makedirs(self.path(name))
+            self.update_manifest(name, status="building", created_at=time.time(), params=params or {})
+        logger.info(f"Created index version {name} in {self.db_dir}")
+        return name
+
+    def activate(self, name):
+        """Atomically make `name` the version that serves queries."""
+        if self.manifest(name).get("status") != "ready":
+            raise ValueError(f"Index version {name} is not ready")
+        with self._lock:
+            history = [entry for entry in self.history() if entry != name] + [name]
+            if name != BASE:
+                self.update_manifest(name, activated_at=time.time())
+            tmp = os.path.join(self.db_dir, ACTIVE_FILE + ".tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(name)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, os.path.join(self.db_dir, ACTIVE_FILE))
+            os.makedirs(self.versions_dir, exist_ok=True)
+            _write_json(os.path.join(self.versions_dir, HISTORY_FILE), history)
+        logger.info(f"Activated index version {name} in {self.db_dir}")
+
+    def previous(self):
+        """The most recently active version before the current one that still exists, or None."""
+        active = self.active()
+        for name in reversed(self.history()):
+            if name != active and (name == BASE or name in self.names()) and self.manifest(name).get("status") == "ready":
+                return name
+        return None
+
+    def interrupted(self):
+        """The newest version whose build was interrupted by a shutdown, or None."""
+        building = [name for name in self.names() if self.manifest(name).get("status") == "building"]
+        return building[-1] if building else None
+
+    def remove(self, name):
+        if name == BASE or name == self.active():
+            raise ValueError(f"Cannot remove index version {name}")
+        shutil.rmtree(self.path(name), ignore_errors=True)
+        with self._lock:
+            history = [entry for entry in self.history() if entry != name]
+            if os.path.isdir(self.versions_dir):
+                _write_json(os.path.join(self.versions_dir, HISTORY_FILE), history)
+        logger.info(f"Removed index version {name} from {self.db_dir}")
+
+    def gc(self, keep=1, in_use=()):
+        """Remove versions other than the active one and the `keep` most recently active before it.
+
+        Versions named in `in_use`, whose stores are still open, are kept.
+        Versions that never became ready are removed too, so this must not run
+        while a build is in progress. Returns the removed names.
+        """
+        active = self.active()
+        retained = [name for name in reversed(self.history()) if name != active][:max(0, keep)]
+        removed = []
+        for name in self.names():
+            if name != active and name not in retained and name not in in_use:
+                self.remove(name)
+                removed.append(name)
+        return removed
+
+    def list(self):
+        active = self.active()
+        names = ([BASE] if active == BASE or BASE in self.history() else []) + self.names()
+        return [dict(self.manifest(name), name=name, active=name == active) for name in names]
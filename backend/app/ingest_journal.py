@@ -0,0 +1,85 @@
+# File: backend/app/ingest_journal.py
+
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS ingest_journal (
+    source TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    batches INTEGER NOT NULL DEFAULT 0,
+    chunks INTEGER NOT NULL DEFAULT 0,
+    content_hash TEXT,
+    updated_at REAL
+)
+"""
+
+PLANNED = "planned"
+PARTIAL = "partial"
+COMMITTED = "committed"
+
+
+class IngestJournal:
+    """Write-ahead progress of an index build, kept in the index's source registry.
+
+    The build first plans every file it will ingest. It then commits each
+    file's chunks in batches, and each batch's journal entry is written in
+    the same SQLite transaction as the registry update for those chunks. After
+    a crash the journal therefore says exactly which batches of which files
+    reached the index, and the build resumes after the last committed batch
+    instead of starting over.
+    """
+
+    def __init__(self, registry):
+        self.registry = registry
+        with registry.transaction():
+            registry.conn.execute(SCHEMA)
+
+    def plan(self, sources):
+        """Record the files a build will ingest; files already in the journal keep their progress."""
+        now = time.time()
+        with self.registry.transaction():
+            self.registry.conn.executemany(
+                "INSERT OR IGNORE INTO ingest_journal (source, state, updated_at) VALUES (?, ?, ?)",
+                [(source, PLANNED, now) for source in sources])
+
+    def progress(self, source):
+        """Return the source's journal row as a dict, or None if it was never planned."""
+        with self.registry.reading() as conn:
+            cursor = conn.execute("SELECT * FROM ingest_journal WHERE source = ?", (source,))
+            row = cursor.fetchone()
+            return dict(zip([c[0] for c in cursor.description], row)) if row else None
+
+    def batch_committed(self, source, chunks, content_hash=None):
+        """Count one more committed batch of `chunks` chunks; call inside the batch's registry transaction."""
+        with self.registry.transaction():
+            self.registry.conn.execute(
+                "INSERT INTO ingest_journal (source, state, batches, chunks, content_hash, updated_at) VALUES (?, ?, 1, ?, ?, ?) "
+                "ON CONFLICT(source) DO UPDATE SET state = excluded.state, batches = batches + 1, "
+                "chunks = chunks + excluded.chunks, content_hash = excluded.content_hash, updated_at = excluded.updated_at",
+                (source, PARTIAL, chunks, content_hash, time.time()))
+
+    def file_committed(self, source):
+        with self.registry.transaction():
+            self.registry.conn.execute(
+                "INSERT INTO ingest_journal (source, state, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(source) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at",
+                (source, COMMITTED, time.time()))
+
+    def reset(self, source):
+        """Forget the progress of a source whose partial chunks were discarded."""
+        with self.registry.transaction():
+            self.registry.conn.execute(
+                "UPDATE ingest_journal SET state = ?, batches = 0, chunks = 0, content_hash = NULL, updated_at = ? "
+                "WHERE source = ?", (PLANNED, time.time(), source))
+
+    def summary(self):
+        """Return `{state: files}`."""
+        with self.registry.reading() as conn:
+            return dict(conn.execute("SELECT state, COUNT(*) FROM ingest_journal GROUP BY state"))
+
+    def clear(self):
+        with self.registry.transaction():
+            self.registry.conn.execute("DELETE FROM ingest_journal")
@@ -0,0 +1,255 @@
+# File: backend/app/ingest_queue.py
+
+import os
+import time
+import heapq
+import itertools
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Lower runs first
+INTERACTIVE = 0
+WATCHER = 10
+RECONCILE = 20
+
+INDEX = "index"
+REMOVE = "remove"
+
+
+class IngestTask:
+    def __init__(self, folder, source, op, priority):
+        self.folder = folder
+        self.source = source
+        self.op = op
+        # The level it was submitted at, and that level after any boost
+        self.base_priority = priority
+        self.priority = priority
+        self.submitted_at = time.time()
+        self.callbacks = []
+        self.cancelled = False
+        self.done = threading.Event()
+        self.chunks = 0
+        self.skipped = False
+        self.error = None
+        # Sequence number of the task's current heap entry; older entries are stale
+        self.entry = None
+
+
+class IngestQueue:
+    """The one queue every document write goes through, in priority order.
+
+    Files the user adds explicitly come first, then watcher events, then the
+    files of a background reconcile. A source that recent queries returned
+    has its priority raised by up to `boost` levels, fading linearly over
+    `boost_window` seconds since it was last returned. A file queued again
+    before it ran keeps one task, with the better of the two priorities and
+    the latest operation, so a new document never waits behind a bulk
+    reconcile of the same folder.
+
+    Tasks run on a single worker thread against the folder's current
+    components, looked up with the `get_folder` passed to `attach`.
+    """
+
+    def __init__(self, boost=15, boost_window=600):
+        self.boost = boost
+        self.boost_window = boost_window
+        self.get_folder = None
+        self._heap = []
+        self._pending = {}
+        self._recent = {}
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+        self.running = None
+        self.stats = {"submitted": 0, "merged": 0, "indexed": 0, "removed": 0, "skipped": 0, "failed": 0}
+
+    def attach(self, get_folder):
+        with self._cond:
+            self.get_folder = get_folder
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._work, daemon=True, name="ingest-queue")
+                self._thread.start()
+
+    @property
+    def attached(self):
+        return self.get_folder is not None
+
+    def _effective_priority(self, folder, source, priority):
+        touched = self._recent.get((folder, source))
+        if touched is None:
+            return priority
+        age = time.time() - touched
+        if age >= self.boost_window:
+            del self._recent[(folder, source)]
+            return priority
+        return priority - self.boost * (1 - age / self.boost_window)
+
+    def _push(self, task):
+        task.entry = next(self._seq)
+        heapq.heappush(self._heap, (task.priority, task.entry, task))
+
+    def submit(self, folder, source, op=INDEX, priority=WATCHER, callback=None):
+        """Queue indexing or removal of one source; returns its task."""
+        with self._cond:
+            self.stats["submitted"] += 1
+            task = self._pending.get((folder, source))
+            if task is not None:
+                self.stats["merged"] += 1
+                task.op = op
+                task.base_priority = min(task.base_priority, priority)
+                self._reprioritize(task)
+            else:
+                task = IngestTask(folder, source, op, priority)
+                task.priority = self._effective_priority(folder, source, priority)
+                self._pending[(folder, source)] = task
+                self._push(task)
+            if callback is not None:
+                task.callbacks.append(callback)
+            self._cond.notify()
+            return task
+
+    def _reprioritize(self, task):
+        priority = self._effective_priority(task.folder, task.source, task.base_priority)
+        if priority < task.priority:
+            task.priority = priority
+            self._push(task)
+
+    def touch(self, folder, sources):
+        """Note that a query just returned `sources`, boosting them in the queue."""
+        now = time.time()
+        with self._cond:
+            for source in sources:
+                self._recent[(folder, source)] = now
+                task = self._pending.get((folder, source))
+                if task is not None:
+                    self._reprioritize(task)
+
+    def cancel(self, tasks):
+        """Drop tasks that have not started yet."""
+        with self._cond:
+            for task in tasks:
+                if self._pending.get((task.folder, task.source)) is task:
+                    del self._pending[(task.folder, task.source)]
+                    task.cancelled = True
+                    task.done.set()
+
+    def abandon(self, tasks, priority, callback=None):
+        """Withdraw one submitter's claim on `tasks`, submitted at `priority` with `callback`.
+
+        Tasks still at that priority are cancelled. A task merged with a more
+        urgent submission for the same file, an explicit add or a watcher
+        event, stays queued for it and only loses `callback`.
+        """
+        with self._cond:
+            for task in tasks:
+                if task.base_priority < priority and callback in task.callbacks:
+                    task.callbacks.remove(callback)
+            self.cancel([task for task in tasks if task.base_priority >= priority])
+
+    def drop_folder(self, folder):
+        """Drop the pending tasks of a folder that is no longer registered."""
+        with self._cond:
+            tasks = [task for task in self._pending.values() if task.folder == folder]
+        self.cancel(tasks)
+        return len(tasks)
+
+    def wait(self, tasks, job=None, interval=0.5, priority=RECONCILE, callback=None):
+        """Block until `tasks` are done.
+
+        A cancelled `job` abandons the rest, as submitted at `priority` with
+        `callback` (see `abandon`), and raises JobCancelled.
+        """
+        for task in tasks:
+            while not task.done.wait(interval):
+                if job is not None and job.cancel_requested:
+                    self.abandon(tasks, priority, callback)
+                    job.check_cancelled()
+        if job is not None:
+            job.check_cancelled()
+
+    def position(self, task):
+        """0 while the task runs or once done, otherwise its 1-based place in the queue."""
+        with self._cond:
+            if self._pending.get((task.folder, task.source)) is not task:
+                return 0
+            return 1 + sum(1 for other in self._pending.values() if (other.priority, other.entry) < (task.priority, task.entry))
+
+    def _next(self):
+        with self._cond:
+            while True:
+                while self._heap:
+                    _, entry, task = heapq.heappop(self._heap)
+                    if entry == task.entry and self._pending.get((task.folder, task.source)) is task:
+                        del self._pending[(task.folder, task.source)]
+                        self.running = task
+                        return task
+                self._cond.wait()
+
+    def _work(self):
+        while True:
+            task = self._next()
+            try:
+                self._run(task)
+            except Exception as e:
+                task.error = str(e)
+                self.stats["failed"] += 1
+                logger.error(f"Error ingesting {task.source} in {task.folder}: {str(e)}", exc_info=True)
+            finally:
+                self.running = None
+                for callback in task.callbacks:
+                    try:
+                        callback(task)
+                    except Exception as e:
+                        logger.error(f"Ingest callback failed: {str(e)}")
+                task.done.set()
+
+    def _run(self, task):
+        from .db_operations import index_file
+        context = self.get_folder(task.folder)
+        db_manager = context.db_manager
+        if task.op == REMOVE:
+            db_manager.remove_documents({"source": task.source})
+            self.stats["removed"] += 1
+            return
+        path = os.path.join(context.path, task.source)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            # Deleted since it was queued; its removal is queued by the watcher
+            logger.debug(f"No longer exists, skipping: {path}")
+            task.skipped = True
+            self.stats["skipped"] += 1
+            return
+        stat = (st.st_size, st.st_mtime)
+        indexed = db_manager.sources.get(task.source)
+        if indexed and (indexed["size"], indexed["mtime"]) == stat:
+            # Editors and copies often report several events for one change
+            logger.debug(f"Already indexed, skipping: {path}")
+            task.skipped = True
+            self.stats["skipped"] += 1
+            return
+        waited = time.time() - task.submitted_at
+        # index_source replaces any existing chunks of the file in one transaction
+        task.chunks = index_file(db_manager, context.document_processor, context.path, task.source, stat)
+        self.stats["indexed"] += 1
+        logger.info(f"Indexed {task.source}: {task.chunks} chunks after {waited:.1f}s in the queue")
+
+    def to_dict(self):
+        with self._cond:
+            by_priority = {}
+            for task in self._pending.values():
+                level = "interactive" if task.base_priority < WATCHER else "watcher" if task.base_priority < RECONCILE else "reconcile"
+                by_priority[level] = by_priority.get(level, 0) + 1
+            running = self.running
+            return {
+                "pending": len(self._pending),
+                "by_priority": by_priority,
+                "running": {"folder": running.folder, "source": running.source, "op": running.op} if running else None,
+                "boosted_sources": len(self._recent),
+                **self.stats,
+            }
+
+
+ingest_queue = IngestQueue()
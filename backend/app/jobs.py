@@ -0,0 +1,164 @@
+# File: backend/app/jobs.py
+
+import threading
+import time
+import uuid
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class JobCancelled(Exception):
+    """Raised inside a job's work function when cancellation was requested."""
+
+
+class Job:
+    """A background unit of work with progress counters and a cancel flag."""
+
+    def __init__(self, kind, folder):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.folder = folder
+        self.status = "pending"
+        self.error = None
+        self.files_total = 0
+        self.files_done = 0
+        self.chunks = 0
+        self.current_file = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._cancel_event = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def finished(self):
+        return self.status in ("completed", "failed", "cancelled")
+
+    @property
+    def cancel_requested(self):
+        return self._cancel_event.is_set()
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    def check_cancelled(self):
+        if self._cancel_event.is_set():
+            raise JobCancelled(f"Job {self.id} cancelled")
+
+    def set_total(self, files_total):
+        with self._lock:
+            self.files_total = files_total
+
+    def file_started(self, file_name):
+        with self._lock:
+            self.current_file = file_name
+
+    def file_done(self, chunks=0):
+        with self._lock:
+            self.files_done += 1
+            self.chunks += chunks
+            self.current_file = None
+
+    def to_dict(self):
+        with self._lock:
+            now = self.finished_at or time.time()
+            elapsed = now - self.started_at if self.started_at else 0.0
+            rate = self.files_done / elapsed if elapsed > 0 else 0.0
+            remaining = max(self.files_total - self.files_done, 0)
+            eta = remaining / rate if rate > 0 and not self.finished else None
+            progress = (self.files_done / self.files_total * 100) if self.files_total else (100.0 if self.finished else 0.0)
+            return {
+                "id": self.id,
+                "kind": self.kind,
+                "folder": self.folder,
+                "status": self.status,
+                "error": self.error,
+                "files_total": self.files_total,
+                "files_done": self.files_done,
+                "chunks": self.chunks,
+                "current_file": self.current_file,
+                "progress": round(progress, 2),
+                "elapsed": round(elapsed, 2),
+                "rate": round(rate, 3),
+                "eta": round(eta, 1) if eta is not None else None,
+                "cancel_requested": self._cancel_event.is_set(),
+            }
+
+
+class JobManager:
+    """Runs jobs on daemon threads, allowing only one active job per folder."""
+
+    def __init__(self, history_size=50):
+        self.history_size = history_size
+        self._jobs = {}
+        self._active = {}
+        self._lock = threading.Lock()
+
+    def submit(self, kind, folder, target):
+        """Start `target(job)` in the background.
+
+        Returns `(job, created)`. When a job is already running for `folder`
+        that job is returned with `created=False` instead of starting another.
+        """
+        with self._lock:
+            active_id = self._active.get(folder)
+            if active_id is not None:
+                return self._jobs[active_id], False
+
+            job = Job(kind, folder)
+            self._jobs[job.id] = job
+            self._active[folder] = job.id
+            self._prune()
+
+        thread = threading.Thread(target=self._run, args=(job, target), daemon=True, name=f"job-{kind}-{job.id[:8]}")
+        thread.start()
+        logger.info(f"Started {kind} job {job.id} for folder {folder}")
+        return job, True
+
+    def _run(self, job, target):
+        job.status = "running"
+        job.started_at = time.time()
+        try:
+            target(job)
+            job.status = "completed"
+            logger.info(f"Job {job.id} completed: {job.files_done} files, {job.chunks} chunks")
+        except JobCancelled:
+            job.status = "cancelled"
+            logger.info(f"Job {job.id} cancelled after {job.files_done} files")
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+            logger.error(f"Job {job.id} failed: {str(e)}", exc_info=True)
+        finally:
+            job.finished_at = time.time()
+            with self._lock:
+                if self._active.get(job.folder) == job.id:
+                    del self._active[job.folder]
+
+    def _prune(self):
+        finished = [j for j in self._jobs.values() if j.finished]
+        excess = len(self._jobs) - self.history_size
+        for job in sorted(finished, key=lambda j: j.created_at)[:max(excess, 0)]:
+            del self._jobs[job.id]
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def active_for(self, folder):
+        with self._lock:
+            job_id = self._active.get(folder)
+            return self._jobs.get(job_id) if job_id else None
+
+    def list(self):
+        return sorted(self._jobs.values(), key=lambda j: j.created_at, reverse=True)
+
+    def cancel(self, job_id):
+        job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        job.cancel()
+        return job
+
+
+job_manager = JobManager()
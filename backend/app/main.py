@@ -1,23 +1,33 @@
 import os
-import threading
 import json
 import asyncio
 import logging
-from fastapi import FastAPI, HTTPException, Request, Depends
+from fastapi import FastAPI, HTTPException, Request, Depends, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
-from pydantic import BaseModel
-from langchain_community.llms import Ollama
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
+from pydantic import BaseModel, Field
+from typing import List, Optional
 import subprocess
 import time
 
-# Import custom modules
-from .document_processor import DocumentProcessor
-from .db_manager import DBManager
+# Import custom modules. Heavy dependencies (langchain, chromadb, pdfplumber,
+# watchdog) are only imported when the components using them are built.
+from .components import components
+from .db_manager import get_embeddings
+from .embeddings import DEFAULT_MODEL as DEFAULT_EMBEDDING_MODEL
 from .file_watcher import FileWatcher
-from .conf import config
-from .utils import is_valid_document
-from .db_operations import cleanup_database, get_db_manager, get_document_processor
+from .folder_registry import FolderRegistry
+from .conf import config, DEFAULT_CONFIG_FILE
+from .db_operations import find_documents, refresh_folder, migrate_index, reset_and_rescan as reset_and_rescan_database
+from .jobs import job_manager
+from .batch_query import run_batch, answer_sources
+from .scheduler import scheduler, QueueFull, INTERACTIVE
+from .query_cache import query_cache, QueryLog, normalize_query
+from .ingest_queue import ingest_queue, INDEX, INTERACTIVE as INGEST_INTERACTIVE
+from .ndjson_stream import ndjson_frames
+from .ws_channel import QueryChannel, metrics as ws_metrics
+from .utils import is_indexable_path, relative_source
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -34,150 +44,190 @@ app.add_middleware(
 )
 
 
+# Global variables
+folder_registry = None
+startup_task = None
+prewarm_task = None
+query_log = QueryLog(os.path.join(os.path.dirname(DEFAULT_CONFIG_FILE), "query_log.jsonl"),
+                     max_entries=config.get("query_log_size", 5000))
+
+# Startup phases: "starting" -> "loading_index" -> "ready" (or "failed")
+startup_state = {"phase": "starting", "error": None, "started_at": time.time(), "ready_at": None}
+
+
 @app.get("/health")
 async def health_check():
+    """Liveness: the process is up and answering requests."""
     return {"status": "ok"}
 
 
-# Global variables
-BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-DEFAULT_DB_DIR = os.path.join(BASE_DIR, "data", "db")
-DEFAULT_DOCUMENTS_DIR = os.path.join(BASE_DIR, "data", "documents")
-
-SELECTED_FOLDER = None
-DB_DIR = DEFAULT_DB_DIR
-DOCUMENTS_DIR = DEFAULT_DOCUMENTS_DIR
-db_manager = None
-document_processor = None
-file_watcher = None
-watcher_thread = None
-
-# Ensure default directories exist
-os.makedirs(DEFAULT_DB_DIR, exist_ok=True)
-os.makedirs(DEFAULT_DOCUMENTS_DIR, exist_ok=True)
-
-
-def load_initial_config():
-    global SELECTED_FOLDER, DB_DIR, DOCUMENTS_DIR
-    config_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'config.json')
-    try:
-        with open(config_path, 'r') as f:
-            data = json.load(f)
-            SELECTED_FOLDER = data.get('current_folder')
-            if SELECTED_FOLDER:
-                DB_DIR = os.path.join(SELECTED_FOLDER, '.raggy_db')
-                DOCUMENTS_DIR = SELECTED_FOLDER
-                # Ensure the DB_DIR exists
-                os.makedirs(DB_DIR, exist_ok=True)
-    except FileNotFoundError:
-        print(f"Config file not found at {config_path}")
-    except json.JSONDecodeError:
-        print(f"Error decoding JSON from {config_path}")
-    except Exception as e:
-        print(f"Error loading initial config: {str(e)}")
+@app.get("/ready")
+async def readiness_check():
+    """Readiness: persisted indexes are loaded and queries can be answered."""
+    ready = startup_state["phase"] == "ready"
+    reconcile = job_manager.active_for(folder_registry.active) if folder_registry and folder_registry.active else None
+    body = {
+        "ready": ready,
+        "phase": startup_state["phase"],
+        "error": startup_state["error"],
+        "reconciling": reconcile.to_dict() if reconcile else None,
+        "startup_seconds": round(startup_state["ready_at"] - startup_state["started_at"], 2) if startup_state["ready_at"] else None,
+    }
+    return JSONResponse(content=body, status_code=200 if ready else 503)
 
-# Load initial config when the app starts
-load_initial_config()
 
-def initialize_components():
-    global db_manager, document_processor, file_watcher, watcher_thread
+def build_folder_registry():
+    logger.info("Initializing folder registry")
+    registry = FolderRegistry(components.get("file_watcher"), max_open=config.get("max_open_folders", 4),
+                              get_embeddings=lambda: components.get("embeddings"))
 
-    try:
-        logger.info("Initializing document processor")
-        document_processor = get_document_processor(DOCUMENTS_DIR)
+    current_folder = config.get("current_folder")
+    for folder in config.get("folders", []):
+        if os.path.isdir(folder):
+            registry.register(folder)
+    if current_folder and os.path.isdir(current_folder):
+        # The store is opened by warm_start, off the startup path
+        registry.activate(current_folder, open_store=False)
+    elif current_folder:
+        logger.warning(f"Configured folder does not exist: {current_folder}")
+    return registry
 
-        logger.info("Initializing database manager")
-        db_manager = get_db_manager(DB_DIR)
 
-        logger.info("Initializing file watcher")
-        if file_watcher:
-            logger.info("Stopping existing file watcher")
-            file_watcher.stop()
+def build_llm():
+    from .ollama_client import OllamaLLM
+    model_name = config.get("model", "mistral:latest")
+    logger.info(f"Creating new LLM instance with model: {model_name}")
+    llm = OllamaLLM(model_name)
+    logger.info(f"LLM instance created successfully with model: {model_name}")
+    return llm
+
 
-        file_watcher = FileWatcher(DOCUMENTS_DIR, db_manager, document_processor)
+components.register("embeddings", get_embeddings)
+components.register("file_watcher", FileWatcher)
+components.register("folder_registry", build_folder_registry)
+components.register("llm", build_llm)
 
-        logger.info("Starting file watcher thread")
-        if watcher_thread and watcher_thread.is_alive():
-            logger.info("Stopping existing watcher thread")
-            watcher_thread.join()
 
-        watcher_thread = threading.Thread(target=file_watcher.run, daemon=True)
-        watcher_thread.start()
-        logger.info("File watcher thread started")
+def initialize_components():
+    global folder_registry
 
+    try:
+        folder_registry = components.get("folder_registry")
     except Exception as e:
         logger.error(f"Error initializing components: {str(e)}")
         raise
 
-    
 
-initialize_components()
+def folder_settings():
+    return {"folders": list(folder_registry.folders), "current_folder": folder_registry.active}
 
-def create_llm():
-    global llm
-    model_name = config.get("model", "mistral:latest")
-    logger.info(f"Creating new LLM instance with model: {model_name}")
-    try:
-        llm = Ollama(model=model_name)
-        logger.info(f"LLM instance created successfully with model: {model_name}")
-    except Exception as e:
-        logger.error(f"Error creating LLM instance: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Error creating LLM instance: {str(e)}")
 
-# Create initial LLM instance
-create_llm()
+def save_folders():
+    config.update(folder_settings())
+
+
+# Components built from a setting, rebuilt when it changes. Everything else
+# (prompt template, k, streaming and cache settings) is read per request and
+# takes effect without rebuilding anything.
+RECONFIGURED_BY = {
+    "model": ["llm"],
+    "embedding_model": ["embeddings"],
+    "embedding_dimensions": ["embeddings"],
+}
+
+# Settings an index is built with; open folders are migrated when they change
+MIGRATED_BY = {"embedding_model", "embedding_dimensions", "vector_backend", "vector_dtype"}
+
+
+def apply_config(changes):
+    """Save `changes` in one atomic write and rebuild only what they affect; returns the changed keys."""
+    changed = config.update(changes)
+    reconfigure(changed)
+    return changed
+
+
+def reconfigure(changed):
+    rebuilt = sorted({name for key in changed for name in RECONFIGURED_BY.get(key, [])})
+    for name in rebuilt:
+        try:
+            # In-flight queries finish with the instance they already hold
+            components.rebuild(name)
+        except Exception as e:
+            logger.error(f"Error rebuilding {name}: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"Error rebuilding {name}: {str(e)}")
+    if folder_registry is not None and "embeddings" in rebuilt and components.is_built("embeddings"):
+        # Open folders keep serving their current version, and build the next one with these
+        folder_registry.set_embeddings(components.get("embeddings"))
+    if folder_registry is not None and changed & MIGRATED_BY:
+        # refresh_folder finds the index no longer matches and builds a new version; other folders migrate when next refreshed
+        for path in folder_registry.open_folders():
+            start_rescan_job("refresh", refresh_folder, path)
+    if changed & {"generation_slots", "generation_queue"}:
+        scheduler.configure(slots=config.get("generation_slots", 1), max_queue=config.get("generation_queue", 16))
+    if changed:
+        logger.info(f"Configuration changed: {sorted(changed)}")
 
 class QueryInput(BaseModel):
     text: str
     k: int = 5
+    folders: Optional[List[str]] = None
+
+class PrefetchInput(BaseModel):
+    text: str
+    k: Optional[int] = None
+    folders: Optional[List[str]] = None
+
+class IngestInput(BaseModel):
+    paths: List[str]
+    folder: Optional[str] = None
+
+class BatchQuestion(BaseModel):
+    id: str
+    text: str
+
+class BatchQueryInput(BaseModel):
+    questions: List[BatchQuestion]
+    k: int = 5
+    folders: Optional[List[str]] = None
+    # With generate=False only the retrieved contexts are returned, for retrieval evaluations
+    generate: bool = True
 
 class ConfigUpdate(BaseModel):
     template: str
     folder: str
     model: str
     k: int
+    # Left unchanged when omitted; a null embedding_dimensions keeps the model's full size
+    embedding_model: Optional[str] = None
+    embedding_dimensions: Optional[int] = Field(None, gt=0)
 
 class FolderPath(BaseModel):
     path: str
 
 
-def get_selected_folder():
-    if globals.SELECTED_FOLDER is None:
-        raise HTTPException(status_code=400, detail="Folder not selected")
-    return globals.SELECTED_FOLDER
-
+def get_registry():
+    if folder_registry is None:
+        raise HTTPException(status_code=503, detail="Service is starting, please retry shortly.", headers={"Retry-After": "1"})
+    return folder_registry
 
 
-def cleanup_database():
-    logger.info("Starting database cleanup")
+def get_folder_context(folder=None):
+    """Resolve `folder` (default: the active folder) to its open FolderContext."""
+    if folder is None and get_registry().active is None:
+        raise HTTPException(status_code=400, detail="No folder selected. Please select a folder first.")
     try:
-        current_files = set(f for f in os.listdir(DOCUMENTS_DIR) 
-                            if os.path.isfile(os.path.join(DOCUMENTS_DIR, f)) and is_valid_document(f))
-        db_documents = db_manager.get_all_sources()
-        
-        logger.debug(f"Current files in documents directory: {current_files}")
-        logger.debug(f"Documents in database before cleanup: {db_documents}")
-
-        # If there's any mismatch between files and database, recreate the database
-        if current_files != db_documents:
-            logger.info("Mismatch detected. Recreating database...")
-            db_manager.recreate_database()
-            
-            # Add all current documents to the new database
-            for file in current_files:
-                logger.info(f"Adding document to database: {file}")
-                file_path = os.path.join(DOCUMENTS_DIR, file)
-                chunks = document_processor.process_file(file_path)
-                metadata = [{"source": file} for _ in chunks]
-                db_manager.add_texts(chunks, metadata)
-        
-        # Verify the database state after cleanup
-        final_db_documents = db_manager.get_all_sources()
-        logger.debug(f"Documents in database after cleanup: {final_db_documents}")
-        
-        logger.info("Database cleanup completed.")
-    except Exception as e:
-        logger.error(f"Error during database cleanup: {str(e)}", exc_info=True)
+        return folder_registry.get(folder)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Folder not registered: {folder}")
+
+
+def start_rescan_job(kind, operation, folder=None):
+    """Run `operation(context, job)` for a folder (default: the active one) as a background job."""
+    path = folder_registry.get(folder).path
+
+    def run(job):
+        operation(folder_registry.get(path), job)
+    return job_manager.submit(kind, path, run)
 
 
 @app.middleware("http")
@@ -193,12 +243,15 @@ async def log_requests(request: Request, call_next):
 
 
 @app.get("/db-state")
-async def get_db_state():
+async def get_db_state(folder: Optional[str] = None):
+    context = get_folder_context(folder)
     try:
-        db_documents = db_manager.get_all_sources()
-        db_files = os.listdir(DB_DIR)
+        db_documents = context.db_manager.get_all_sources()
+        db_files = os.listdir(context.db_dir)
         return {
             "documents_in_db": list(db_documents),
+            "sources": context.db_manager.sources.list(),
+            "dedup": context.db_manager.dedup_stats(),
             "files_in_db_directory": db_files
         }
     except Exception as e:
@@ -206,97 +259,221 @@ async def get_db_state():
         raise HTTPException(status_code=500, detail=str(e))    
 
 
-from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import StreamingResponse
-from pydantic import BaseModel
-import asyncio
-import json
+def stream_response(events, request, media_type="application/x-ndjson", background=None):
+    """Stream event dicts as NDJSON frames, gzip-compressed when enabled and accepted by the client."""
+    compress = config.get("stream_compression", False) and "gzip" in request.headers.get("accept-encoding", "")
+    frames = ndjson_frames(events, window=config.get("stream_window_ms", 30) / 1000,
+                           max_bytes=config.get("stream_frame_bytes", 16384), compress=compress)
+    headers = {"Content-Encoding": "gzip", "Vary": "Accept-Encoding"} if compress else None
+    return StreamingResponse(frames, media_type=media_type, headers=headers, background=background)
 
-class QueryInput(BaseModel):
-    text: str
-    k: int = 5
 
 @app.post("/query")
 async def query_documents(query_input: QueryInput, request: Request):
     logger.info(f"Received query: {query_input}")
-    if not SELECTED_FOLDER:
-        raise HTTPException(status_code=400, detail="No folder selected. Please select a folder first.")
-    
-    return StreamingResponse(query_stream(query_input.text, query_input.k, request), media_type="application/json")
+    contexts = [get_folder_context(folder) for folder in (query_input.folders or [None])]
+    # Admission happens before streaming starts, so an overloaded server can still answer 429
+    try:
+        ticket = scheduler.submit(INTERACTIVE)
+    except QueueFull as e:
+        logger.warning(f"Rejecting query: {str(e)}")
+        return JSONResponse(status_code=429, content={"error": str(e), "retry_after": e.retry_after},
+                            headers={"Retry-After": str(e.retry_after)})
+
+    # The background task releases the ticket even if the stream is never started
+    return stream_response(query_stream(query_input.text, query_input.k, contexts, ticket), request,
+                           media_type="application/json", background=BackgroundTask(scheduler.release, ticket))
+
+def open_query(message):
+    """Admit a WebSocket query message; returns its event stream and the ticket's release."""
+    query_input = QueryInput(text=message.get("text", ""), k=message.get("k", 5), folders=message.get("folders"))
+    contexts = [get_folder_context(folder) for folder in (query_input.folders or [None])]
+    ticket = scheduler.submit(INTERACTIVE)
+    return query_stream(query_input.text, query_input.k, contexts, ticket), lambda: scheduler.release(ticket)
+
+@app.websocket("/ws")
+async def query_channel(websocket: WebSocket):
+    """Run many concurrent queries over one connection; see QueryChannel for the protocol."""
+    channel = QueryChannel(websocket, open_query,
+                           credit=config.get("ws_initial_credit", 16),
+                           max_streams=config.get("ws_max_streams", 8),
+                           window=config.get("stream_window_ms", 30) / 1000,
+                           max_bytes=config.get("stream_frame_bytes", 16384))
+    await channel.run()
+
+@app.post("/query/batch")
+async def query_batch(batch_input: BatchQueryInput, request: Request):
+    """Answer many questions at once, streaming one NDJSON line per question id as each completes."""
+    logger.info(f"Received batch of {len(batch_input.questions)} questions")
+    contexts = [get_folder_context(folder) for folder in (batch_input.folders or [None])]
+    items = [(question.id, question.text) for question in batch_input.questions]
+    return stream_response(batch_stream(items, batch_input.k, contexts, batch_input.generate), request)
+
+async def batch_stream(items, k, contexts, generate):
+    try:
+        async for result in run_batch(items, k, contexts, lambda: components.get("llm"), config.get_prompt_template(),
+                                      concurrency=config.get("batch_concurrency", 2),
+                                      embed_workers=config.get("embed_workers", 4),
+                                      generate=generate, scheduler=scheduler):
+            yield result
+    except Exception as e:
+        logger.error(f"Error during batch query: {str(e)}", exc_info=True)
+        yield {"error": f"Si è verificato un errore durante l'elaborazione del batch: {str(e)}"}
+
+async def embed_query(query, context):
+    """Embed `query` with the folder's embeddings client, reusing a cached vector when there is one."""
+    db_manager = context.db_manager
+    spec = getattr(db_manager.embeddings, "spec", getattr(db_manager.embeddings, "model", None))
+    key = (spec, normalize_query(query))
+    vector = query_cache.embeddings.get(key)
+    if vector is None:
+        vector = await db_manager.aembed_query(query)
+        query_cache.embeddings.put(key, vector)
+    return vector
+
+def result_key(context, query, k):
+    # The index version and its write generation, unique across reopens, identify what a cached result was read from
+    return (context.path, context.version, context.db_manager.generation, normalize_query(query), k)
+
+async def search_folders(query, k, contexts):
+    """Search one or more folders, merging results by distance when there are several."""
+    scored = []
+    for context in contexts:
+        key = result_key(context, query, k)
+        hits = query_cache.results.get(key)
+        if hits is None:
+            # Folders built with the same embeddings share one cached query vector
+            vector = await embed_query(query, context)
+            # Run the search off the event loop so background rebuilds and other requests keep being served
+            hits = (await asyncio.to_thread(context.db_manager.search_by_vectors, [vector], k))[0]
+            query_cache.results.put(key, hits)
+        for doc, score in hits:
+            doc = doc.copy(deep=True)
+            if len(contexts) > 1:
+                doc.metadata["folder"] = context.path
+            scored.append((score, doc))
+    scored.sort(key=lambda item: item[0])
+    return [doc for _, doc in scored[:k]]
+
+@app.post("/prefetch")
+async def prefetch(prefetch_input: PrefetchInput):
+    """Warm the embedding and result caches for a query the user is likely to submit."""
+    contexts = [get_folder_context(folder) for folder in (prefetch_input.folders or [None])]
+    k = prefetch_input.k or config.get("k", 5)
+    cached = query_cache.results.get(result_key(contexts[0], prefetch_input.text, k)) is not None
+    start = time.time()
+    try:
+        await search_folders(prefetch_input.text, k, contexts)
+    except Exception as e:
+        logger.warning(f"Prefetch failed: {str(e)}")
+        raise HTTPException(status_code=502, detail=f"Prefetch failed: {str(e)}")
+    return {"cached": cached, "took_ms": round((time.time() - start) * 1000, 1)}
+
+async def prewarm_from_log(context, n):
+    """Fill the caches with the folder's most frequent logged queries."""
+    queries = await asyncio.to_thread(query_log.top, n, context.path)
+    k = config.get("k", 5)
+    start = time.time()
+    for query in queries:
+        try:
+            await search_folders(query, k, [context])
+        except Exception as e:
+            logger.warning(f"Prewarming stopped: {str(e)}")
+            return
+    logger.info(f"Prewarmed {len(queries)} frequent queries in {time.time() - start:.2f}s")
 
-async def query_stream(query: str, k: int, request: Request):
+async def query_stream(query: str, k: int, contexts, ticket):
+    # Yields event dicts, which stream_response serializes and coalesces. A
+    # client disconnect cancels this generator wherever it is waiting, which
+    # aborts the in-flight embedding or generation request to Ollama.
     try:
-        logger.info(f"Performing similarity search with k={k}")
-        docs = db_manager.similarity_search(query, k=k)
+        logger.info(f"Performing similarity search with k={k} over {len(contexts)} folder(s)")
+        started = time.time()
+        docs = await search_folders(query, k, contexts)
+        retrieval_ms = (time.time() - started) * 1000
         logger.info(f"Similarity search returned {len(docs)} documents")
-        yield json.dumps({"debug": f"Similarity search returned {len(docs)} documents"}) + "\n"
-
-        if not docs or (len(docs) == 1 and "An error occurred during the search" in docs[0].page_content):
-            error_message = docs[0].page_content if docs else "No documents found"
-            logger.error(f"Error in similarity search: {error_message}")
-            yield json.dumps({"error": error_message}) + "\n"
+        for doc in docs:
+            # Pending updates to documents people are asking about are ingested sooner
+            ingest_queue.touch(doc.metadata.get("folder", contexts[0].path), [doc.metadata.get("source")])
+        yield {"debug": f"Similarity search returned {len(docs)} documents"}
+
+        if not docs:
+            logger.error("Error in similarity search: No documents found")
+            yield {"error": "No documents found"}
             return
 
         context = "\n".join([doc.page_content for doc in docs])
 
         sources = [doc.metadata.get("source", "Unknown") for doc in docs]
-        unique_sources = list(set(sources))
+        # Files whose near-duplicate chunks were not embedded are sources of the answer too
+        unique_sources = answer_sources(docs)
         logger.info(f"All sources: {sources}")
         logger.info(f"Unique sources: {unique_sources}")
-        yield json.dumps({"debug": f"All sources: {sources}"}) + "\n"
-        yield json.dumps({"debug": f"Unique sources: {unique_sources}"}) + "\n"
-        yield json.dumps({"sources": unique_sources}) + "\n"
+        yield {"debug": f"All sources: {sources}"}
+        yield {"debug": f"Unique sources: {unique_sources}"}
+        yield {"sources": unique_sources}
 
         prompt = config.get_prompt_template().format(context=context, question=query)
         logger.debug(f"Full Generated prompt: {prompt}")
-        yield json.dumps({"debug": f"Full Generated prompt: {prompt}"}) + "\n"
-
+        yield {"debug": f"Full Generated prompt: {prompt}"}
+
+        # Retrieval ran while the ticket was queued; report the queue position until a slot is free
+        position = scheduler.position(ticket)
+        while position:
+            yield {"queue": {"position": position}}
+            new_position = position
+            while new_position == position:
+                new_position = await scheduler.wait(ticket)
+            position = new_position
+
+        llm = await asyncio.to_thread(components.get, "llm")
         logger.info(f"Using LLM with model: {llm.model}")
-        yield json.dumps({"debug": f"Using LLM with model: {llm.model}"}) + "\n"
+        yield {"debug": f"Using LLM with model: {llm.model}"}
 
         response = ""
-        for chunk in llm.stream(prompt):
-            if await request.is_disconnected():
-                logger.info("Client disconnected, stopping generation")
-                break
+        async for chunk in llm.astream(prompt):
             response += chunk
-            yield json.dumps({"answer": chunk}) + "\n"
-            await asyncio.sleep(0.1)
+            yield {"answer": chunk}
         
         if not response.strip():
             logger.warning("No response generated")
-            yield json.dumps({"answer": "Mi dispiace, non ho trovato una risposta adeguata basata sul contesto fornito."}) + "\n"
-            yield json.dumps({"debug": "No response generated"}) + "\n"
+            yield {"answer": "Mi dispiace, non ho trovato una risposta adeguata basata sul contesto fornito."}
+            yield {"debug": "No response generated"}
         else:
             logger.info("Response generated successfully")
-            yield json.dumps({"debug": "Response generated successfully"}) + "\n"
+            yield {"debug": "Response generated successfully"}
+        # The append, and now and then a rewrite of the log, must not block the event loop
+        await asyncio.to_thread(query_log.record, query, [context.path for context in contexts], retrieval_ms,
+                                (time.time() - started) * 1000)
         
+    except asyncio.CancelledError:
+        logger.info("Client disconnected, query cancelled")
+        raise
     except Exception as e:
         logger.error(f"Error during query processing: {str(e)}", exc_info=True)
-        yield json.dumps({"error": f"Si è verificato un errore durante l'elaborazione della query: {str(e)}"}) + "\n"
+        yield {"error": f"Si è verificato un errore durante l'elaborazione della query: {str(e)}"}
+    finally:
+        scheduler.release(ticket)
 
 
 
 @app.get("/documents")
-async def list_documents():
-    if not SELECTED_FOLDER:
-        raise HTTPException(status_code=400, detail="No folder selected. Please select a folder first.")
-    
+async def list_documents(folder: Optional[str] = None):
+    context = get_folder_context(folder)
     try:
-        documents = [f for f in os.listdir(DOCUMENTS_DIR) if os.path.isfile(os.path.join(DOCUMENTS_DIR, f)) and is_valid_document(f)]
+        documents = sorted(find_documents(context.path))
         return {"documents": documents}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error listing documents: {str(e)}")
 
 # Updated refresh-documents endpoint
 @app.get("/refresh-documents")
-async def refresh_documents():
-    if not SELECTED_FOLDER:
-        raise HTTPException(status_code=400, detail="No folder selected. Please select a folder first.")
-    
+async def refresh_documents(folder: Optional[str] = None):
+    get_folder_context(folder)
     try:
-        cleanup_database(db_manager, document_processor, DOCUMENTS_DIR)
-        return {"message": "Documents refreshed successfully"}
+        job, created = start_rescan_job("refresh", refresh_folder, folder)
+        message = "Documents refresh started" if created else "A rebuild is already running for this folder"
+        return {"message": message, "job": job.to_dict()}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error refreshing documents: {str(e)}")
 
@@ -304,52 +481,113 @@ async def refresh_documents():
 @app.get("/config")
 async def get_config():
     models = get_installed_ollama_models()
+    # Answer from the saved config while the registry is still starting up
+    active_folder = folder_registry.active if folder_registry else config.get("current_folder")
     return {
         "prompt_template": config.get_prompt_template(),
         "model": config.get("model", "mistral:latest"),
         "k": config.get("k", 5),
-        "folder_selected": SELECTED_FOLDER is not None,
-        "current_folder": SELECTED_FOLDER or "No folder selected",
+        "embedding_model": config.get("embedding_model", DEFAULT_EMBEDDING_MODEL),
+        "embedding_dimensions": config.get("embedding_dimensions"),
+        "folder_selected": active_folder is not None,
+        "current_folder": active_folder or "No folder selected",
+        "folders": folder_registry.folders if folder_registry else config.get("folders", []),
         "available_models": models
     }
 
 
 @app.post("/config")
 async def update_config(config_update: ConfigUpdate):
-    config.set_prompt_template(config_update.template)
-    config.set("model", config_update.model)
-    config.set("k", config_update.k)
-    global SELECTED_FOLDER
-    SELECTED_FOLDER = config_update.folder
-    config.set("current_folder", config_update.folder)
-    create_llm()  # Recreate the LLM instance with the new model
-    return {"message": "Config updated successfully"}
+    changes = {"prompt_template": config_update.template, "model": config_update.model, "k": config_update.k}
+    # Changing these re-embeds every open folder as a new index version, see reconfigure
+    if config_update.embedding_model:
+        changes["embedding_model"] = config_update.embedding_model
+    if "embedding_dimensions" in config_update.model_fields_set:
+        changes["embedding_dimensions"] = config_update.embedding_dimensions
+    if config_update.folder and os.path.isdir(config_update.folder):
+        registry = get_registry()
+        if os.path.abspath(config_update.folder) != registry.active:
+            # Opening a store reads its index from disk; keep that off the event loop
+            await asyncio.to_thread(registry.activate, config_update.folder)
+            # Saved in the same write as the other settings
+            changes.update(folder_settings())
+    changed = apply_config(changes)
+    return {"message": "Config updated successfully", "changed": sorted(changed)}
 
 @app.post("/config/reset")
 async def reset_config():
-    config.reset_to_default()
-    create_llm()  # Recreate the LLM instance with the default model
-    return {"message": "Config reset to default"}
+    changed = config.reset_to_default()
+    reconfigure(changed)
+    return {"message": "Config reset to default", "changed": sorted(changed)}
 
 
 @app.post("/reset-and-rescan")
-async def reset_and_rescan():
-    if not SELECTED_FOLDER:
-        raise HTTPException(status_code=400, detail="No folder selected. Please select a folder first.")
-    
+async def reset_and_rescan(folder: Optional[str] = None):
+    get_folder_context(folder)
     try:
-        db_manager.clear_database()
-        for filename in os.listdir(DOCUMENTS_DIR):
-            if filename.endswith(('.pdf', '.xml')):  # Adjust the extensions as needed
-                file_path = os.path.join(DOCUMENTS_DIR, filename)
-                chunks = document_processor.process_file(file_path)
-                metadata = [{"source": filename} for _ in chunks]
-                db_manager.add_texts(chunks, metadata)
-        return {"message": "Reset and rescan completed successfully"}
+        job, created = start_rescan_job("reset-and-rescan", reset_and_rescan_database, folder)
+        message = "Reset and rescan started" if created else "A rebuild is already running for this folder"
+        return {"message": message, "job": job.to_dict()}
     except Exception as e:
         logger.error(f"Error during reset and rescan: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Error during reset and rescan: {str(e)}")
 
+@app.post("/ingest")
+async def ingest_documents(ingest_input: IngestInput):
+    """Index documents the user just added ahead of any watcher or background work."""
+    context = get_folder_context(ingest_input.folder)
+    queued, rejected = [], []
+    for path in ingest_input.paths:
+        path = os.path.join(context.path, path)
+        if not os.path.isfile(path) or not is_indexable_path(path, context.path):
+            rejected.append(path)
+            continue
+        task = ingest_queue.submit(context.path, relative_source(path, context.path), INDEX, INGEST_INTERACTIVE)
+        queued.append({"source": task.source, "position": ingest_queue.position(task)})
+    return {"queued": queued, "rejected": rejected}
+
+@app.get("/ingest/queue")
+async def get_ingest_queue():
+    return ingest_queue.to_dict()
+
+@app.get("/index/versions")
+async def list_index_versions(folder: Optional[str] = None):
+    context = get_folder_context(folder)
+    return {"active": context.version, "versions": context.versions.list()}
+
+@app.post("/index/migrate")
+async def migrate(folder: Optional[str] = None):
+    """Rebuild the folder's index as a new version with the current settings, then switch to it."""
+    get_folder_context(folder)
+    job, created = start_rescan_job("migrate", migrate_index, folder)
+    message = "Index migration started" if created else "A rebuild is already running for this folder"
+    return {"message": message, "job": job.to_dict()}
+
+@app.post("/index/rollback")
+async def rollback_index(folder: Optional[str] = None):
+    """Switch back to the version that was active before the current one."""
+    context = get_folder_context(folder)
+    if job_manager.active_for(context.path):
+        raise HTTPException(status_code=409, detail="A rebuild is running for this folder")
+    version = context.versions.previous()
+    if version is None:
+        raise HTTPException(status_code=400, detail="No previous index version to roll back to")
+    try:
+        await asyncio.to_thread(context.activate_version, version)
+    except Exception as e:
+        logger.error(f"Error rolling back to index version {version}: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error rolling back: {str(e)}")
+    return {"message": f"Rolled back to index version {version}", "active": version}
+
+@app.post("/index/gc")
+async def gc_index_versions(folder: Optional[str] = None, keep: int = 0):
+    """Delete index versions other than the active one and the `keep` most recent before it."""
+    context = get_folder_context(folder)
+    if job_manager.active_for(context.path):
+        raise HTTPException(status_code=409, detail="A rebuild is running for this folder")
+    removed = await asyncio.to_thread(context.versions.gc, keep, context.open_versions())
+    return {"removed": removed, "versions": context.versions.list()}
+
 @app.post("/set-folder")
 async def set_folder(folder: FolderPath):
     try:
@@ -359,38 +597,111 @@ async def set_folder(folder: FolderPath):
         if not os.access(folder.path, os.R_OK | os.W_OK):
             raise HTTPException(status_code=403, detail="No permission to access folder")
 
-        # Update the global variables
-        global SELECTED_FOLDER, DB_DIR, DOCUMENTS_DIR
-        SELECTED_FOLDER = folder.path
-        DB_DIR = os.path.join(SELECTED_FOLDER, '.raggy_db')
-        DOCUMENTS_DIR = folder.path
-
-        # Create necessary directories
-        os.makedirs(DB_DIR, exist_ok=True)
-
-        # Update config.json
-        config_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'config.json')
-        with open(config_path, 'r+') as f:
-            data = json.load(f)
-            data['current_folder'] = SELECTED_FOLDER
-            f.seek(0)
-            json.dump(data, f, indent=4)
-            f.truncate()
-
-        # Reinitialize components with new folder
-        initialize_components()
-        
-        return {"message": f"Folder set to {SELECTED_FOLDER}"}
+        # Switching only moves the active pointer: the folder's store is
+        # reused from the LRU when open and its watcher is already scheduled
+        path = await asyncio.to_thread(get_registry().activate, folder.path)
+        save_folders()
+        start_rescan_job("refresh", refresh_folder, path)
+
+        return {"message": f"Folder set to {path}"}
     except HTTPException as he:
         raise he
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error setting folder: {str(e)}")
 
+@app.get("/folders")
+async def list_folders():
+    registry = get_registry()
+    return {
+        "active": registry.active,
+        "folders": [
+            {"path": path, "active": path == registry.active, "open": registry.is_open(path),
+             # Only open folders report it, listing folders never opens a store
+             "dedup": registry.get(path).db_manager.dedup_stats() if registry.is_open(path) else None}
+            for path in registry.folders
+        ],
+    }
+
+
+@app.post("/folders")
+async def add_folder(folder: FolderPath):
+    if not os.path.isdir(folder.path):
+        raise HTTPException(status_code=400, detail="Folder does not exist")
+    if not os.access(folder.path, os.R_OK | os.W_OK):
+        raise HTTPException(status_code=403, detail="No permission to access folder")
+    path = get_registry().register(folder.path)
+    save_folders()
+    job, _ = start_rescan_job("refresh", refresh_folder, path)
+    return {"message": f"Folder registered: {path}", "job": job.to_dict()}
+
+
+@app.delete("/folders")
+async def remove_folder(path: str):
+    if not get_registry().unregister(path):
+        raise HTTPException(status_code=404, detail=f"Folder not registered: {path}")
+    save_folders()
+    return {"message": f"Folder removed: {path}"}
+
+
 async def periodic_refresh():
     while True:
         await asyncio.sleep(60)  # Refresh every 60 seconds
         logger.info("Performing periodic database refresh")
-        cleanup_database()
+        for path in folder_registry.folders:
+            start_rescan_job("refresh", refresh_folder, path)
+
+
+@app.get("/scheduler")
+async def get_scheduler():
+    """Generation slots, queue length and admission counters."""
+    return scheduler.to_dict()
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """Generation and embedding counters, including the model time freed by cancelled queries."""
+    from .ollama_client import metrics_snapshot
+    from .ndjson_stream import metrics_snapshot as stream_metrics_snapshot
+    return {"ollama": metrics_snapshot(), "streams": stream_metrics_snapshot(), "websocket": dict(ws_metrics), "scheduler": scheduler.to_dict(), "query_cache": query_cache.to_dict(),
+            "ingest_queue": ingest_queue.to_dict()}
+
+
+@app.get("/jobs")
+async def list_jobs():
+    return {"jobs": [job.to_dict() for job in job_manager.list()]}
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+
+@app.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    job = job_manager.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+
+@app.get("/jobs/{job_id}/stream")
+async def stream_job(job_id: str, interval: float = 0.5):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def job_events():
+        while True:
+            state = job.to_dict()
+            yield json.dumps(state) + "\n"
+            if job.finished:
+                break
+            await asyncio.sleep(interval)
+
+    return StreamingResponse(job_events(), media_type="application/json")
 
 
 def get_installed_ollama_models():
@@ -433,9 +744,45 @@ async def list_models():
 async def root():
     return {"message": "Local RAG App Backend is running"}
 
+async def warm_start():
+    """Bring the service up from what is already persisted.
+
+    The active folder's existing index is opened and loaded into memory so
+    queries can be served right away; reconciling it with the files on disk
+    then runs as a background job.
+    """
+    try:
+        await asyncio.to_thread(initialize_components)
+
+        startup_state["phase"] = "loading_index"
+        if folder_registry.active:
+            context = await asyncio.to_thread(folder_registry.get)
+            await asyncio.to_thread(context.db_manager.preload)
+
+        startup_state["phase"] = "ready"
+        startup_state["ready_at"] = time.time()
+        logger.info(f"Ready to serve queries after {startup_state['ready_at'] - startup_state['started_at']:.2f}s")
+    except Exception as e:
+        startup_state["phase"] = "failed"
+        startup_state["error"] = str(e)
+        logger.error(f"Error during startup: {str(e)}", exc_info=True)
+        return
+
+    if folder_registry.active:
+        start_rescan_job("reconcile", refresh_folder)
+        prewarm = config.get("prewarm_queries", 20)
+        if prewarm:
+            global prewarm_task
+            prewarm_task = asyncio.create_task(prewarm_from_log(folder_registry.get(), prewarm))
+
+
 @app.on_event("startup")
 async def startup_event():
-    cleanup_database()
+    startup_state["started_at"] = time.time()
+    scheduler.configure(slots=config.get("generation_slots", 1), max_queue=config.get("generation_queue", 16))
+    global startup_task
+    # Keep a reference so the task is not garbage collected while running
+    startup_task = asyncio.create_task(warm_start())
     #asyncio.create_task(periodic_refresh())
 
 
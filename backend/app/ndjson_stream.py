@@ -0,0 +1,163 @@
+# File: backend/app/ndjson_stream.py
+
+import time
+import zlib
+import asyncio
+import logging
+
+import anyio
+import orjson
+
+logger = logging.getLogger(__name__)
+
+# Totals over every stream written, for /metrics
+metrics = {
+    "streams": 0,
+    "events": 0,
+    "frames": 0,
+    "bytes": 0,
+    "cpu_seconds": 0.0,
+}
+
+
+def encode(event):
+    return orjson.dumps(event) + b"\n"
+
+
+def metrics_snapshot():
+    """The totals plus per-stream averages."""
+    snapshot = dict(metrics)
+    streams = metrics["streams"]
+    snapshot["frames_per_stream"] = round(metrics["frames"] / streams, 1) if streams else None
+    snapshot["cpu_ms_per_stream"] = round(metrics["cpu_seconds"] * 1000 / streams, 3) if streams else None
+    return snapshot
+
+
+def _event_size(event):
+    # Cheap estimate without serializing: string payloads plus some framing
+    return 16 + sum(len(value) for value in event.values() if isinstance(value, str))
+
+
+class _Batch:
+    """Events buffered for the next batch, with consecutive answer tokens merged."""
+
+    def __init__(self):
+        self.events = []
+        self.answer = []
+        self.size = 0
+
+    def add(self, event):
+        if len(event) == 1 and "answer" in event:
+            if event["answer"]:
+                self.answer.append(event["answer"])
+                self.size += len(event["answer"])
+            return
+        self._close_answer()
+        self.events.append(event)
+        self.size += _event_size(event)
+
+    def _close_answer(self):
+        if self.answer:
+            self.events.append({"answer": "".join(self.answer)})
+            self.answer = []
+
+    def __bool__(self):
+        return bool(self.events or self.answer)
+
+    def take(self):
+        self._close_answer()
+        events, self.events, self.size = self.events, [], 0
+        return events
+
+
+async def coalesce(events, window=0.03, max_bytes=16384):
+    """Regroup an async iterator of event dicts into lists, merging consecutive answer tokens.
+
+    A list is yielded `window` seconds after its first event arrived, or as
+    soon as about `max_bytes` are buffered. `events` is consumed by a
+    separate task that only wakes this generator when a list is due, and the
+    window is timed by a loop timer, so a stalled generation still gets its
+    buffered tokens out on time. While a full buffer waits for the consumer,
+    that task stops reading `events`, so a slow consumer holds back the
+    generation instead of growing the buffer. Cancelling the consumer cancels
+    the task, and with it whatever `events` is waiting on.
+    """
+    loop = asyncio.get_running_loop()
+    batch = _Batch()
+    ready = asyncio.Event()
+    space = asyncio.Event()
+    space.set()
+    state = {"timer": None, "done": False, "error": None}
+
+    def batch_due():
+        state["timer"] = None
+        ready.set()
+
+    async def produce():
+        try:
+            async for event in events:
+                batch.add(event)
+                if batch.size >= max_bytes:
+                    space.clear()
+                    ready.set()
+                    await space.wait()
+                elif state["timer"] is None and not ready.is_set():
+                    state["timer"] = loop.call_later(window, batch_due)
+        except Exception as e:
+            state["error"] = e
+        finally:
+            state["done"] = True
+            ready.set()
+
+    producer = asyncio.ensure_future(produce())
+    try:
+        while True:
+            await ready.wait()
+            ready.clear()
+            if state["timer"] is not None:
+                state["timer"].cancel()
+                state["timer"] = None
+            if batch:
+                events_due = batch.take()
+                space.set()
+                yield events_due
+            if state["error"] is not None:
+                raise state["error"]
+            if state["done"] and not batch:
+                break
+    finally:
+        if state["timer"] is not None:
+            state["timer"].cancel()
+        if not producer.done():
+            # Reaches the Ollama request the wrapped stream is waiting on. The
+            # wait is shielded from the response's own cancel scope, so that
+            # request is closed before the response finishes.
+            producer.cancel()
+            with anyio.CancelScope(shield=True):
+                try:
+                    await producer
+                except asyncio.CancelledError:
+                    pass
+
+
+async def ndjson_frames(events, window=0.03, max_bytes=16384, compress=False):
+    """Serialize an async iterator of event dicts as NDJSON, coalesced into frames by `coalesce`."""
+    # gzip framing, so a browser decodes the stream without any client code
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    cpu = 0.0
+    metrics["streams"] += 1
+    try:
+        async for batch in coalesce(events, window, max_bytes):
+            started = time.thread_time()
+            frame = b"".join(encode(event) for event in batch)
+            if compressor is not None:
+                frame = compressor.compress(frame) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            cpu += time.thread_time() - started
+            metrics["events"] += len(batch)
+            metrics["frames"] += 1
+            metrics["bytes"] += len(frame)
+            yield frame
+        if compressor is not None:
+            yield compressor.flush()
+    finally:
+        metrics["cpu_seconds"] += cpu
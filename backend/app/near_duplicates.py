@@ -0,0 +1,243 @@
+# File: backend/app/near_duplicates.py
+
+import re
+import logging
+
+import mmh3
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS minhash (
+        chunk INTEGER PRIMARY KEY,
+        source TEXT NOT NULL,
+        signature BLOB NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS minhash_source ON minhash (source)",
+    """
+    CREATE TABLE IF NOT EXISTS minhash_bands (
+        band INTEGER NOT NULL,
+        bucket INTEGER NOT NULL,
+        chunk INTEGER NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS minhash_bands_bucket ON minhash_bands (band, bucket)",
+    "CREATE INDEX IF NOT EXISTS minhash_bands_chunk ON minhash_bands (chunk)",
+    """
+    CREATE TABLE IF NOT EXISTS duplicates (
+        chunk INTEGER PRIMARY KEY,
+        source TEXT NOT NULL,
+        canonical INTEGER NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS duplicates_canonical ON duplicates (canonical)",
+    "CREATE INDEX IF NOT EXISTS duplicates_source ON duplicates (source)",
+]
+
+# A prime above 2**32, for the (a * x + b) mod p permutations of shingle hashes
+_PRIME = np.uint64(4294967311)
+_WORD = re.compile(r"\w+")
+
+
+class DedupPlan:
+    """How a list of chunk texts relates to the index: per text, None for a
+    new canonical chunk, ("chunk", id) for a near-duplicate of a stored one,
+    or ("new", j) for a near-duplicate of text j earlier in the same list.
+    """
+
+    def __init__(self, signatures, refs):
+        self.signatures = signatures
+        self.refs = refs
+
+    @property
+    def unique(self):
+        return [j for j, ref in enumerate(self.refs) if ref is None]
+
+    def make_canonical(self, positions, embeddings, new_embeddings):
+        """Turn `positions` into new canonical chunks; returns the embeddings of `unique` in order.
+
+        `embeddings` are those of the current `unique` texts, `new_embeddings`
+        those of the texts at `positions`.
+        """
+        vectors = dict(zip(self.unique, embeddings))
+        for j, vector in zip(positions, new_embeddings):
+            self.refs[j] = None
+            vectors[j] = vector
+        return [vectors[j] for j in self.unique]
+
+
+class NearDuplicateIndex:
+    """MinHash signatures of an index's canonical chunks, with LSH buckets to find near-duplicates.
+
+    A chunk whose word shingles overlap a canonical chunk's by an estimated
+    Jaccard similarity of at least `threshold` is a near-duplicate of it:
+    its text is still stored, but it is neither embedded nor added to the
+    vector store. Invoice folders repeat the same supplier header and legal
+    boilerplate in every file, so this cuts embedding calls and index size,
+    and keeps copies of one passage from filling the top-k of a search.
+
+    Signatures have `num_perm` components split into `bands` LSH bands;
+    chunks sharing any band's bucket are candidates, verified against the
+    full signature. Everything lives in the index's source registry, so a
+    chunk's dedup rows commit in the same transaction as the chunk.
+    """
+
+    def __init__(self, registry, threshold=0.9, num_perm=64, bands=8, shingle_size=3):
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) must be a multiple of bands ({bands})")
+        self.registry = registry
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        # Fixed seed: signatures are persisted and must be comparable across restarts
+        rng = np.random.RandomState(1)
+        self._a = rng.randint(1, 1 << 31, size=num_perm).astype(np.uint64)
+        self._b = rng.randint(0, 1 << 31, size=num_perm).astype(np.uint64)
+        with registry.transaction():
+            for statement in SCHEMA:
+                registry.conn.execute(statement)
+
+    def signature(self, text):
+        words = _WORD.findall(text.lower())
+        size = self.shingle_size
+        shingles = {" ".join(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+        hashes = np.fromiter((mmh3.hash(shingle, signed=False) for shingle in shingles),
+                             dtype=np.uint64, count=len(shingles))
+        permuted = (hashes[:, None] * self._a + self._b) % _PRIME
+        return permuted.min(axis=0).astype(np.uint32)
+
+    def _buckets(self, signature):
+        return [(band, mmh3.hash64(signature[band * self.rows:(band + 1) * self.rows].tobytes(), seed=band)[0])
+                for band in range(self.bands)]
+
+    def _stored_candidates(self, buckets, exclude_source=None):
+        placeholders = ", ".join("(?, ?)" for _ in buckets)
+        with self.registry.reading() as conn:
+            return conn.execute(
+                "SELECT DISTINCT m.chunk, m.signature FROM minhash_bands b JOIN minhash m ON m.chunk = b.chunk "
+                f"WHERE (b.band, b.bucket) IN (VALUES {placeholders}) AND m.source IS NOT ?",
+                [value for bucket in buckets for value in bucket] + [exclude_source]).fetchall()
+
+    def classify(self, texts, exclude_source=None):
+        """Find which of `texts` are near-duplicates of stored chunks or of each other; returns a DedupPlan.
+
+        Chunks of `exclude_source`, which the caller is about to replace, are
+        not candidates.
+        """
+        signatures = [self.signature(text) for text in texts]
+        refs = []
+        batch_buckets = {}
+        for j, signature in enumerate(signatures):
+            buckets = self._buckets(signature)
+            ref, best = None, self.threshold
+            for k in {k for bucket in buckets for k in batch_buckets.get(bucket, [])}:
+                similarity = np.count_nonzero(signature == signatures[k]) / self.num_perm
+                if similarity >= best:
+                    ref, best = ("new", k), similarity
+            for chunk, blob in self._stored_candidates(buckets, exclude_source):
+                similarity = np.count_nonzero(signature == np.frombuffer(blob, dtype=np.uint32)) / self.num_perm
+                if similarity >= best:
+                    ref, best = ("chunk", chunk), similarity
+            refs.append(ref)
+            if ref is None:
+                for bucket in buckets:
+                    batch_buckets.setdefault(bucket, []).append(j)
+        return DedupPlan(signatures, refs)
+
+    def add_canonical(self, chunk, source, signature):
+        with self.registry.transaction():
+            self.registry.conn.execute("INSERT OR REPLACE INTO minhash (chunk, source, signature) VALUES (?, ?, ?)",
+                                       (chunk, source, signature.tobytes()))
+            self.registry.conn.executemany("INSERT INTO minhash_bands (band, bucket, chunk) VALUES (?, ?, ?)",
+                                           [(band, bucket, chunk) for band, bucket in self._buckets(signature)])
+
+    def lost(self, plan):
+        """The positions of `plan` whose stored canonical chunk was removed since `classify`.
+
+        Those must be embedded and indexed as canonical chunks; see `DedupPlan.make_canonical`.
+        """
+        stored = {ref[1] for ref in plan.refs if ref and ref[0] == "chunk"}
+        if not stored:
+            return []
+        placeholders = ", ".join("?" for _ in stored)
+        with self.registry.reading() as conn:
+            existing = {chunk for chunk, in conn.execute(
+                f"SELECT chunk FROM minhash WHERE chunk IN ({placeholders})", list(stored))}
+        return [j for j, ref in enumerate(plan.refs) if ref and ref[0] == "chunk" and ref[1] not in existing]
+
+    def record(self, plan, chunk_ids, sources):
+        """Store a plan's rows once its chunks have ids.
+
+        Call inside the chunks' registry transaction, after checking `lost`
+        in that same transaction.
+        """
+        with self.registry.transaction():
+            conn = self.registry.conn
+            for j, ref in enumerate(plan.refs):
+                if ref is None:
+                    self.add_canonical(chunk_ids[j], sources[j], plan.signatures[j])
+                    continue
+                kind, target = ref
+                canonical = chunk_ids[target] if kind == "new" else target
+                conn.execute("INSERT OR REPLACE INTO duplicates (chunk, source, canonical) VALUES (?, ?, ?)",
+                             (chunk_ids[j], sources[j], canonical))
+
+    def orphans(self, source):
+        """Other sources' duplicates that removing `source` leaves without a canonical chunk.
+
+        They come grouped by the canonical chunk they reference, lowest chunk
+        id first; the caller must promote the first chunk of each group, see
+        `promote`, or their texts would no longer be searchable.
+        """
+        groups = {}
+        with self.registry.reading() as conn:
+            for chunk, canonical in conn.execute(
+                    "SELECT d.chunk, d.canonical FROM duplicates d JOIN minhash m ON m.chunk = d.canonical "
+                    "WHERE m.source = ? AND d.source != ? ORDER BY d.chunk", (source, source)):
+                groups.setdefault(canonical, []).append(chunk)
+        return list(groups.values())
+
+    def remove_source(self, source):
+        """Drop a source's rows; returns its `orphans`, which the caller must promote."""
+        with self.registry.transaction():
+            groups = self.orphans(source)
+            conn = self.registry.conn
+            conn.execute("DELETE FROM duplicates WHERE source = ?", (source,))
+            conn.execute("DELETE FROM minhash_bands WHERE chunk IN (SELECT chunk FROM minhash WHERE source = ?)", (source,))
+            conn.execute("DELETE FROM minhash WHERE source = ?", (source,))
+            return groups
+
+    def promote(self, chunk, source, text, duplicates):
+        """Make `chunk` canonical in place of a removed one, for itself and the other `duplicates`."""
+        with self.registry.transaction():
+            conn = self.registry.conn
+            conn.execute("DELETE FROM duplicates WHERE chunk = ?", (chunk,))
+            conn.executemany("UPDATE duplicates SET canonical = ? WHERE chunk = ?",
+                             [(chunk, duplicate) for duplicate in duplicates])
+            self.add_canonical(chunk, source, self.signature(text))
+
+    def duplicate_sources(self, chunk_ids):
+        """Return `{canonical chunk: sorted sources of its duplicates}` for those of `chunk_ids` that have any."""
+        if not chunk_ids:
+            return {}
+        placeholders = ", ".join("?" for _ in chunk_ids)
+        sources = {}
+        with self.registry.reading() as conn:
+            for canonical, source in conn.execute(
+                    f"SELECT DISTINCT canonical, source FROM duplicates WHERE canonical IN ({placeholders})", list(chunk_ids)):
+                sources.setdefault(canonical, []).append(source)
+        return {canonical: sorted(names) for canonical, names in sources.items()}
+
+    def count(self):
+        with self.registry.reading() as conn:
+            return conn.execute("SELECT COUNT(*) FROM duplicates").fetchone()[0]
+
+    def clear(self):
+        with self.registry.transaction():
+            for table in ("minhash", "minhash_bands", "duplicates"):
+                self.registry.conn.execute(f"DELETE FROM {table}")
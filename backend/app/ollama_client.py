@@ -0,0 +1,156 @@
+# File: backend/app/ollama_client.py
+
+import os
+import json
+import time
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BASE_URL = os.environ.get("OLLAMA_HOST", "http://localhost:11434")
+
+# Shared by every client: what was generated, and what was cut short by cancellation
+metrics = {
+    "generations_started": 0,
+    "generations_completed": 0,
+    "generations_cancelled": 0,
+    "generations_failed": 0,
+    "tokens_generated": 0,
+    "generation_seconds": 0.0,
+    "cancelled_after_seconds": 0.0,
+    "cancelled_after_tokens": 0,
+    "embeddings": 0,
+    "embeddings_cancelled": 0,
+}
+
+
+def _record_cancelled(elapsed, tokens):
+    metrics["generations_cancelled"] += 1
+    metrics["cancelled_after_seconds"] += elapsed
+    metrics["cancelled_after_tokens"] += tokens
+
+
+def metrics_snapshot():
+    """The counters plus the model time cancellations freed.
+
+    Savings are estimated against the average completed generation: each
+    cancelled one would otherwise have run that long.
+    """
+    snapshot = dict(metrics)
+    completed = metrics["generations_completed"]
+    cancelled = metrics["generations_cancelled"]
+    if completed:
+        average_seconds = metrics["generation_seconds"] / completed
+        average_tokens = metrics["tokens_generated"] / completed
+        snapshot["generation_seconds_saved"] = round(max(0.0, cancelled * average_seconds - metrics["cancelled_after_seconds"]), 3)
+        snapshot["tokens_saved"] = int(max(0, cancelled * average_tokens - metrics["cancelled_after_tokens"]))
+    else:
+        snapshot["generation_seconds_saved"] = None
+        snapshot["tokens_saved"] = None
+    return snapshot
+
+
+class OllamaClient:
+    """Async access to the Ollama HTTP API.
+
+    Requests are made with httpx, so cancelling the task awaiting one closes
+    its connection and Ollama stops working on it. Cancelling a query
+    therefore frees the model instead of letting it finish an answer nobody
+    reads.
+    """
+
+    def __init__(self, base_url=DEFAULT_BASE_URL):
+        self.base_url = base_url.rstrip("/")
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            import httpx
+            # Generations can take minutes between tokens on a cold model, so reads do not time out
+            self._client = httpx.AsyncClient(base_url=self.base_url, timeout=httpx.Timeout(10.0, read=None))
+        return self._client
+
+    async def embed(self, model, prompt):
+        metrics["embeddings"] += 1
+        try:
+            response = await self.client.post("/api/embeddings", json={"model": model, "prompt": prompt})
+        except asyncio.CancelledError:
+            metrics["embeddings_cancelled"] += 1
+            raise
+        response.raise_for_status()
+        return response.json()["embedding"]
+
+    async def generate_stream(self, model, prompt, options=None):
+        """Yield response tokens as Ollama generates them."""
+        metrics["generations_started"] += 1
+        started = time.time()
+        tokens = 0
+        try:
+            body = {"model": model, "prompt": prompt, "stream": True}
+            if options:
+                body["options"] = options
+            async with self.client.stream("POST", "/api/generate", json=body) as response:
+                if response.status_code != 200:
+                    await response.aread()
+                    raise RuntimeError(f"Ollama returned {response.status_code}: {response.text}")
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
+                    data = json.loads(line)
+                    if "error" in data:
+                        raise RuntimeError(f"Ollama error: {data['error']}")
+                    if data.get("response"):
+                        tokens += 1
+                        yield data["response"]
+                    if data.get("done"):
+                        tokens = data.get("eval_count", tokens)
+                        break
+        except (asyncio.CancelledError, GeneratorExit):
+            # Leaving the stream context above closed the connection, which stops the generation
+            _record_cancelled(time.time() - started, tokens)
+            logger.info(f"Generation cancelled after {time.time() - started:.2f}s and {tokens} tokens")
+            raise
+        except Exception:
+            metrics["generations_failed"] += 1
+            raise
+        metrics["generations_completed"] += 1
+        metrics["tokens_generated"] += tokens
+        metrics["generation_seconds"] += time.time() - started
+
+    async def generate(self, model, prompt, options=None):
+        stream = self.generate_stream(model, prompt, options)
+        try:
+            return "".join([token async for token in stream])
+        finally:
+            await stream.aclose()
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+_clients = {}
+
+
+def get_client(base_url=DEFAULT_BASE_URL):
+    base_url = (base_url or DEFAULT_BASE_URL).rstrip("/")
+    if base_url not in _clients:
+        _clients[base_url] = OllamaClient(base_url)
+    return _clients[base_url]
+
+
+class OllamaLLM:
+    """The generation model handle used by queries."""
+
+    def __init__(self, model, base_url=DEFAULT_BASE_URL):
+        self.model = model
+        self.client = get_client(base_url)
+
+    def astream(self, prompt):
+        return self.client.generate_stream(self.model, prompt)
+
+    async def agenerate(self, prompt):
+        return await self.client.generate(self.model, prompt)
@@ -0,0 +1,497 @@
+# File: backend/app/quantized_store.py
+
+import os
+import json
+import math
+import threading
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILE = "index.json"
+VECTORS_FILE = "vectors.bin"
+SCALES_FILE = "scales.bin"
+LISTS_FILE = "lists.bin"
+DELETED_FILE = "deleted.bin"
+CENTROIDS_FILE = "centroids.npy"
+RECORDS_FILE = "records.jsonl"
+OFFSETS_FILE = "records.idx"
+CHUNKS_FILE = "chunks.bin"
+COMPACT_MARKER = "compact.commit"
+
+DTYPES = ("float16", "int8")
+
+
+class QuantizedVectorStore:
+    """An in-process vector store backed by memory-mapped files.
+
+    Vectors are L2-normalised and kept as float16 or as scalar-quantised int8
+    with one float32 scale per row. Small stores are searched exactly, in
+    blocks of NumPy matrix products. Once a store reaches `ivf_min_rows` rows
+    it also trains a coarse inverted-file quantizer (spherical k-means); a
+    search then scores only the rows of the `nprobe` nearest lists, plus rows
+    added since the inverted lists were last built, and reranks them with
+    their stored vectors.
+
+    Opening a store reads only index.json. Vectors are memory-mapped, and
+    texts are read per row through an offset index. Each row also keeps the
+    chunk id from its metadata, so a source's rows are found from the chunk
+    ids the chunk store holds rather than by reading every record.
+
+    Deleting marks rows; once enough are deleted, `compact` rewrites the
+    files without them. Rows are renumbered, ids and chunk ids are kept.
+
+    Distances are squared L2 between normalised vectors (2 - 2 * cosine), the
+    scale Chroma reports, so results from both backends can be merged.
+    """
+
+    def __init__(self, directory, dtype="float16", ivf_min_rows=50_000, nprobe=16, block_rows=32_768,
+                 compact_ratio=0.5, compact_min_rows=4096):
+        if dtype not in DTYPES:
+            raise ValueError(f"Unsupported vector dtype: {dtype}")
+        self.directory = directory
+        self.ivf_min_rows = ivf_min_rows
+        self.nprobe = nprobe
+        self.block_rows = block_rows
+        self.compact_ratio = compact_ratio
+        self.compact_min_rows = compact_min_rows
+        self._lock = threading.RLock()
+        self._maps = None
+        self._centroids = None
+        self._inverted = None
+        self._id_rows = None
+        os.makedirs(directory, exist_ok=True)
+        self._finish_compaction()
+
+        index_path = os.path.join(directory, INDEX_FILE)
+        if os.path.exists(index_path):
+            with open(index_path, "r") as f:
+                self.meta = json.load(f)
+            if self.meta["dtype"] != dtype:
+                logger.warning(f"Store at {directory} uses {self.meta['dtype']}, ignoring requested {dtype}")
+        else:
+            self.meta = self._empty_meta(dtype)
+
+    @staticmethod
+    def _empty_meta(dtype):
+        return {"dtype": dtype, "dim": None, "count": 0, "capacity": 0, "records_bytes": 0,
+                "ivf_lists": 0, "ivf_trained_rows": 0, "chunk_ids": True}
+
+    @property
+    def dtype(self):
+        return self.meta["dtype"]
+
+    @property
+    def dim(self):
+        return self.meta["dim"]
+
+    @property
+    def has_chunk_ids(self):
+        """True if every row was added with a chunk id; stores from before the column have none."""
+        return self.meta.get("chunk_ids", False)
+
+    def count(self):
+        if not self.meta["count"]:
+            return 0
+        return int(self.meta["count"] - np.count_nonzero(self._mapped()["deleted"][:self.meta["count"]]))
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _save_meta(self):
+        tmp = self._path(INDEX_FILE + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump(self.meta, f)
+        os.replace(tmp, self._path(INDEX_FILE))
+
+    def _file_specs(self):
+        specs = {
+            "vectors": (VECTORS_FILE, np.dtype(self.dtype), (self.meta["dim"],)),
+            "lists": (LISTS_FILE, np.dtype(np.int32), ()),
+            "deleted": (DELETED_FILE, np.dtype(np.uint8), ()),
+            "offsets": (OFFSETS_FILE, np.dtype(np.uint64), ()),
+        }
+        if self.dtype == "int8":
+            specs["scales"] = (SCALES_FILE, np.dtype(np.float32), ())
+        if "chunk_ids" in self.meta:
+            specs["chunks"] = (CHUNKS_FILE, np.dtype(np.int64), ())
+        return specs
+
+    def _mapped(self):
+        """Memory-map the data files at the current capacity."""
+        if self._maps is None:
+            with self._lock:
+                if self._maps is None:
+                    capacity = self.meta["capacity"]
+                    self._maps = {
+                        key: np.memmap(self._path(name), dtype=dtype, mode="r+", shape=(capacity,) + shape)
+                        for key, (name, dtype, shape) in self._file_specs().items()
+                    }
+        return self._maps
+
+    def _grow(self, needed):
+        capacity = self.meta["capacity"]
+        if needed <= capacity:
+            return
+        new_capacity = max(needed, capacity * 2, 1024)
+        self._flush()
+        self._maps = None
+        for name, dtype, shape in self._file_specs().values():
+            row_bytes = dtype.itemsize * int(np.prod(shape, dtype=np.int64))
+            with open(self._path(name), "ab") as f:
+                f.truncate(new_capacity * row_bytes)
+        self.meta["capacity"] = new_capacity
+
+    def _flush(self):
+        if self._maps is not None:
+            for mm in self._maps.values():
+                mm.flush()
+
+    @staticmethod
+    def _normalise(matrix):
+        matrix = np.asarray(matrix, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+    def _dequantize(self, rows):
+        """Return the stored vectors of `rows` (a slice or index array) as float32."""
+        maps = self._mapped()
+        vectors = maps["vectors"][rows].astype(np.float32)
+        if self.dtype == "int8":
+            vectors *= maps["scales"][rows][:, None]
+        return vectors
+
+    def add(self, embeddings, texts, metadatas, ids=None):
+        """Append vectors with their texts, metadata and optional ids; returns the new rows."""
+        vectors = self._normalise(embeddings)
+        if vectors.ndim != 2 or len(vectors) != len(texts):
+            raise ValueError("embeddings must be a 2D array with one row per text")
+        with self._lock:
+            if self.meta["dim"] is None:
+                self.meta["dim"] = int(vectors.shape[1])
+            elif vectors.shape[1] != self.meta["dim"]:
+                raise ValueError(f"Vector dimension {vectors.shape[1]} does not match store dimension {self.meta['dim']}")
+
+            start = self.meta["count"]
+            end = start + len(vectors)
+            self._grow(end)
+            maps = self._mapped()
+
+            if self.dtype == "int8":
+                scales = np.abs(vectors).max(axis=1) / 127.0
+                scales[scales == 0] = 1.0
+                maps["vectors"][start:end] = np.round(vectors / scales[:, None]).astype(np.int8)
+                maps["scales"][start:end] = scales
+            else:
+                maps["vectors"][start:end] = vectors.astype(np.float16)
+            centroids = self._load_centroids()
+            maps["lists"][start:end] = np.argmax(vectors @ centroids.T, axis=1) if centroids is not None else -1
+            maps["deleted"][start:end] = 0
+            if "chunks" in maps:
+                chunks = [(metadata or {}).get("chunk") for metadata in metadatas]
+                maps["chunks"][start:end] = [-1 if chunk is None else chunk for chunk in chunks]
+                if None in chunks:
+                    self.meta["chunk_ids"] = False
+
+            with open(self._path(RECORDS_FILE), "ab") as f:
+                # Drop any tail written by an add that did not reach _save_meta
+                f.truncate(self.meta["records_bytes"])
+                offset = self.meta["records_bytes"]
+                for i, (text, metadata) in enumerate(zip(texts, metadatas)):
+                    maps["offsets"][start + i] = offset
+                    record = {"text": text, "metadata": metadata or {}}
+                    if ids is not None:
+                        record["id"] = ids[i]
+                        if self._id_rows is not None:
+                            self._id_rows[ids[i]] = start + i
+                    line = json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n"
+                    f.write(line)
+                    offset += len(line)
+
+            self._flush()
+            self.meta["count"] = end
+            self.meta["records_bytes"] = offset
+            self._save_meta()
+
+            trained = self.meta["ivf_trained_rows"]
+            if end >= self.ivf_min_rows and (not trained or end >= 4 * trained):
+                self.train_ivf()
+            return list(range(start, end))
+
+    def _load_centroids(self):
+        if self._centroids is None and self.meta["ivf_lists"]:
+            self._centroids = np.load(self._path(CENTROIDS_FILE))
+        return self._centroids
+
+    def train_ivf(self, nlist=None, iterations=8, seed=0):
+        """Train the coarse quantizer with spherical k-means and assign every row to a list."""
+        with self._lock:
+            n = self.meta["count"]
+            nlist = nlist or int(min(4096, max(16, 2 * math.sqrt(n))))
+            if n < nlist:
+                return
+            logger.info(f"Training IVF quantizer with {nlist} lists on {n} vectors in {self.directory}")
+            rng = np.random.default_rng(seed)
+            sample_rows = np.sort(rng.choice(n, size=min(n, nlist * 40), replace=False))
+            sample = self._dequantize(sample_rows)
+            centroids = sample[rng.choice(len(sample), size=nlist, replace=False)]
+            for _ in range(iterations):
+                assignment = np.argmax(sample @ centroids.T, axis=1)
+                sums = np.zeros_like(centroids)
+                np.add.at(sums, assignment, sample)
+                empty = np.bincount(assignment, minlength=nlist) == 0
+                sums[empty] = centroids[empty]
+                centroids = self._normalise(sums)
+
+            lists = self._mapped()["lists"]
+            for start in range(0, n, self.block_rows):
+                block = slice(start, min(start + self.block_rows, n))
+                lists[block] = np.argmax(self._dequantize(block) @ centroids.T, axis=1)
+            lists.flush()
+
+            np.save(self._path(CENTROIDS_FILE), centroids)
+            self._centroids = centroids
+            self._inverted = None
+            self.meta["ivf_lists"] = nlist
+            self.meta["ivf_trained_rows"] = n
+            self._save_meta()
+
+    def _inverted_lists(self):
+        """Rows grouped by list, built lazily. Later rows are scanned as an exhaustive tail."""
+        n = self.meta["count"]
+        inverted = self._inverted
+        if inverted is None or (n - inverted[2]) > max(1024, inverted[2] // 10):
+            lists = np.asarray(self._mapped()["lists"][:n])
+            order = np.argsort(lists, kind="stable").astype(np.int64)
+            bounds = np.searchsorted(lists[order], np.arange(self.meta["ivf_lists"] + 1))
+            inverted = self._inverted = (order, bounds, n)
+        return inverted
+
+    def _top_k(self, rows, sims, k):
+        """Keep the k best of `sims` for `rows` (an index array), skipping deleted rows."""
+        sims[self._mapped()["deleted"][rows].astype(bool)] = -np.inf
+        if len(sims) > k:
+            keep = np.argpartition(-sims, k - 1)[:k]
+            rows, sims = rows[keep], sims[keep]
+        return rows, sims
+
+    def _exact(self, queries, k):
+        n = self.meta["count"]
+        best = [(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)) for _ in queries]
+        for start in range(0, n, self.block_rows):
+            rows = np.arange(start, min(start + self.block_rows, n))
+            scores = self._dequantize(slice(rows[0], rows[-1] + 1)) @ queries.T
+            for j in range(len(queries)):
+                block_rows, block_sims = self._top_k(rows, scores[:, j], k)
+                merged_rows = np.concatenate([best[j][0], block_rows])
+                merged_sims = np.concatenate([best[j][1], block_sims])
+                if len(merged_sims) > k:
+                    keep = np.argpartition(-merged_sims, k - 1)[:k]
+                    merged_rows, merged_sims = merged_rows[keep], merged_sims[keep]
+                best[j] = (merged_rows, merged_sims)
+        return best
+
+    def _ivf(self, queries, k):
+        order, bounds, indexed = self._inverted_lists()
+        centroids = self._load_centroids()
+        nprobe = min(self.nprobe, len(centroids))
+        tail = np.arange(indexed, self.meta["count"])
+        probes = np.argpartition(-(queries @ centroids.T), nprobe - 1, axis=1)[:, :nprobe]
+        best = []
+        for j, probe in enumerate(probes):
+            rows = np.sort(np.concatenate([order[bounds[l]:bounds[l + 1]] for l in probe] + [tail]))
+            if len(rows) == 0:
+                best.append((rows, np.empty(0, dtype=np.float32)))
+                continue
+            best.append(self._top_k(rows, self._dequantize(rows) @ queries[j], k))
+        return best
+
+    def search(self, query_embeddings, k=4):
+        """Search with one or more query vectors.
+
+        Returns, per query, a list of `(row, distance)` pairs sorted by
+        increasing distance.
+        """
+        queries = self._normalise(np.atleast_2d(query_embeddings))
+        with self._lock:
+            if not self.meta["count"]:
+                return [[] for _ in range(len(queries))]
+            if queries.shape[1] != self.meta["dim"]:
+                raise ValueError(f"Query dimension {queries.shape[1]} does not match store dimension {self.meta['dim']}")
+            top = self._ivf(queries, k) if self.meta["ivf_lists"] else self._exact(queries, k)
+
+        results = []
+        for rows, sims in top:
+            order = np.argsort(-sims)
+            results.append([(int(rows[i]), float(2.0 - 2.0 * sims[i])) for i in order if np.isfinite(sims[i])])
+        return results
+
+    def search_records(self, query_embeddings, k=4):
+        """Like `search`, with each row's record: per query, `(record, distance)` pairs.
+
+        Rows are renumbered by compaction, so they are looked up under the
+        same lock acquisition as the search that found them.
+        """
+        with self._lock:
+            return [list(zip(self.get_records([row for row, _ in hits]), (distance for _, distance in hits)))
+                    for hits in self.search(query_embeddings, k=k)]
+
+    def get_records(self, rows):
+        """Read the text and metadata of the given rows without loading the rest."""
+        if len(rows) == 0:
+            return []
+        with self._lock:
+            offsets = self._mapped()["offsets"]
+            records = []
+            with open(self._path(RECORDS_FILE), "rb") as f:
+                for row in rows:
+                    f.seek(int(offsets[row]))
+                    records.append(json.loads(f.readline()))
+            return records
+
+    def _iter_records(self):
+        count = self.meta["count"]
+        if not count:
+            return
+        deleted = self._mapped()["deleted"]
+        with open(self._path(RECORDS_FILE), "rb") as f:
+            for row in range(count):
+                line = f.readline()
+                if not deleted[row]:
+                    yield row, json.loads(line)
+
+    def _rows_for_ids(self, ids):
+        # The id map is built on first use, so stores that never upsert by id never scan their records
+        if self._id_rows is None:
+            self._id_rows = {record["id"]: row for row, record in self._iter_records() if "id" in record}
+        return [self._id_rows[i] for i in ids if i in self._id_rows]
+
+    def delete(self, where=None, ids=None, chunks=None):
+        """Mark rows as deleted, by id, by chunk id, or by metadata matching every key in `where`.
+
+        With no argument every row is deleted. Returns the deleted rows.
+        """
+        with self._lock:
+            if not self.meta["count"]:
+                return []
+            maps = self._mapped()
+            deleted = maps["deleted"]
+            if ids is not None:
+                rows = self._rows_for_ids(ids)
+            elif chunks is not None:
+                if not self.has_chunk_ids:
+                    raise ValueError(f"Store at {self.directory} has rows without chunk ids")
+                count = self.meta["count"]
+                rows = np.flatnonzero(np.isin(maps["chunks"][:count], np.asarray(chunks, dtype=np.int64))
+                                      & (deleted[:count] == 0)).tolist()
+            else:
+                rows = [row for row, record in self._iter_records()
+                        if not where or all(record["metadata"].get(key) == value for key, value in where.items())]
+            if rows:
+                deleted[rows] = 1
+                deleted.flush()
+                if self._id_rows is not None:
+                    removed = set(rows)
+                    self._id_rows = {i: row for i, row in self._id_rows.items() if row not in removed}
+                self.maybe_compact()
+            return rows
+
+    def maybe_compact(self):
+        dead = int(np.count_nonzero(self._mapped()["deleted"][:self.meta["count"]]))
+        if dead >= self.compact_min_rows and dead >= self.compact_ratio * self.meta["count"]:
+            self.compact()
+
+    def _finish_compaction(self):
+        """Complete or discard a compaction interrupted between writing and swapping its files."""
+        committed = os.path.exists(self._path(COMPACT_MARKER))
+        for name in (VECTORS_FILE, SCALES_FILE, LISTS_FILE, DELETED_FILE, OFFSETS_FILE, CHUNKS_FILE,
+                     RECORDS_FILE, INDEX_FILE):
+            tmp = self._path(name + ".compact")
+            if os.path.exists(tmp):
+                if committed:
+                    os.replace(tmp, self._path(name))
+                else:
+                    os.remove(tmp)
+        if committed:
+            os.remove(self._path(COMPACT_MARKER))
+
+    def _write_compacted(self, name, write):
+        with open(self._path(name + ".compact"), "wb") as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def compact(self):
+        """Rewrite the data files and records without deleted rows."""
+        with self._lock:
+            count = self.meta["count"]
+            maps = self._mapped()
+            live = np.flatnonzero(maps["deleted"][:count] == 0)
+            if len(live) == count:
+                return
+            if not len(live):
+                self.clear()
+                return
+            self._flush()
+            meta = dict(self.meta, count=len(live), capacity=len(live),
+                        ivf_trained_rows=min(self.meta["ivf_trained_rows"], len(live)))
+
+            offsets = np.zeros(len(live), dtype=np.uint64)
+
+            def write_records(f):
+                with open(self._path(RECORDS_FILE), "rb") as records:
+                    offset = 0
+                    for i, row in enumerate(live):
+                        records.seek(int(maps["offsets"][row]))
+                        line = records.readline()
+                        offsets[i] = offset
+                        f.write(line)
+                        offset += len(line)
+                meta["records_bytes"] = offset
+            self._write_compacted(RECORDS_FILE, write_records)
+            for key, (name, dtype, _) in self._file_specs().items():
+                column = offsets if key == "offsets" else maps[key][live]
+                self._write_compacted(name, np.ascontiguousarray(column, dtype=dtype).tofile)
+            self._write_compacted(INDEX_FILE, lambda f: f.write(json.dumps(meta).encode()))
+
+            self._maps = None
+            self._inverted = None
+            self._id_rows = None
+            # The marker commits the set: once it exists a restart finishes every swap, before it none happens
+            with open(self._path(COMPACT_MARKER), "w"):
+                pass
+            self._finish_compaction()
+            self.meta = meta
+            logger.info(f"Compacted vector store {self.directory}, dropped {count - len(live)} deleted rows")
+
+    def list_sources(self):
+        return set(record["metadata"]["source"] for _, record in self._iter_records()
+                   if "source" in record["metadata"])
+
+    def clear(self):
+        """Drop every vector and record, keeping the configured dtype."""
+        with self._lock:
+            self._maps = None
+            self._centroids = None
+            self._inverted = None
+            self._id_rows = None
+            for name in (VECTORS_FILE, SCALES_FILE, LISTS_FILE, DELETED_FILE, CENTROIDS_FILE, RECORDS_FILE, OFFSETS_FILE,
+                         CHUNKS_FILE):
+                if os.path.exists(self._path(name)):
+                    os.remove(self._path(name))
+            self.meta = self._empty_meta(self.dtype)
+            self._save_meta()
+
+    def close(self):
+        """Flush and unmap the data files; they are mapped again on the next access."""
+        with self._lock:
+            self._flush()
+            self._maps = None
+
+    def preload(self):
+        """Map the data files; pages are faulted in by the OS on first access."""
+        if self.meta["count"]:
+            self._mapped()
+            self._load_centroids()
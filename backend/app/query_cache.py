@@ -0,0 +1,129 @@
+# File: backend/app/query_cache.py
+
+import os
+import json
+import time
+import threading
+import logging
+from collections import OrderedDict, Counter
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_query(text):
+    return " ".join(text.split())
+
+
+class LRUCache:
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def to_dict(self):
+        return {"entries": len(self._entries), "max_entries": self.max_entries, "hits": self.hits, "misses": self.misses}
+
+
+class QueryCache:
+    """Query embeddings and search results, shared by /query, /prefetch and startup prewarming.
+
+    Embeddings are keyed by embedding model and query text. Results are keyed
+    by folder, the folder index's write generation, query and k, so any write
+    to an index makes its cached results unreachable.
+    """
+
+    def __init__(self, max_embeddings=2048, max_results=512):
+        self.embeddings = LRUCache(max_embeddings)
+        self.results = LRUCache(max_results)
+
+    def to_dict(self):
+        return {"embeddings": self.embeddings.to_dict(), "results": self.results.to_dict()}
+
+
+class QueryLog:
+    """A bounded JSON-lines log of answered queries and their latency.
+
+    The file is appended to and rewritten with only the newest `max_entries`
+    lines once it holds twice that many.
+    """
+
+    def __init__(self, path, max_entries=5000):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._lines = None
+
+    def _count_lines(self):
+        if self._lines is None:
+            if os.path.exists(self.path):
+                with open(self.path, "rb") as f:
+                    self._lines = sum(1 for _ in f)
+            else:
+                self._lines = 0
+        return self._lines
+
+    def _read(self):
+        if not os.path.exists(self.path):
+            return []
+        entries = []
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    continue
+        return entries
+
+    def record(self, text, folders, retrieval_ms, total_ms=None):
+        entry = {"q": normalize_query(text), "folders": folders, "retrieval_ms": round(retrieval_ms, 1),
+                 "total_ms": round(total_ms, 1) if total_ms is not None else None, "t": time.time()}
+        try:
+            with self._lock:
+                # Counted before the append, which would otherwise count the first new line twice
+                lines = self._count_lines()
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                self._lines = lines + 1
+                if self._lines >= 2 * self.max_entries:
+                    self._truncate()
+        except OSError as e:
+            logger.warning(f"Could not write query log: {str(e)}")
+
+    def _truncate(self):
+        entries = self._read()[-self.max_entries:]
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for entry in entries:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        os.replace(tmp, self.path)
+        self._lines = len(entries)
+
+    def top(self, n, folder=None):
+        """The `n` most frequent logged queries, optionally only those asked of `folder`."""
+        with self._lock:
+            entries = self._read()
+        counts = Counter(entry["q"] for entry in entries
+                         if folder is None or folder in (entry.get("folders") or []))
+        return [query for query, _ in counts.most_common(n)]
+
+
+query_cache = QueryCache()
@@ -0,0 +1,68 @@
+# File: backend/app/scanner.py
+
+import os
+import logging
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from .utils import is_valid_document, is_ignored_dir
+
+logger = logging.getLogger(__name__)
+
+
+def _scan_dir(path, rel_prefix):
+    """List one directory, returning its documents and subdirectories.
+
+    Directory entries are classified with the d_type returned by scandir, so
+    the only stat call made is the one for each matching document.
+    """
+    files = {}
+    subdirs = []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if not is_ignored_dir(entry.name):
+                            subdirs.append((entry.path, rel_prefix + entry.name + "/"))
+                    elif is_valid_document(entry.name) and entry.is_file():
+                        st = entry.stat()
+                        files[rel_prefix + entry.name] = (st.st_size, st.st_mtime)
+                except OSError as e:
+                    logger.warning(f"Skipping {entry.path}: {str(e)}")
+    except OSError as e:
+        logger.warning(f"Cannot scan directory {path}: {str(e)}")
+    return files, subdirs
+
+
+def scan_documents(root, workers=0):
+    """Recursively find documents below `root`.
+
+    Returns a dict mapping each document's path relative to `root` (always
+    using "/" as separator) to its `(size, mtime)`. With `workers > 1`
+    directories are listed concurrently, which helps on network shares and
+    cold caches where each listing waits on I/O.
+    """
+    if workers and workers > 1:
+        return _scan_parallel(root, workers)
+
+    found = {}
+    pending = [(root, "")]
+    while pending:
+        path, rel_prefix = pending.pop()
+        files, subdirs = _scan_dir(path, rel_prefix)
+        found.update(files)
+        pending.extend(subdirs)
+    return found
+
+
+def _scan_parallel(root, workers):
+    found = {}
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="scan") as executor:
+        running = {executor.submit(_scan_dir, root, "")}
+        while running:
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                files, subdirs = future.result()
+                found.update(files)
+                for path, rel_prefix in subdirs:
+                    running.add(executor.submit(_scan_dir, path, rel_prefix))
+    return found
@@ -0,0 +1,168 @@
+# File: backend/app/scheduler.py
+
+import math
+import time
+import heapq
+import asyncio
+import itertools
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Lower runs first
+INTERACTIVE = 0
+BATCH = 10
+
+
+class QueueFull(Exception):
+    """Raised by `GenerationScheduler.submit` when no more requests can wait."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Generation queue is full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class Ticket:
+    def __init__(self, priority, seq):
+        self.priority = priority
+        self.seq = seq
+        self.granted = False
+        self.released = False
+        self.submitted_at = time.time()
+        self.started_at = None
+        # Set whenever the ticket is granted or moves up the queue
+        self.changed = asyncio.Event()
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class GenerationScheduler:
+    """Admission control in front of the LLM.
+
+    At most `slots` generations run at once; others wait in a priority queue
+    (FIFO within a priority) of at most `max_queue` entries. When the queue is
+    full `submit` fails immediately with QueueFull and a Retry-After estimate,
+    rather than letting every request slow down together. Batch work can be
+    submitted with `bounded=False` and a lower priority, so it waits behind
+    interactive queries without being turned away.
+
+    All methods must be called from the event loop.
+    """
+
+    def __init__(self, slots=1, max_queue=16):
+        self.slots = max(1, slots)
+        self.max_queue = max(0, max_queue)
+        self.running = 0
+        self.waiting = []
+        self._seq = itertools.count()
+        self.avg_seconds = None
+        self.stats = {"admitted": 0, "rejected": 0, "completed": 0, "abandoned": 0}
+
+    def configure(self, slots=None, max_queue=None):
+        if slots is not None:
+            self.slots = max(1, slots)
+        if max_queue is not None:
+            self.max_queue = max(0, max_queue)
+        self._grant()
+
+    def retry_after(self):
+        """Seconds until a queue slot is likely to free up."""
+        per_generation = self.avg_seconds or 5.0
+        return max(1, math.ceil(per_generation * (len(self.waiting) + 1) / self.slots))
+
+    def submit(self, priority=INTERACTIVE, bounded=True):
+        """Queue a generation; the returned ticket is granted a slot immediately if one is free."""
+        queued = sum(1 for ticket in self.waiting if ticket.priority <= priority)
+        if bounded and self.running >= self.slots and queued >= self.max_queue:
+            self.stats["rejected"] += 1
+            raise QueueFull(self.retry_after())
+        ticket = Ticket(priority, next(self._seq))
+        heapq.heappush(self.waiting, ticket)
+        self.stats["admitted"] += 1
+        self._grant()
+        return ticket
+
+    def position(self, ticket):
+        """0 once the ticket holds a slot, otherwise its 1-based place in the queue."""
+        if ticket.granted:
+            return 0
+        return 1 + sum(1 for other in self.waiting if other < ticket)
+
+    async def wait(self, ticket, timeout=None):
+        """Wait until the ticket is granted or its position changes; returns the position."""
+        if not ticket.granted:
+            try:
+                await asyncio.wait_for(ticket.changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            ticket.changed.clear()
+        return self.position(ticket)
+
+    async def acquire(self, ticket):
+        while not ticket.granted:
+            await self.wait(ticket)
+
+    def release(self, ticket):
+        """Give back a slot, or leave the queue if the ticket was never granted."""
+        if ticket.released:
+            return
+        ticket.released = True
+        if ticket.granted:
+            self.running -= 1
+            self.stats["completed"] += 1
+            elapsed = time.time() - ticket.started_at
+            self.avg_seconds = elapsed if self.avg_seconds is None else 0.8 * self.avg_seconds + 0.2 * elapsed
+        else:
+            self.waiting.remove(ticket)
+            heapq.heapify(self.waiting)
+            self.stats["abandoned"] += 1
+        self._grant()
+
+    def _grant(self):
+        while self.waiting and self.running < self.slots:
+            ticket = heapq.heappop(self.waiting)
+            ticket.granted = True
+            ticket.started_at = time.time()
+            self.running += 1
+            ticket.changed.set()
+        # Everyone still waiting may have moved up
+        for ticket in self.waiting:
+            ticket.changed.set()
+
+    def slot(self, priority=INTERACTIVE, bounded=True):
+        """`async with scheduler.slot():` submits, waits for a slot and releases it afterwards."""
+        return _Slot(self, priority, bounded)
+
+    def to_dict(self):
+        return {
+            "slots": self.slots,
+            "max_queue": self.max_queue,
+            "running": self.running,
+            "queued": len(self.waiting),
+            "avg_generation_seconds": round(self.avg_seconds, 3) if self.avg_seconds is not None else None,
+            **self.stats,
+        }
+
+
+class _Slot:
+    def __init__(self, scheduler, priority, bounded):
+        self.scheduler = scheduler
+        self.priority = priority
+        self.bounded = bounded
+        self.ticket = None
+
+    async def __aenter__(self):
+        self.ticket = self.scheduler.submit(self.priority, self.bounded)
+        try:
+            await self.scheduler.acquire(self.ticket)
+        except BaseException:
+            self.scheduler.release(self.ticket)
+            raise
+        return self.ticket
+
+    async def __aexit__(self, *exc):
+        self.scheduler.release(self.ticket)
+
+
+scheduler = GenerationScheduler()
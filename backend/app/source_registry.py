@@ -0,0 +1,160 @@
+# File: backend/app/source_registry.py
+
+import time
+import sqlite3
+import threading
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (
+    source TEXT PRIMARY KEY,
+    chunks INTEGER NOT NULL DEFAULT 0,
+    size INTEGER,
+    mtime REAL,
+    content_hash TEXT,
+    ingested_at REAL
+)
+"""
+
+
+class SourceRegistry:
+    """One row per indexed source, kept in SQLite next to the index.
+
+    Rows hold the source's chunk count, the size, mtime and content hash of
+    the file it was ingested from, and when it was ingested, so listing
+    sources or diffing them against a folder scan reads one small table
+    instead of the whole collection.
+
+    DBManager wraps each chunk write or delete in `transaction()` and touches
+    the registry last, so a failed store write rolls the registry back too.
+    Reads go through `reading()`, on a second connection, so queries do not
+    wait behind a write transaction.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._owner = None
+        self._conn = None
+        self._read_lock = threading.Lock()
+        self._read_conn = None
+        self.conn.execute(SCHEMA)
+
+    @property
+    def conn(self):
+        # Reopened on use after close(), for requests still holding an evicted folder
+        if self._conn is None:
+            with self._lock:
+                if self._conn is None:
+                    # Transactions are managed explicitly, see transaction()
+                    conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+                    conn.execute("PRAGMA journal_mode=WAL")
+                    conn.execute("PRAGMA synchronous=NORMAL")
+                    self._conn = conn
+        return self._conn
+
+    @contextmanager
+    def transaction(self):
+        """A transaction that nests: only the outermost block commits or rolls back."""
+        with self._lock:
+            if self._depth == 0:
+                self.conn.execute("BEGIN IMMEDIATE")
+                self._owner = threading.get_ident()
+            self._depth += 1
+            try:
+                yield self
+            except BaseException:
+                self._depth -= 1
+                if self._depth == 0:
+                    self._owner = None
+                    self.conn.execute("ROLLBACK")
+                raise
+            self._depth -= 1
+            if self._depth == 0:
+                self._owner = None
+                self.conn.execute("COMMIT")
+
+    @contextmanager
+    def reading(self):
+        """A connection to read from.
+
+        Inside a transaction of the calling thread that is the transaction's
+        connection, so its uncommitted writes are seen. Otherwise it is the
+        read connection, which in WAL mode sees the last commit rather than
+        waiting for a running write transaction.
+        """
+        if self._owner == threading.get_ident():
+            with self._lock:
+                yield self.conn
+            return
+        with self._read_lock:
+            if self._read_conn is None:
+                self._read_conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+                self._read_conn.execute("PRAGMA query_only=ON")
+            yield self._read_conn
+
+    def add_chunks(self, counts):
+        """Add `{source: n}` chunks to the sources' counts, creating rows as needed."""
+        now = time.time()
+        with self.transaction():
+            self.conn.executemany(
+                "INSERT INTO sources (source, chunks, ingested_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(source) DO UPDATE SET chunks = chunks + excluded.chunks, ingested_at = excluded.ingested_at",
+                [(source, n, now) for source, n in counts.items()])
+
+    def record_file(self, source, size=None, mtime=None, content_hash=None):
+        """Record the file a source was ingested from; the row exists even if it produced no chunks."""
+        with self.transaction():
+            self.conn.execute(
+                "INSERT INTO sources (source, size, mtime, content_hash, ingested_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(source) DO UPDATE SET size = excluded.size, mtime = excluded.mtime, "
+                "content_hash = excluded.content_hash, ingested_at = excluded.ingested_at",
+                (source, size, mtime, content_hash, time.time()))
+
+    def remove(self, source):
+        with self.transaction():
+            self.conn.execute("DELETE FROM sources WHERE source = ?", (source,))
+
+    def clear(self):
+        with self.transaction():
+            self.conn.execute("DELETE FROM sources")
+
+    def sources(self):
+        with self.reading() as conn:
+            return set(row[0] for row in conn.execute("SELECT source FROM sources"))
+
+    def files(self):
+        """Return `{source: (size, mtime, content_hash)}` for every source."""
+        with self.reading() as conn:
+            return {row[0]: row[1:] for row in conn.execute("SELECT source, size, mtime, content_hash FROM sources")}
+
+    def get(self, source):
+        with self.reading() as conn:
+            cursor = conn.execute("SELECT * FROM sources WHERE source = ?", (source,))
+            row = cursor.fetchone()
+            return dict(zip([c[0] for c in cursor.description], row)) if row else None
+
+    def list(self):
+        with self.reading() as conn:
+            cursor = conn.execute("SELECT * FROM sources ORDER BY source")
+            columns = [c[0] for c in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor]
+
+    def is_empty(self):
+        with self.reading() as conn:
+            return conn.execute("SELECT 1 FROM sources LIMIT 1").fetchone() is None
+
+    def close(self):
+        # Waits for a running transaction, which holds the lock
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+        with self._read_lock:
+            if self._read_conn is not None:
+                self._read_conn.close()
+                self._read_conn = None
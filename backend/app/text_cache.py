@@ -0,0 +1,137 @@
+# File: backend/app/text_cache.py
+
+import os
+import json
+import zlib
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class TextCache:
+    """Extracted document text on disk, keyed by file content hash.
+
+    Each entry is one zlib-compressed JSON file holding the records a file
+    was parsed into, before chunking, so changing the chunker or re-indexing
+    an unchanged file does not parse it again. Reads refresh an entry's
+    mtime, and once the cache exceeds `max_bytes` the least recently used
+    entries are deleted.
+    """
+
+    SUFFIX = ".json.z"
+
+    def __init__(self, directory, max_bytes=512 * 1024 * 1024, level=6):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.level = level
+        self._lock = threading.Lock()
+        self._size = None
+        self.stats = {"hits": 0, "misses": 0, "evicted": 0}
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + self.SUFFIX)
+
+    def _entries(self):
+        """Yield `(path, size, mtime)` for every entry."""
+        if not os.path.isdir(self.directory):
+            return
+        for prefix in os.scandir(self.directory):
+            if not prefix.is_dir():
+                continue
+            for entry in os.scandir(prefix.path):
+                if entry.name.endswith(self.SUFFIX):
+                    try:
+                        st = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    yield entry.path, st.st_size, st.st_mtime
+
+    def size(self):
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._entries())
+            return self._size
+
+    def get(self, key, kind):
+        """Return the cached records of `kind` for `key`, or None."""
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                entry = json.loads(zlib.decompress(f.read()).decode("utf-8"))
+            os.utime(path)
+        except FileNotFoundError:
+            self.stats["misses"] += 1
+            return None
+        except (OSError, ValueError, zlib.error) as e:
+            logger.warning(f"Discarding unreadable text cache entry {key}: {str(e)}")
+            self._remove(path)
+            self.stats["misses"] += 1
+            return None
+        if entry.get("kind") != kind:
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        return entry["records"]
+
+    def put(self, key, kind, records):
+        data = zlib.compress(json.dumps({"kind": kind, "records": records}, ensure_ascii=False).encode("utf-8"), self.level)
+        if len(data) > self.max_bytes:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp, "wb") as f:
+                f.write(data)
+            old_size = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.warning(f"Could not write text cache entry {key}: {str(e)}")
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            return
+        total = self.size()
+        with self._lock:
+            self._size = total + len(data) - old_size
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def _remove(self, path):
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except FileNotFoundError:
+            return
+        with self._lock:
+            if self._size is not None:
+                self._size -= size
+
+    def evict(self):
+        """Delete least recently used entries until the cache is within `max_bytes`."""
+        with self._lock:
+            entries = sorted(self._entries(), key=lambda entry: entry[2])
+            total = sum(size for _, size, _ in entries)
+            evicted = 0
+            for path, size, _ in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                evicted += 1
+            self._size = total
+            self.stats["evicted"] += evicted
+        if evicted:
+            logger.info(f"Evicted {evicted} text cache entries")
+
+    def clear(self):
+        with self._lock:
+            for path, _, _ in list(self._entries()):
+                os.remove(path)
+            self._size = 0
+
+    def to_dict(self):
+        return {"bytes": self.size(), "max_bytes": self.max_bytes, **self.stats}
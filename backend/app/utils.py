@@ -2,7 +2,32 @@
 
 
 import os
+import hashlib
 
 def is_valid_document(filename):
-    return (not filename.startswith('.') and 
-            os.path.splitext(filename)[1].lower() in ['.pdf', '.xml'])
\ No newline at end of file
+    return (not filename.startswith('.') and
+            os.path.splitext(filename)[1].lower() in ['.pdf', '.xml'])
+
+def is_ignored_dir(dirname):
+    # Hidden directories include the .raggy_db store kept inside each folder
+    return dirname.startswith('.')
+
+def relative_source(path, root):
+    """Return the source key for `path`: its path relative to `root` using "/" separators."""
+    return os.path.relpath(path, root).replace(os.sep, '/')
+
+def is_indexable_path(path, root):
+    """Check that `path` is a document below `root` and not inside an ignored directory."""
+    rel = os.path.relpath(path, root)
+    if rel.startswith('..'):
+        return False
+    parts = rel.split(os.sep)
+    return is_valid_document(parts[-1]) and not any(is_ignored_dir(p) for p in parts[:-1])
+
+def content_hash(path, block_size=1 << 20):
+    """Return a hex digest of the file's contents, read in blocks."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
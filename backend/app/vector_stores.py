@@ -0,0 +1,450 @@
+# File: backend/app/vector_stores.py
+
+import os
+import re
+import json
+import uuid
+import threading
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class VectorStore:
+    """The storage operations DBManager needs from a vector index.
+
+    Stores hold precomputed embeddings; DBManager owns the embeddings client.
+    Distances returned by `search` are squared L2, lower meaning closer
+    (the quantized store normalises vectors first, so its distances are
+    2 - 2 * cosine).
+    """
+
+    name = None
+
+    def upsert(self, ids, embeddings, texts, metadatas):
+        """Insert rows, replacing existing rows with the same ids.
+
+        `ids=None` adds new rows; `texts=None` stores vectors and metadata only,
+        for callers that keep chunk texts elsewhere.
+        """
+        raise NotImplementedError
+
+    def delete(self, where=None):
+        """Delete rows whose metadata matches every key in `where`, or every row if None."""
+        raise NotImplementedError
+
+    def delete_chunks(self, chunk_ids, where):
+        """Delete the rows of `chunk_ids`, which are the rows whose metadata matches `where`.
+
+        Stores that can find rows by chunk id override this; the rest filter by metadata.
+        """
+        self.delete(where)
+
+    def search(self, query_embeddings, k=4):
+        """Return, per query vector, up to k `(text, metadata, distance)` tuples sorted by distance."""
+        raise NotImplementedError
+
+    def list_sources(self):
+        raise NotImplementedError
+
+    def count(self):
+        raise NotImplementedError
+
+    def clear(self):
+        self.delete()
+
+    def preload(self):
+        """Load whatever the first search would otherwise load."""
+
+    def close(self):
+        """Release open files and connections; a store used again afterwards reopens them."""
+
+
+def _stop_chroma_system(client):
+    """Stop the System behind a Chroma client and drop it from Chroma's per-path cache.
+
+    chromadb keeps one System per path for the life of the process. Its
+    public clear_system_cache() drops the Systems of every path, including
+    the folders still open, so this goes through the cache itself. It is the
+    only place that touches chromadb internals; they are those of the
+    version pinned in requirements.txt, so check it when upgrading.
+    """
+    from chromadb.api.shared_system_client import SharedSystemClient
+    system = SharedSystemClient._identifier_to_system.pop(getattr(client, "_identifier", None), None)
+    if system is not None:
+        system.stop()
+
+
+class ChromaStore(VectorStore):
+    """A Chroma collection, accessed through the public chromadb client API.
+
+    Uses the collection name LangChain's Chroma wrapper created, so indexes
+    built by earlier versions keep working.
+    """
+
+    name = "chroma"
+    COLLECTION = "langchain"
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.client = None
+        self._collection = None
+        self._open()
+
+    def _open(self):
+        import chromadb
+        from chromadb.config import Settings
+        self.client = chromadb.PersistentClient(path=self.directory, settings=Settings(anonymized_telemetry=False))
+        self._collection = self._get_collection()
+
+    @property
+    def collection(self):
+        if self._collection is None:
+            self._open()
+        return self._collection
+
+    def _get_collection(self):
+        # Embeddings are always passed in, so the collection needs no embedding function
+        return self.client.get_or_create_collection(self.COLLECTION, embedding_function=None)
+
+    def close(self):
+        if self.client is None:
+            return
+        _stop_chroma_system(self.client)
+        self.client = self._collection = None
+
+    def upsert(self, ids, embeddings, texts, metadatas):
+        ids = ids or [str(uuid.uuid4()) for _ in embeddings]
+        # Chroma rejects empty metadata dicts
+        metadatas = [metadata or None for metadata in metadatas]
+        self.collection.upsert(ids=list(ids), embeddings=[list(map(float, e)) for e in embeddings],
+                               documents=list(texts) if texts is not None else None, metadatas=metadatas)
+
+    def delete(self, where=None):
+        if where:
+            self.collection.delete(where=where)
+            return
+        # Dropping the collection is much cheaper than deleting every id
+        if self.client is None:
+            self._open()
+        self.client.delete_collection(self.COLLECTION)
+        self._collection = self._get_collection()
+
+    def search(self, query_embeddings, k=4):
+        queries = np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32))
+        if not self.collection.count():
+            return [[] for _ in queries]
+        result = self.collection.query(query_embeddings=queries.tolist(), n_results=k,
+                                       include=["documents", "metadatas", "distances"])
+        return [[(text, metadata or {}, distance) for text, metadata, distance in zip(*hits)]
+                for hits in zip(result["documents"], result["metadatas"], result["distances"])]
+
+    def list_sources(self):
+        metadatas = self.collection.get(include=["metadatas"])["metadatas"]
+        return set(meta["source"] for meta in metadatas if meta and "source" in meta)
+
+    def count(self):
+        return self.collection.count()
+
+    def preload(self):
+        # Chroma loads a collection's HNSW segment on the first query, so query it with a stored vector
+        sample = self.collection.peek(limit=1)
+        embeddings = sample.get("embeddings") if sample else None
+        if embeddings is None or len(embeddings) == 0:
+            logger.info("Vector index is empty, nothing to preload")
+            return
+        self.collection.query(query_embeddings=[list(embeddings[0])], n_results=1, include=[])
+
+
+class MemoryStore(VectorStore):
+    """A float32 NumPy matrix searched exactly, optionally saved to `directory`.
+
+    Meant for small folders and as the reference implementation when
+    comparing engines: every search is brute force, so its results are exact.
+
+    Saved stores are append-only: an upsert appends its vectors and records,
+    a delete appends the file rows it removed, and a later row for an id
+    replaces the earlier one when the files are loaded. Once dead rows
+    outnumber live ones the files are rewritten under the next generation,
+    which store.json switches to atomically.
+    """
+
+    name = "memory"
+    META_FILE = "store.json"
+
+    def __init__(self, directory=None, compact_min_rows=1024):
+        self.directory = directory
+        self.compact_min_rows = compact_min_rows
+        self._lock = threading.RLock()
+        self.vectors = np.empty((0, 0), dtype=np.float32)
+        self.ids, self.texts, self.metadatas = [], [], []
+        # The file row each position was loaded from or appended at
+        self._rows = []
+        self.meta = self._empty_meta(0)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._load()
+        self._positions = {id_: i for i, id_ in enumerate(self.ids)}
+
+    @staticmethod
+    def _empty_meta(generation):
+        return {"generation": generation, "dim": None, "rows": 0, "records_bytes": 0, "deleted": 0}
+
+    def _path(self, kind, generation=None):
+        generation = self.meta["generation"] if generation is None else generation
+        return os.path.join(self.directory, {"vectors": f"vectors.{generation}.f32",
+                                             "records": f"records.{generation}.jsonl",
+                                             "deleted": f"deleted.{generation}.i64"}[kind])
+
+    def _save_meta(self):
+        tmp = os.path.join(self.directory, self.META_FILE + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump(self.meta, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, os.path.join(self.directory, self.META_FILE))
+
+    def _remove_other_generations(self):
+        current = {os.path.basename(self._path(kind)) for kind in ("vectors", "records", "deleted")}
+        for name in os.listdir(self.directory):
+            if re.fullmatch(r"(vectors|records|deleted)\.\d+\.\w+", name) and name not in current:
+                os.remove(os.path.join(self.directory, name))
+
+    def _load(self):
+        meta_path = os.path.join(self.directory, self.META_FILE)
+        if not os.path.exists(meta_path):
+            return
+        with open(meta_path, "r") as f:
+            self.meta = json.load(f)
+        # Files of an interrupted compaction, or of one that finished but was not cleaned up
+        self._remove_other_generations()
+        if not self.meta["rows"]:
+            return
+
+        # Anything past the sizes in store.json was written by an append that did not finish
+        vectors = np.fromfile(self._path("vectors"), dtype=np.float32, count=self.meta["rows"] * self.meta["dim"])
+        vectors = vectors.reshape(self.meta["rows"], self.meta["dim"])
+        with open(self._path("records"), "rb") as f:
+            records = [json.loads(line) for line in f.read(self.meta["records_bytes"]).splitlines()]
+        deleted = set()
+        if self.meta["deleted"]:
+            deleted = set(np.fromfile(self._path("deleted"), dtype=np.int64, count=self.meta["deleted"]).tolist())
+
+        latest = {}
+        for row, (id_, _, _) in enumerate(records):
+            latest[id_] = row
+        self._rows = [row for row in latest.values() if row not in deleted]
+        self._rows.sort()
+        self.vectors = vectors[self._rows]
+        self.ids = [records[row][0] for row in self._rows]
+        self.texts = [records[row][1] for row in self._rows]
+        self.metadatas = [records[row][2] for row in self._rows]
+
+    @staticmethod
+    def _encode_records(ids, texts, metadatas):
+        return b"".join(json.dumps([id_, text, metadata], ensure_ascii=False).encode("utf-8") + b"\n"
+                        for id_, text, metadata in zip(ids, texts, metadatas))
+
+    def _append(self, kind, size, data):
+        with open(self._path(kind), "ab") as f:
+            # Drop any tail written by an append that did not reach _save_meta
+            f.truncate(size)
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _append_rows(self, ids, vectors, texts, metadatas):
+        if not self.directory:
+            return
+        lines = self._encode_records(ids, texts, metadatas)
+        if self.meta["dim"] is None:
+            self.meta["dim"] = int(vectors.shape[1])
+        self._append("vectors", self.meta["rows"] * self.meta["dim"] * 4, np.ascontiguousarray(vectors).tobytes())
+        self._append("records", self.meta["records_bytes"], lines)
+        self.meta["rows"] += len(ids)
+        self.meta["records_bytes"] += len(lines)
+        self._save_meta()
+
+    def _append_deleted(self, rows):
+        if not self.directory:
+            return
+        self._append("deleted", self.meta["deleted"] * 8, np.asarray(rows, dtype=np.int64).tobytes())
+        self.meta["deleted"] += len(rows)
+        self._save_meta()
+
+    def _maybe_compact(self):
+        if not self.directory:
+            return
+        dead = self.meta["rows"] - len(self.ids)
+        if dead >= self.compact_min_rows and dead > len(self.ids):
+            self._compact()
+
+    def _compact(self):
+        """Write the live rows as the next generation and switch store.json to it."""
+        generation = self.meta["generation"] + 1
+        meta = self._empty_meta(generation)
+        if self.ids:
+            lines = self._encode_records(self.ids, self.texts, self.metadatas)
+            for kind, data in (("vectors", np.ascontiguousarray(self.vectors).tobytes()), ("records", lines)):
+                with open(self._path(kind, generation), "wb") as f:
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+            meta.update(dim=int(self.vectors.shape[1]), rows=len(self.ids), records_bytes=len(lines))
+        dead = self.meta["rows"] - len(self.ids)
+        self.meta = meta
+        self._save_meta()
+        self._remove_other_generations()
+        self._rows = list(range(len(self.ids)))
+        logger.info(f"Compacted memory store {self.directory}, dropped {dead} dead rows")
+
+    def upsert(self, ids, embeddings, texts, metadatas):
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        ids = ids or [str(uuid.uuid4()) for _ in embeddings]
+        texts = texts if texts is not None else [None] * len(embeddings)
+        metadatas = [metadata or {} for metadata in metadatas]
+        with self._lock:
+            if len(self.ids) == 0:
+                self.vectors = np.empty((0, embeddings.shape[1]), dtype=np.float32)
+            elif embeddings.shape[1] != self.vectors.shape[1]:
+                raise ValueError(f"Vector dimension {embeddings.shape[1]} does not match store dimension {self.vectors.shape[1]}")
+            self._append_rows(ids, embeddings, texts, metadatas)
+            first_row = self.meta["rows"] - len(ids)
+            new_rows = []
+            for i, id_ in enumerate(ids):
+                position = self._positions.get(id_)
+                if position is None:
+                    self._positions[id_] = len(self.ids) + len(new_rows)
+                    new_rows.append(i)
+                else:
+                    self.vectors[position] = embeddings[i]
+                    self.texts[position] = texts[i]
+                    self.metadatas[position] = metadatas[i]
+                    self._rows[position] = first_row + i
+            if new_rows:
+                self.vectors = np.concatenate([self.vectors, embeddings[new_rows]])
+                self.ids.extend(ids[i] for i in new_rows)
+                self.texts.extend(texts[i] for i in new_rows)
+                self.metadatas.extend(metadatas[i] for i in new_rows)
+                self._rows.extend(first_row + i for i in new_rows)
+            self._maybe_compact()
+
+    def delete(self, where=None):
+        with self._lock:
+            if not where:
+                self.clear()
+                return
+            keep, removed = [], []
+            for i, meta in enumerate(self.metadatas):
+                (removed if all(meta.get(key) == value for key, value in where.items()) else keep).append(i)
+            if not removed:
+                return
+            self._append_deleted([self._rows[i] for i in removed])
+            self.vectors = self.vectors[keep]
+            self.ids = [self.ids[i] for i in keep]
+            self.texts = [self.texts[i] for i in keep]
+            self.metadatas = [self.metadatas[i] for i in keep]
+            self._rows = [self._rows[i] for i in keep]
+            self._positions = {id_: i for i, id_ in enumerate(self.ids)}
+            self._maybe_compact()
+
+    def clear(self):
+        with self._lock:
+            self.vectors = np.empty((0, 0), dtype=np.float32)
+            self.ids, self.texts, self.metadatas, self._rows = [], [], [], []
+            self._positions = {}
+            if self.directory:
+                self._compact()
+
+    def search(self, query_embeddings, k=4):
+        queries = np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32))
+        with self._lock:
+            if not self.ids:
+                return [[] for _ in queries]
+            distances = ((queries ** 2).sum(axis=1)[:, None] + (self.vectors ** 2).sum(axis=1)[None, :]
+                         - 2.0 * queries @ self.vectors.T)
+            k = min(k, len(self.ids))
+            results = []
+            for row in distances:
+                top = np.argpartition(row, k - 1)[:k]
+                top = top[np.argsort(row[top])]
+                results.append([(self.texts[i], self.metadatas[i], float(max(row[i], 0.0))) for i in top])
+            return results
+
+    def list_sources(self):
+        return set(meta["source"] for meta in self.metadatas if "source" in meta)
+
+    def count(self):
+        return len(self.ids)
+
+
+class QuantizedStore(VectorStore):
+    """The VectorStore interface over QuantizedVectorStore (see quantized_store.py)."""
+
+    name = "quantized"
+
+    def __init__(self, directory, dtype="float16"):
+        from .quantized_store import QuantizedVectorStore
+        self.store = QuantizedVectorStore(directory, dtype=dtype)
+
+    def upsert(self, ids, embeddings, texts, metadatas):
+        if ids is not None and self.store.count():
+            self.store.delete(ids=ids)
+        texts = texts if texts is not None else [None] * len(embeddings)
+        self.store.add(embeddings, texts, metadatas, ids=ids)
+
+    def delete(self, where=None):
+        if where:
+            self.store.delete(where)
+        else:
+            self.store.clear()
+
+    def delete_chunks(self, chunk_ids, where):
+        if self.store.has_chunk_ids:
+            self.store.delete(chunks=chunk_ids)
+        else:
+            self.store.delete(where)
+
+    def search(self, query_embeddings, k=4):
+        return [[(record["text"], record["metadata"], distance) for record, distance in hits]
+                for hits in self.store.search_records(query_embeddings, k=k)]
+
+    def list_sources(self):
+        return self.store.list_sources()
+
+    def count(self):
+        return self.store.count()
+
+    def preload(self):
+        self.store.preload()
+
+    def close(self):
+        self.store.close()
+
+
+VECTOR_STORES = {
+    "chroma": lambda directory, options: ChromaStore(directory),
+    "memory": lambda directory, options: MemoryStore(os.path.join(directory, "memory")),
+    "quantized": lambda directory, options: QuantizedStore(os.path.join(directory, "quantized"),
+                                                           dtype=options.get("dtype", "float16")),
+}
+
+
+def detect_vector_backend(directory):
+    """The backend whose files are under `directory`, or None if no store was created there."""
+    if os.path.exists(os.path.join(directory, "quantized", "index.json")):
+        return "quantized"
+    if os.path.exists(os.path.join(directory, "memory", MemoryStore.META_FILE)):
+        return "memory"
+    if os.path.exists(os.path.join(directory, "chroma.sqlite3")):
+        return "chroma"
+    return None
+
+
+def create_vector_store(backend, directory, **options):
+    """Open the `backend` store kept under `directory`."""
+    factory = VECTOR_STORES.get(backend)
+    if factory is None:
+        raise ValueError(f"Unknown vector backend: {backend} (expected one of {', '.join(VECTOR_STORES)})")
+    return factory(directory, options)
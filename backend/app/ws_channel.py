@@ -0,0 +1,215 @@
+# File: backend/app/ws_channel.py
+
+import asyncio
+import logging
+
+import anyio
+import orjson
+from starlette.websockets import WebSocketDisconnect
+
+from .ndjson_stream import coalesce
+
+logger = logging.getLogger(__name__)
+
+# Totals over every connection, for /metrics
+metrics = {
+    "connections": 0,
+    "open_connections": 0,
+    "streams": 0,
+    "cancelled": 0,
+    "rejected": 0,
+    "messages": 0,
+    "credit_stalls": 0,
+}
+
+
+def _count(message, key, default):
+    """A non-negative integer field of a client message."""
+    value = message.get(key, default)
+    if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+        raise ValueError(f"{key} must be a non-negative integer")
+    return value
+
+
+class _Stream:
+    def __init__(self, stream_id, credit):
+        self.id = stream_id
+        self.credit = credit
+        self.has_credit = asyncio.Event()
+        if credit > 0:
+            self.has_credit.set()
+        self.task = None
+
+    def grant(self, n):
+        self.credit += n
+        if self.credit > 0:
+            self.has_credit.set()
+
+    async def spend(self):
+        if self.credit <= 0:
+            metrics["credit_stalls"] += 1
+            await self.has_credit.wait()
+        self.credit -= 1
+        if self.credit <= 0:
+            self.has_credit.clear()
+
+
+class QueryChannel:
+    """Many query streams multiplexed over one WebSocket, tagged by the client's request id.
+
+    The client sends JSON messages:
+
+        {"type": "query", "id": "q1", "text": "...", "k": 5, "folders": [...], "credit": 16}
+        {"type": "cancel", "id": "q1"}
+        {"type": "credit", "id": "q1", "n": 16}
+
+    and receives, for each query, `{"id", "events": [...]}` messages carrying
+    the same event dicts /query streams (answer tokens coalesced), then one
+    of `{"id", "done": true}`, `{"id", "cancelled": true}` or
+    `{"id", "error", "retry_after"?}`.
+
+    Every events message spends one credit of its stream. A stream without
+    credit stops sending; its buffer is bounded by `max_bytes`, after which
+    the generation itself waits, so a slow client never makes the server
+    buffer without limit. Cancelling a stream, or closing the socket, aborts
+    its retrieval or generation exactly as a disconnect does on /query.
+
+    `open_stream(message)` resolves a query message to `(events, release)`,
+    an async iterator of event dicts and a callable run when the stream
+    ends. It may raise; an exception with a `retry_after` attribute is
+    reported with it.
+    """
+
+    def __init__(self, websocket, open_stream, credit=16, max_streams=8, window=0.03, max_bytes=16384):
+        self.websocket = websocket
+        self.open_stream = open_stream
+        self.credit = credit
+        self.max_streams = max_streams
+        self.window = window
+        self.max_bytes = max_bytes
+        self.streams = {}
+        self._send_lock = asyncio.Lock()
+
+    async def send(self, message):
+        # Messages of concurrent streams must not interleave on the socket
+        async with self._send_lock:
+            await self.websocket.send_text(orjson.dumps(message).decode())
+        metrics["messages"] += 1
+
+    async def run(self):
+        """Serve the connection until the client closes it."""
+        await self.websocket.accept()
+        metrics["connections"] += 1
+        metrics["open_connections"] += 1
+        try:
+            while True:
+                text = await self.websocket.receive_text()
+                try:
+                    message = orjson.loads(text)
+                    if not isinstance(message, dict):
+                        raise ValueError("expected a JSON object")
+                except ValueError as e:
+                    await self.send({"id": None, "error": f"Invalid message: {str(e)}"})
+                    continue
+                try:
+                    await self.handle(message)
+                except WebSocketDisconnect:
+                    raise
+                except Exception as e:
+                    # A bad message fails on its own, not the other streams on the connection
+                    logger.warning(f"Invalid WebSocket message: {str(e)}")
+                    await self.send({"id": message.get("id"), "error": str(e)})
+        except WebSocketDisconnect:
+            logger.info("WebSocket client disconnected")
+        finally:
+            metrics["open_connections"] -= 1
+            streams = list(self.streams.values())
+            for stream in streams:
+                stream.task.cancel()
+            # Wait for every stream to release its generation slot and upstream request
+            with anyio.CancelScope(shield=True):
+                await asyncio.gather(*(stream.task for stream in streams), return_exceptions=True)
+
+    async def handle(self, message):
+        kind = message.get("type")
+        stream_id = message.get("id")
+        if stream_id is None:
+            await self.send({"id": None, "error": "Missing id"})
+        elif kind == "query":
+            await self.start(stream_id, message)
+        elif kind == "cancel":
+            await self.cancel(stream_id)
+        elif kind == "credit":
+            stream = self.streams.get(stream_id)
+            if stream is not None:
+                stream.grant(_count(message, "n", 1))
+        else:
+            await self.send({"id": stream_id, "error": f"Unknown message type: {kind}"})
+
+    async def start(self, stream_id, message):
+        if stream_id in self.streams:
+            await self.send({"id": stream_id, "error": "A stream with this id is already running"})
+            return
+        if len(self.streams) >= self.max_streams:
+            metrics["rejected"] += 1
+            await self.send({"id": stream_id, "error": f"Too many concurrent streams (max {self.max_streams})",
+                             "retry_after": 1})
+            return
+        credit = _count(message, "credit", self.credit)
+        try:
+            events, release = self.open_stream(message)
+        except Exception as e:
+            metrics["rejected"] += 1
+            logger.warning(f"Rejecting WebSocket query {stream_id}: {str(e)}")
+            error = {"id": stream_id, "error": str(getattr(e, "detail", e))}
+            if getattr(e, "retry_after", None) is not None:
+                error["retry_after"] = e.retry_after
+            await self.send(error)
+            return
+        try:
+            stream = _Stream(stream_id, credit)
+            stream.task = asyncio.ensure_future(self._pump(stream, events))
+        except BaseException:
+            # Admitted but never started: give the generation slot back
+            release()
+            raise
+        self.streams[stream_id] = stream
+        metrics["streams"] += 1
+
+        def finished(task):
+            # Also runs for a task cancelled before it started
+            self.streams.pop(stream_id, None)
+            release()
+        stream.task.add_done_callback(finished)
+
+    async def _pump(self, stream, events):
+        batches = coalesce(events, self.window, self.max_bytes)
+        try:
+            async for batch in batches:
+                await stream.spend()
+                await self.send({"id": stream.id, "events": batch})
+            await self.send({"id": stream.id, "done": True})
+        except WebSocketDisconnect:
+            pass
+        except Exception as e:
+            logger.error(f"Error in WebSocket stream {stream.id}: {str(e)}", exc_info=True)
+            try:
+                await self.send({"id": stream.id, "error": str(e)})
+            except Exception:
+                pass
+        finally:
+            # Cancelled while waiting for credit, the generator still holds the query open
+            with anyio.CancelScope(shield=True):
+                await batches.aclose()
+
+    async def cancel(self, stream_id):
+        stream = self.streams.get(stream_id)
+        if stream is None:
+            # Already finished; its final message is on its way
+            return
+        stream.task.cancel()
+        with anyio.CancelScope(shield=True):
+            await asyncio.gather(stream.task, return_exceptions=True)
+        metrics["cancelled"] += 1
+        logger.info(f"WebSocket stream {stream_id} cancelled")
+        await self.send({"id": stream_id, "cancelled": True})
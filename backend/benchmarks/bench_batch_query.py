@@ -0,0 +1,57 @@
+# File: backend/benchmarks/bench_batch_query.py
+#
+# Wall time of answering a question set with one /query call per question
+# versus a single /query/batch call, against a running backend and Ollama.
+# Questions are read one per line from --questions.
+#
+#   cd backend
+#   python -m benchmarks.bench_batch_query --questions eval.txt --limit 200
+
+import argparse
+import json
+import time
+
+import requests
+
+
+def run_sequential(url, questions, k):
+    for question in questions:
+        with requests.post(f"{url}/query", json={"text": question, "k": k}, stream=True) as response:
+            for _ in response.iter_lines():
+                pass
+
+
+def run_batch(url, questions, k):
+    body = {"questions": [{"id": str(i), "text": q} for i, q in enumerate(questions)], "k": k}
+    with requests.post(f"{url}/query/batch", json=body, stream=True) as response:
+        for line in response.iter_lines():
+            if line:
+                summary = json.loads(line)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--questions", required=True)
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--skip-sequential", action="store_true")
+    args = parser.parse_args()
+
+    with open(args.questions, encoding="utf-8") as f:
+        questions = [line.strip() for line in f if line.strip()][:args.limit]
+
+    if not args.skip_sequential:
+        start = time.perf_counter()
+        run_sequential(args.url, questions, args.k)
+        print(f"sequential /query: {time.perf_counter() - start:8.1f} s for {len(questions)} questions")
+
+    start = time.perf_counter()
+    summary = run_batch(args.url, questions, args.k)
+    print(f"/query/batch     : {time.perf_counter() - start:8.1f} s for {len(questions)} questions"
+          f" ({summary.get('generations')} generations)")
+
+
+if __name__ == "__main__":
+    main()
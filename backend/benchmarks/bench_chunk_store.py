@@ -0,0 +1,75 @@
+# File: backend/benchmarks/bench_chunk_store.py
+#
+# ChunkStore on synthetic invoice-like chunks: append rate, size on disk with
+# and without compression, list_sources, fetching k chunks, and compaction
+# after deleting most sources.
+#
+#   cd backend
+#   python -m benchmarks.bench_chunk_store --chunks 200000
+
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+import numpy as np
+
+from app.chunk_store import ChunkStore, SEGMENT_FILE
+
+
+def make_chunk(i):
+    return (f"DettaglioLinee: NumeroLinea: {i % 40} Descrizione: Articolo {i} lotto {i * 7 % 1000} "
+            f"Quantita: {i % 13}.00 PrezzoUnitario: {i % 97}.50 PrezzoTotale: {(i % 13) * (i % 97)}.00 "
+            f"AliquotaIVA: 22.00 ") * 3
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=200_000)
+    parser.add_argument("--sources", type=int, default=2_000)
+    parser.add_argument("--k", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    for compression in (None, "zlib"):
+        with tempfile.TemporaryDirectory() as tmp:
+            store = ChunkStore(tmp, compression=compression)
+            start = time.perf_counter()
+            for batch in range(0, args.chunks, 1000):
+                ids = range(batch, min(batch + 1000, args.chunks))
+                store.append([make_chunk(i) for i in ids], [{"source": f"doc{i % args.sources}.xml"} for i in ids])
+            append_s = time.perf_counter() - start
+            size_mb = os.path.getsize(os.path.join(tmp, SEGMENT_FILE)) / 1e6
+
+            start = time.perf_counter()
+            store = ChunkStore(tmp, compression=compression)
+            open_ms = (time.perf_counter() - start) * 1000
+
+            start = time.perf_counter()
+            store.list_sources()
+            sources_ms = (time.perf_counter() - start) * 1000
+
+            latencies = []
+            for _ in range(200):
+                ids = rng.integers(0, args.chunks, size=args.k).tolist()
+                start = time.perf_counter()
+                store.get(ids)
+                latencies.append((time.perf_counter() - start) * 1000)
+
+            store.compact_min_bytes = float("inf")
+            for source in range(int(args.sources * 0.6)):
+                store.delete({"source": f"doc{source}.xml"})
+            start = time.perf_counter()
+            store.compact()
+            compact_s = time.perf_counter() - start
+            compacted_mb = os.path.getsize(os.path.join(tmp, SEGMENT_FILE)) / 1e6
+
+            print(f"{compression or 'none':>5}: append {args.chunks / append_s:8.0f} chunks/s | {size_mb:6.1f} MB"
+                  f" | open {open_ms:6.1f} ms | list_sources {sources_ms:5.1f} ms"
+                  f" | get {args.k} p50 {statistics.median(latencies):.3f} ms"
+                  f" | compact 60% deleted {compact_s:.2f} s -> {compacted_mb:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+# File: backend/benchmarks/bench_quantized.py
+#
+# Open time, search latency and resident memory of QuantizedVectorStore on
+# random 768-dim vectors (the nomic-embed-text size).
+#
+#   cd backend
+#   python -m benchmarks.bench_quantized --rows 1000000 --dtype int8
+
+import argparse
+import resource
+import statistics
+import tempfile
+import time
+
+import numpy as np
+
+from app.quantized_store import QuantizedVectorStore
+
+
+def rss_mb():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--dtype", choices=("float16", "int8"), default="float16")
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--batch", type=int, default=50_000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        store = QuantizedVectorStore(tmp, dtype=args.dtype)
+        for start in range(0, args.rows, args.batch):
+            n = min(args.batch, args.rows - start)
+            vectors = rng.standard_normal((n, args.dim), dtype=np.float32)
+            store.add(vectors, [""] * n, [{"source": f"doc{(start + i) % 1000}"} for i in range(n)])
+        del store
+
+        base_rss = rss_mb()
+        start = time.perf_counter()
+        store = QuantizedVectorStore(tmp, dtype=args.dtype)
+        store.preload()
+        open_ms = (time.perf_counter() - start) * 1000
+
+        queries = rng.standard_normal((args.queries, args.dim), dtype=np.float32)
+        store.search(queries[0], k=args.k)  # fault pages in once
+        latencies = []
+        for q in queries:
+            start = time.perf_counter()
+            store.search(q, k=args.k)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+        start = time.perf_counter()
+        store.search(queries, k=args.k)
+        batch_ms = (time.perf_counter() - start) * 1000
+
+        mode = f"ivf, {store.meta['ivf_lists']} lists, nprobe {store.nprobe}" if store.meta["ivf_lists"] else "exact"
+        print(f"{args.rows} x {args.dim} {args.dtype} ({mode})")
+        print(f"  open            : {open_ms:.2f} ms")
+        print(f"  search p50 / p95: {statistics.median(latencies):.2f} / {np.percentile(latencies, 95):.2f} ms")
+        print(f"  {args.queries} queries batched: {batch_ms:.2f} ms")
+        print(f"  RSS after search: +{rss_mb() - base_rss:.0f} MB (float32 would be {args.rows * args.dim * 4 / 1e6:.0f} MB)")
+
+
+if __name__ == "__main__":
+    main()
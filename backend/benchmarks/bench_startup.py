@@ -0,0 +1,90 @@
+# File: backend/benchmarks/bench_startup.py
+#
+# Track cold-start cost of the backend the way the Electron shell launches it:
+#   import  - time to import app.main in a fresh interpreter
+#   health  - time from spawning uvicorn until /health first answers
+#   ready   - time from spawning uvicorn until /ready reports ready
+#
+#   cd backend
+#   python -m benchmarks.bench_startup --runs 3
+
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def import_time():
+    code = "import time; t = time.perf_counter(); import app.main; print(time.perf_counter() - t)"
+    out = subprocess.run([sys.executable, "-c", code], cwd=BACKEND_DIR, capture_output=True, text=True, check=True)
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def wait_for(url, start, timeout):
+    while time.perf_counter() - start < timeout:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                if response.status == 200:
+                    return time.perf_counter() - start
+        except (urllib.error.URLError, ConnectionError, OSError):
+            pass
+        time.sleep(0.01)
+    return None
+
+
+def server_times(timeout):
+    port = free_port()
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port)],
+        cwd=BACKEND_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        health = wait_for(f"http://127.0.0.1:{port}/health", start, timeout)
+        ready = wait_for(f"http://127.0.0.1:{port}/ready", start, timeout)
+        return health, ready
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def summary(values):
+    values = [v for v in values if v is not None]
+    if not values:
+        return "timed out"
+    return f"median {statistics.median(values):.2f}s  min {min(values):.2f}s  max {max(values):.2f}s"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=120)
+    args = parser.parse_args()
+
+    imports, healths, readies = [], [], []
+    for _ in range(args.runs):
+        imports.append(import_time())
+        health, ready = server_times(args.timeout)
+        healths.append(health)
+        readies.append(ready)
+
+    print(f"import app.main : {summary(imports)}")
+    print(f"first /health   : {summary(healths)}")
+    print(f"first /ready    : {summary(readies)}")
+
+
+if __name__ == "__main__":
+    main()
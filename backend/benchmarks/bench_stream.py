@@ -0,0 +1,105 @@
+# File: backend/benchmarks/bench_stream.py
+#
+# Server CPU time and frames per streamed answer: one json.dumps line per
+# token, as /query used to write them, versus ndjson_frames coalescing tokens
+# by time window. A uvicorn server is started in a subprocess and streams
+# answers whose tokens arrive every --token-ms; it reports its own CPU time.
+#
+#   cd backend
+#   python -m benchmarks.bench_stream --tokens 400 --answers 10
+
+import argparse
+import asyncio
+import json
+import subprocess
+import sys
+import time
+
+import httpx
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+from app.ndjson_stream import ndjson_frames
+
+
+def make_app(tokens, token_ms, window_ms, compress):
+    async def events():
+        yield {"sources": ["fattura_001.xml", "fattura_002.xml"]}
+        for i in range(tokens):
+            await asyncio.sleep(token_ms / 1000)
+            yield {"answer": f"parola{i} "}
+        yield {"debug": "Response generated successfully"}
+
+    async def per_token(request):
+        async def lines():
+            async for event in events():
+                yield json.dumps(event) + "\n"
+        return StreamingResponse(lines(), media_type="application/json")
+
+    async def coalesced(request):
+        return StreamingResponse(ndjson_frames(events(), window=window_ms / 1000, compress=compress),
+                                 media_type="application/json",
+                                 headers={"Content-Encoding": "gzip"} if compress else None)
+
+    async def cpu(request):
+        return JSONResponse({"cpu": time.process_time()})
+
+    return Starlette(routes=[Route("/per-token", per_token), Route("/coalesced", coalesced), Route("/cpu", cpu)])
+
+
+def measure(url, path, answers):
+    frames = 0
+    with httpx.Client(base_url=url, timeout=None) as client:
+        cpu = client.get("/cpu").json()["cpu"]
+        for _ in range(answers):
+            with client.stream("GET", path) as response:
+                for _ in response.iter_raw():
+                    frames += 1
+        cpu = client.get("/cpu").json()["cpu"] - cpu
+    return cpu / answers * 1000, frames / answers
+
+
+def serve(args):
+    import uvicorn
+    app = make_app(args.tokens, args.token_ms, args.window_ms, args.compress)
+    uvicorn.run(app, host="127.0.0.1", port=args.serve, log_level="warning")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tokens", type=int, default=400)
+    parser.add_argument("--token-ms", type=float, default=2.0)
+    parser.add_argument("--window-ms", type=float, default=30.0)
+    parser.add_argument("--answers", type=int, default=10)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--serve", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--compress", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        serve(args)
+        return
+
+    url = f"http://127.0.0.1:{args.port}"
+    for label, path, compress in [("per-token json.dumps", "/per-token", False),
+                                  ("coalesced orjson", "/coalesced", False),
+                                  ("coalesced orjson gzip", "/coalesced", True)]:
+        command = [sys.executable, "-m", "benchmarks.bench_stream", "--serve", str(args.port),
+                   "--tokens", str(args.tokens), "--token-ms", str(args.token_ms), "--window-ms", str(args.window_ms)]
+        server = subprocess.Popen(command + (["--compress"] if compress else []))
+        try:
+            for _ in range(100):
+                try:
+                    httpx.get(f"{url}/cpu")
+                    break
+                except httpx.TransportError:
+                    time.sleep(0.1)
+            cpu_ms, frames = measure(url, path, args.answers)
+        finally:
+            server.terminate()
+            server.wait()
+        print(f"{label:22}: {cpu_ms:8.2f} ms server CPU per answer, {frames:7.1f} frames per answer")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+# File: backend/benchmarks/bench_text_cache.py
+#
+# Time to chunk every document in a folder by parsing it, versus reading its
+# extracted text from the TextCache, e.g. after chunk_size has changed.
+# The cache is written to a temporary directory, not the folder's .raggy_db.
+#
+#   cd backend
+#   python -m benchmarks.bench_text_cache --folder /path/to/documents
+
+import argparse
+import os
+import tempfile
+import time
+
+from app.document_processor import DocumentProcessor
+from app.scanner import scan_documents
+from app.text_cache import TextCache
+from app.utils import content_hash
+
+
+def chunk_all(processor, sources, hashes):
+    chunks = 0
+    for source in sources:
+        chunks += len(processor.process_file(source, content_hash=hashes.get(source)))
+    return chunks
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--folder", required=True)
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    sources = sorted(scan_documents(args.folder))
+    start = time.perf_counter()
+    hashes = {source: content_hash(os.path.join(args.folder, source)) for source in sources}
+    print(f"hashing            : {time.perf_counter() - start:8.2f} s for {len(sources)} files")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = TextCache(tmp)
+        plain = DocumentProcessor(args.folder, chunk_size=args.chunk_size)
+        cached = DocumentProcessor(args.folder, chunk_size=args.chunk_size, text_cache=cache)
+
+        start = time.perf_counter()
+        chunks = chunk_all(plain, sources, {})
+        print(f"parse + chunk      : {time.perf_counter() - start:8.2f} s, {chunks} chunks")
+
+        start = time.perf_counter()
+        chunk_all(cached, sources, hashes)
+        print(f"parse + fill cache : {time.perf_counter() - start:8.2f} s")
+
+        cached.chunk_size = args.chunk_size // 2
+        start = time.perf_counter()
+        chunks = chunk_all(cached, sources, hashes)
+        print(f"re-chunk from cache: {time.perf_counter() - start:8.2f} s, {chunks} chunks at chunk_size {cached.chunk_size}")
+        print(f"cache size         : {cache.size() / 1e6:8.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+# File: backend/benchmarks/bench_vector_stores.py
+#
+# A benchmark for every VectorStore backend; their behaviour is checked by
+# tests/test_vector_stores.py.
+#
+# Each backend is timed on one dataset: insert rate, search latency, recall@k
+# against exact search, list_sources and count. By default the dataset is
+# random; --folder uses the vectors already indexed (by the Chroma backend)
+# for one of our folders.
+#
+#   cd backend
+#   python -m benchmarks.bench_vector_stores --rows 20000
+#   python -m benchmarks.bench_vector_stores --folder ~/Documents/fatture
+
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+import numpy as np
+
+from app.folder_registry import DB_DIR_NAME
+from app.vector_stores import VECTOR_STORES, ChromaStore, MemoryStore, create_vector_store
+
+
+def load_folder(folder):
+    collection = ChromaStore(os.path.join(folder, DB_DIR_NAME)).collection
+    data = collection.get(include=["embeddings", "documents", "metadatas"])
+    return np.asarray(data["embeddings"], dtype=np.float32), data["documents"], [m or {} for m in data["metadatas"]]
+
+
+def random_data(rows, dim, seed=0):
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((rows, dim), dtype=np.float32)
+    # Unit length like nomic-embed-text output, so L2 and cosine rank the same way
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors, [f"chunk {i}" for i in range(rows)], [{"source": f"doc{i % 500}.xml"} for i in range(rows)]
+
+
+def benchmark(backend, directory, vectors, texts, metadatas, queries, truth, k, batch):
+    store = create_vector_store(backend, directory)
+    start = time.perf_counter()
+    for i in range(0, len(vectors), batch):
+        store.upsert(None, vectors[i:i + batch], texts[i:i + batch], metadatas[i:i + batch])
+    insert_s = time.perf_counter() - start
+
+    store.search(queries[0], k=k)
+    latencies, recalls = [], []
+    for query, expected in zip(queries, truth):
+        start = time.perf_counter()
+        hits = store.search(query, k=k)[0]
+        latencies.append((time.perf_counter() - start) * 1000)
+        recalls.append(len({text for text, _, _ in hits} & expected) / len(expected))
+
+    start = time.perf_counter()
+    store.list_sources()
+    sources_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    store.count()
+    count_ms = (time.perf_counter() - start) * 1000
+
+    print(f"{backend:>10}: insert {len(vectors) / insert_s:8.0f} rows/s | search p50 {statistics.median(latencies):7.2f} ms"
+          f" p95 {np.percentile(latencies, 95):7.2f} ms | recall@{k} {statistics.mean(recalls):.3f}"
+          f" | list_sources {sources_ms:7.1f} ms | count {count_ms:.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backends", default=",".join(VECTOR_STORES))
+    parser.add_argument("--folder", help="benchmark on the vectors indexed for this folder")
+    parser.add_argument("--rows", type=int, default=20_000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--batch", type=int, default=1000)
+    args = parser.parse_args()
+    backends = args.backends.split(",")
+
+    if args.folder:
+        vectors, texts, metadatas = load_folder(args.folder)
+    else:
+        vectors, texts, metadatas = random_data(args.rows, args.dim)
+    # Queries are perturbed stored vectors, so every query has close neighbours as with real questions
+    rng = np.random.default_rng(2)
+    picks = rng.choice(len(vectors), size=min(args.queries, len(vectors)), replace=False)
+    queries = vectors[picks] + 0.3 * vectors.std() * rng.standard_normal((len(picks), vectors.shape[1]), dtype=np.float32)
+    # Texts are unique per row, so exact search over them gives the ground truth
+    texts = [f"{i}: {text}" for i, text in enumerate(texts)]
+    reference = MemoryStore()
+    reference.upsert(None, vectors, texts, metadatas)
+    truth = [{text for text, _, _ in hits} for hits in reference.search(queries, k=args.k)]
+
+    print(f"{len(vectors)} x {vectors.shape[1]} vectors, {len(queries)} queries")
+    for backend in backends:
+        with tempfile.TemporaryDirectory() as tmp:
+            benchmark(backend, tmp, vectors, texts, metadatas, queries, truth, args.k, args.batch)
+
+
+if __name__ == "__main__":
+    main()
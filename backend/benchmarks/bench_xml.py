@@ -0,0 +1,114 @@
+# File: backend/benchmarks/bench_xml.py
+#
+# Compare the legacy ET.parse + flatten extraction with the streaming
+# iterparse extractor on a synthetic FatturaPA invoice.
+#
+#   cd backend
+#   python -m benchmarks.bench_xml --lines 500 --invoices 200
+
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+import xml.etree.ElementTree as ET
+
+from app.document_processor import DocumentProcessor
+
+NS = "http://ivaservizi.agenziaentrate.gov.it/docs/xsd/fatture/v1.2"
+
+
+def write_invoice(path, lines, invoices):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(f'<?xml version="1.0" encoding="UTF-8"?>\n<p:FatturaElettronica xmlns:p="{NS}" versione="FPR12">\n')
+        f.write("<FatturaElettronicaHeader><CedentePrestatore><DatiAnagrafici><IdFiscaleIVA>"
+                "<IdPaese>IT</IdPaese><IdCodice>01234567890</IdCodice></IdFiscaleIVA>"
+                "<Anagrafica><Denominazione>Fornitore Srl</Denominazione></Anagrafica>"
+                "</DatiAnagrafici></CedentePrestatore></FatturaElettronicaHeader>\n")
+        for n in range(invoices):
+            f.write("<FatturaElettronicaBody><DatiGenerali><DatiGeneraliDocumento>"
+                    f"<TipoDocumento>TD01</TipoDocumento><Data>2024-01-{n % 28 + 1:02d}</Data>"
+                    f"<Numero>{n}</Numero></DatiGeneraliDocumento></DatiGenerali><DatiBeniServizi>\n")
+            for i in range(lines):
+                f.write(f"<DettaglioLinee><NumeroLinea>{i + 1}</NumeroLinea>"
+                        f"<Descrizione>Articolo {i} lotto {n}</Descrizione><Quantita>{i % 7 + 1}.00</Quantita>"
+                        f"<PrezzoUnitario>{i * 1.5:.2f}</PrezzoUnitario><PrezzoTotale>{i * 3:.2f}</PrezzoTotale>"
+                        "<AliquotaIVA>22.00</AliquotaIVA></DettaglioLinee>\n")
+            f.write("</DatiBeniServizi></FatturaElettronicaBody>\n")
+        f.write("</p:FatturaElettronica>\n")
+
+
+def flatten(element, parent_path=""):
+    # The extraction DocumentProcessor used before iterparse: one dict keyed by
+    # element path, so repeated siblings overwrite each other.
+    items = {}
+    for child in element:
+        tag = child.tag.split("}")[-1]
+        child_path = f"{parent_path}/{tag}" if parent_path else tag
+        if len(child) == 0:
+            items[child_path] = child.text.strip() if child.text else ""
+        else:
+            items.update(flatten(child, child_path))
+    return items
+
+
+def format_flattened(data):
+    groups = []
+    for key, value in data.items():
+        parts = key.split("/")
+        group = parts[-2] if len(parts) > 1 else "root"
+        if not groups or groups[-1][0] != group:
+            groups.append((group, []))
+        if value:
+            groups[-1][1].append(f"{parts[-1]}: {value}")
+    return " ".join((" ".join(fields) if group == "root" else f"{group}: " + " ".join(fields))
+                    for group, fields in groups if fields)
+
+
+def legacy(processor, path):
+    root = ET.parse(path).getroot()
+    return processor.split_text(format_flattened(flatten(root)), os.path.basename(path))
+
+
+def streaming(processor, path):
+    return processor.process_xml(path)
+
+
+def measure(fn, *args):
+    # Best-of-three time and peak memory are measured in separate runs: tracemalloc slows
+    # allocation-heavy code by several times.
+    elapsed = float("inf")
+    for _ in range(3):
+        start = time.perf_counter()
+        result = fn(*args)
+        elapsed = min(elapsed, time.perf_counter() - start)
+    tracemalloc.start()
+    fn(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lines", type=int, default=500)
+    parser.add_argument("--invoices", type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "invoice.xml")
+        write_invoice(path, args.lines, args.invoices)
+        size_mb = os.path.getsize(path) / 1e6
+        processor = DocumentProcessor(tmp)
+
+        print(f"{size_mb:.1f} MB, {args.invoices} invoices x {args.lines} DettaglioLinee")
+        for name, fn in (("parse+flatten", legacy), ("iterparse", streaming)):
+            chunks, elapsed, peak = measure(fn, processor, path)
+            text = " ".join(c[0] for c in chunks)
+            lines = text.count("DettaglioLinee:")
+            print(f"{name:>14}: {elapsed:6.2f}s  peak {peak / 1e6:7.1f} MB  "
+                  f"{len(chunks):6d} chunks  {lines:7d} DettaglioLinee records kept")
+
+
+if __name__ == "__main__":
+    main()
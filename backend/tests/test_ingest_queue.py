@@ -0,0 +1,105 @@
+import threading
+
+from app.ingest_queue import INTERACTIVE, RECONCILE, REMOVE, WATCHER, IngestQueue
+
+
+class RecordingQueue(IngestQueue):
+    """Runs tasks by recording them; `hold` keeps the worker inside the first task until set."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.ran = []
+        self.started = threading.Event()
+        self.hold = threading.Event()
+        self.hold.set()
+
+    def _run(self, task):
+        self.started.set()
+        self.hold.wait()
+        self.ran.append((task.source, task.op))
+
+
+def _run_all(queue, tasks):
+    queue.attach(lambda folder: None)
+    for task in tasks:
+        assert task.done.wait(5)
+
+
+def test_tasks_run_by_priority_then_submission_order():
+    queue = RecordingQueue()
+    tasks = [
+        queue.submit("/f", "reconcile-1.xml", priority=RECONCILE),
+        queue.submit("/f", "watcher-1.xml", priority=WATCHER),
+        queue.submit("/f", "reconcile-2.xml", priority=RECONCILE),
+        queue.submit("/f", "added.xml", priority=INTERACTIVE),
+        queue.submit("/f", "watcher-2.xml", priority=WATCHER),
+    ]
+    _run_all(queue, tasks)
+    assert [source for source, _ in queue.ran] == [
+        "added.xml", "watcher-1.xml", "watcher-2.xml", "reconcile-1.xml", "reconcile-2.xml"]
+
+
+def test_an_urgent_file_overtakes_a_queued_reconcile():
+    queue = RecordingQueue()
+    queue.hold.clear()
+    first = queue.submit("/f", "first.xml", priority=RECONCILE)
+    queue.attach(lambda folder: None)
+    assert queue.started.wait(5)
+    # Queued while the worker is busy
+    tasks = [first, queue.submit("/f", "bulk.xml", priority=RECONCILE),
+             queue.submit("/f", "new.xml", priority=INTERACTIVE)]
+    queue.hold.set()
+    for task in tasks:
+        assert task.done.wait(5)
+    assert [source for source, _ in queue.ran] == ["first.xml", "new.xml", "bulk.xml"]
+
+
+def test_a_file_queued_twice_runs_once_with_the_better_priority_and_latest_op():
+    queue = RecordingQueue()
+    queue.submit("/f", "watched.xml", priority=WATCHER)
+    reconcile = queue.submit("/f", "a.xml", priority=RECONCILE)
+    merged = queue.submit("/f", "a.xml", op=REMOVE, priority=INTERACTIVE)
+    assert merged is reconcile
+    assert queue.stats["merged"] == 1
+    _run_all(queue, [merged])
+    assert queue.ran[0] == ("a.xml", REMOVE)
+    assert [source for source, _ in queue.ran].count("a.xml") == 1
+
+
+def test_recently_returned_sources_are_boosted():
+    queue = RecordingQueue(boost=15, boost_window=600)
+    tasks = [
+        queue.submit("/f", "watcher.xml", priority=WATCHER),
+        queue.submit("/f", "queried.xml", priority=RECONCILE),
+    ]
+    queue.touch("/f", ["queried.xml"])
+    _run_all(queue, tasks)
+    assert [source for source, _ in queue.ran] == ["queried.xml", "watcher.xml"]
+
+
+def test_abandoning_a_reconcile_keeps_tasks_merged_with_more_urgent_submissions():
+    queue = RecordingQueue()
+    reconciled = []
+    callback = reconciled.append
+    tasks = [queue.submit("/f", source, priority=RECONCILE, callback=callback) for source in ("a.xml", "b.xml")]
+    # A watcher event for a.xml arrives before the reconcile is cancelled
+    queue.submit("/f", "a.xml", priority=WATCHER)
+
+    queue.abandon(tasks, RECONCILE, callback)
+    assert tasks[1].cancelled and not tasks[0].cancelled
+    _run_all(queue, [tasks[0]])
+    assert [source for source, _ in queue.ran] == ["a.xml"]
+    # The reconcile no longer hears about a.xml
+    assert reconciled == []
+
+
+def test_cancelled_and_dropped_tasks_do_not_run():
+    queue = RecordingQueue()
+    cancelled = queue.submit("/f", "cancelled.xml")
+    queue.submit("/other", "dropped.xml")
+    kept = queue.submit("/f", "kept.xml")
+    queue.cancel([cancelled])
+    assert queue.drop_folder("/other") == 1
+    assert queue.position(kept) == 1
+    _run_all(queue, [kept])
+    assert queue.ran == [("kept.xml", "index")]
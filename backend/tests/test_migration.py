@@ -0,0 +1,134 @@
+import os
+import zlib
+
+import numpy as np
+import pytest
+
+from app.conf import config
+from app.db_operations import migrate_index, refresh_folder
+from app.embeddings import DEFAULT_MODEL, EmbeddingModel
+from app.folder_registry import FolderContext
+from app.index_versions import BASE
+from app.ingest_queue import ingest_queue
+from app.jobs import Job, JobCancelled
+
+
+class FakeClient:
+    """Stands in for OllamaEmbeddings with deterministic vectors per text."""
+
+    def _vector(self, text):
+        vector = np.random.default_rng(zlib.crc32(text.encode("utf-8"))).standard_normal(16)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts):
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._vector(text)
+
+
+@pytest.fixture
+def folder(tmp_path, monkeypatch):
+    for key, value in {"vector_backend": "memory", "migration_throttle": 0, "text_cache": False,
+                       "index_versions_keep": 1}.items():
+        monkeypatch.setitem(config.config, key, value)
+    # Without an attached queue, refreshes index files on the calling thread
+    assert not ingest_queue.attached
+    for i in range(3):
+        (tmp_path / f"invoice{i}.xml").write_text(
+            f"<Invoice><Line><Description>Item {i}</Description><Amount>{10 * i}</Amount></Line>"
+            f"<Supplier>Supplier number {i}</Supplier></Invoice>", encoding="utf-8")
+    context = FolderContext(str(tmp_path), EmbeddingModel(FakeClient(), DEFAULT_MODEL))
+    yield context
+    context.close()
+
+
+def _sources(context):
+    return context.db_manager.get_all_sources()
+
+
+def test_migration_builds_a_version_and_switches_to_it(folder):
+    base = folder.db_manager
+    assert folder.version == BASE and _sources(folder) == set()
+
+    name = migrate_index(folder)
+    assert name == "v1"
+    assert folder.version == "v1" and folder.versions.active() == "v1"
+    assert folder.db_manager is not base
+    assert _sources(folder) == {"invoice0.xml", "invoice1.xml", "invoice2.xml"}
+    manifest = folder.versions.manifest("v1")
+    assert manifest["status"] == "ready"
+    assert manifest["counts"]["files"] == 3
+    assert not folder.chunking_mismatch() and not folder.embedding_mismatch() and not folder.store_mismatch()
+    # The replaced version stays open for requests that started on it
+    assert folder.retired[:2] == (BASE, base)
+
+
+def test_rollback_reuses_the_retired_store(folder):
+    migrate_index(folder)
+    v1 = folder.db_manager
+    os.remove(os.path.join(folder.path, "invoice2.xml"))
+    migrate_index(folder)
+    v2 = folder.db_manager
+    assert _sources(folder) == {"invoice0.xml", "invoice1.xml"}
+
+    folder.activate_version("v1")
+    assert folder.version == "v1" and folder.versions.active() == "v1"
+    assert folder.db_manager is v1
+    assert _sources(folder) == {"invoice0.xml", "invoice1.xml", "invoice2.xml"}
+    folder.activate_version("v2")
+    assert folder.db_manager is v2
+
+
+def test_a_cancelled_build_is_removed_and_its_name_not_reused(folder):
+    base = folder.db_manager
+    job = Job("reset", folder.path)
+    job.cancel()
+    with pytest.raises(JobCancelled):
+        migrate_index(folder, job)
+    assert folder.versions.names() == []
+    assert folder.version == BASE and folder.versions.active() == BASE
+    assert folder.db_manager is base
+
+    assert migrate_index(folder) == "v2"
+    assert _sources(folder) == {"invoice0.xml", "invoice1.xml", "invoice2.xml"}
+
+
+def test_a_failed_build_is_removed(folder, monkeypatch):
+    import app.db_operations
+
+    def fail(*args, **kwargs):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(app.db_operations, "verify_index", fail)
+    with pytest.raises(OSError):
+        migrate_index(folder)
+    assert folder.versions.names() == []
+    assert folder.version == BASE
+
+
+def test_gc_keeps_versions_that_are_still_open(folder):
+    migrate_index(folder, keep=0)
+    migrate_index(folder, keep=0)
+    # v1 was just replaced and is still open, so it survives keep=0
+    assert folder.versions.names() == ["v1", "v2"]
+    migrate_index(folder, keep=0)
+    assert folder.versions.names() == ["v2", "v3"]
+    assert folder.retired[0] == "v2"
+
+
+def test_an_index_from_an_older_chunker_is_rebuilt(folder):
+    # The base version predates chunker versions
+    assert folder.chunking_mismatch()
+    refresh_folder(folder)
+    assert folder.version == "v1"
+    assert _sources(folder) == {"invoice0.xml", "invoice1.xml", "invoice2.xml"}
+
+    refresh_folder(folder)
+    assert folder.version == "v1"
+
+    folder.versions.update_manifest("v1", params=dict(folder.versions.manifest("v1")["params"], chunking=1))
+    assert folder.chunking_mismatch()
+    refresh_folder(folder)
+    assert folder.version == "v2"
+    assert folder.versions.manifest("v2")["params"]["chunking"] != 1
@@ -0,0 +1,71 @@
+import asyncio
+import zlib
+
+import orjson
+import pytest
+
+from app.ndjson_stream import ndjson_frames
+
+
+async def _events(events, delay=0):
+    for event in events:
+        if delay:
+            await asyncio.sleep(delay)
+        yield event
+
+
+def _frames(events, **options):
+    async def collect():
+        return [frame async for frame in ndjson_frames(events, **options)]
+    return asyncio.run(collect())
+
+
+def _lines(data):
+    assert data.endswith(b"\n")
+    return [orjson.loads(line) for line in data.split(b"\n")[:-1]]
+
+
+def test_every_frame_is_whole_lines():
+    events = [{"answer": "Ciao"}, {"answer": " mondo"}, {"sources": ["a.xml"]}, {"answer": "!"}]
+    frames = _frames(_events(events, delay=0.005), window=0.001)
+    assert len(frames) > 1
+    for frame in frames:
+        _lines(frame)
+
+
+def test_consecutive_answer_tokens_are_merged_in_order():
+    events = [{"answer": "Ciao"}, {"answer": " mondo"}, {"sources": ["a.xml"]}, {"answer": "!"}, {"answer": ""}]
+    frames = _frames(_events(events), window=1)
+    assert _lines(b"".join(frames)) == [{"answer": "Ciao mondo"}, {"sources": ["a.xml"]}, {"answer": "!"}]
+
+
+def test_a_full_buffer_is_sent_without_waiting_for_the_window():
+    events = [{"answer": "x" * 100} for _ in range(50)]
+    frames = _frames(_events(events, delay=0.001), window=60, max_bytes=1000)
+    assert len(frames) >= 5
+    assert "".join(line["answer"] for line in _lines(b"".join(frames))) == "x" * 5000
+
+
+def test_compressed_frames_decode_to_the_same_lines():
+    events = [{"answer": "token "} for _ in range(20)] + [{"sources": ["a.xml", "b.pdf"]}]
+    plain = b"".join(_frames(_events(events), window=1))
+    compressed = _frames(_events(events), window=1, compress=True)
+    decompressor = zlib.decompressobj(31)
+    # Each frame is flushed on its own, so a client can decode it as soon as it arrives
+    decoded = b"".join(decompressor.decompress(frame) for frame in compressed)
+    assert decoded == plain
+
+
+def test_an_error_is_raised_after_the_events_before_it():
+    async def failing():
+        yield {"answer": "partial"}
+        raise RuntimeError("model went away")
+
+    async def collect():
+        frames = []
+        with pytest.raises(RuntimeError):
+            async for frame in ndjson_frames(failing(), window=1):
+                frames.append(frame)
+        return frames
+
+    assert _lines(b"".join(asyncio.run(collect()))) == [{"answer": "partial"}]
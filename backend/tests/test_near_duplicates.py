@@ -0,0 +1,125 @@
+import threading
+import zlib
+
+import numpy as np
+import pytest
+
+from app.db_manager import DBManager
+
+BOILERPLATE = ("The supplier declares that the goods listed in this invoice were delivered in full "
+               "and that payment is due within thirty days of the invoice date by bank transfer.")
+
+
+class FakeEmbeddings:
+    """Deterministic embeddings that record what they embed and fail if called inside a registry transaction."""
+
+    spec = ("fake", None)
+
+    def __init__(self):
+        self.embedded = []
+        self.manager = None
+
+    def _vector(self, text):
+        vector = np.random.default_rng(zlib.crc32(text.encode("utf-8"))).standard_normal(32)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts):
+        if self.manager is not None:
+            assert self.manager.sources._owner != threading.get_ident(), "embedded inside a registry transaction"
+        self.embedded.extend(texts)
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._vector(text)
+
+
+@pytest.fixture
+def manager(tmp_path):
+    embeddings = FakeEmbeddings()
+    db = DBManager(str(tmp_path), embeddings=embeddings, backend="memory", dedup_threshold=0.9)
+    embeddings.manager = db
+    yield db
+    db.close()
+
+
+def _search(db, text, k=10):
+    return [(document.page_content, document.metadata) for document, _ in db.similarity_search_with_score(text, k=k)]
+
+
+def test_near_duplicates_are_stored_but_not_embedded(manager):
+    manager.index_source("a.xml", [BOILERPLATE, "Invoice 1 for 100 EUR"])
+    manager.embeddings.embedded.clear()
+    manager.index_source("b.xml", [BOILERPLATE, "Invoice 2 for 250 EUR"])
+
+    assert manager.embeddings.embedded == ["Invoice 2 for 250 EUR"]
+    assert manager.chunks.count() == 4
+    assert manager.count() == 3
+    assert manager.dedup_stats()["duplicates"] == 1
+    assert manager.get_all_sources() == {"a.xml", "b.xml"}
+
+
+def test_search_reports_the_sources_of_duplicates(manager):
+    manager.index_source("a.xml", [BOILERPLATE])
+    manager.index_source("b.xml", [BOILERPLATE])
+    manager.index_source("c.xml", [BOILERPLATE])
+
+    hits = _search(manager, BOILERPLATE)
+    assert len(hits) == 1
+    text, metadata = hits[0]
+    assert text == BOILERPLATE
+    assert metadata["source"] == "a.xml"
+    assert metadata["duplicate_sources"] == ["b.xml", "c.xml"]
+
+
+def test_removing_the_canonical_source_promotes_a_duplicate(manager):
+    manager.index_source("a.xml", [BOILERPLATE])
+    manager.index_source("b.xml", [BOILERPLATE])
+    manager.index_source("c.xml", [BOILERPLATE])
+
+    manager.remove_documents({"source": "a.xml"})
+    hits = _search(manager, BOILERPLATE)
+    assert len(hits) == 1
+    assert hits[0][1]["source"] == "b.xml"
+    assert hits[0][1]["duplicate_sources"] == ["c.xml"]
+    assert manager.dedup_stats()["duplicates"] == 1
+
+    manager.remove_documents({"source": "b.xml"})
+    hits = _search(manager, BOILERPLATE)
+    assert [metadata["source"] for _, metadata in hits] == ["c.xml"]
+    assert "duplicate_sources" not in hits[0][1]
+    assert manager.dedup_stats()["duplicates"] == 0
+
+
+def test_reindexing_a_source_does_not_match_its_own_old_chunks(manager):
+    manager.index_source("a.xml", [BOILERPLATE, "Invoice 1 for 100 EUR"])
+    manager.embeddings.embedded.clear()
+    manager.index_source("a.xml", [BOILERPLATE, "Invoice 1 for 120 EUR"])
+
+    # The old copy is being replaced, so the new one is embedded rather than pointed at it
+    assert manager.embeddings.embedded == [BOILERPLATE, "Invoice 1 for 120 EUR"]
+    assert manager.count() == 2
+    assert manager.dedup_stats()["duplicates"] == 0
+    assert [text for text, _ in _search(manager, BOILERPLATE)][0] == BOILERPLATE
+
+
+def test_reindexing_the_canonical_source_keeps_its_duplicates_searchable(manager):
+    manager.index_source("a.xml", [BOILERPLATE])
+    manager.index_source("b.xml", [BOILERPLATE])
+    manager.index_source("a.xml", ["Invoice 1 for 100 EUR"])
+
+    hits = _search(manager, BOILERPLATE)
+    assert [(text, metadata["source"]) for text, metadata in hits if text == BOILERPLATE] == [(BOILERPLATE, "b.xml")]
+    assert manager.count() == 2
+
+
+def test_a_duplicate_whose_canonical_chunk_disappears_before_the_write_is_embedded(manager):
+    manager.index_source("a.xml", [BOILERPLATE])
+    # Classified against a.xml's chunk, which is removed before the write commits
+    embeddings, plan = manager._embed([BOILERPLATE])
+    assert embeddings == []
+    manager.remove_documents({"source": "a.xml"})
+    with manager._write_transaction([BOILERPLATE], embeddings, plan):
+        manager._write_chunks(None, [BOILERPLATE], [{"source": "b.xml"}], embeddings, plan)
+
+    hits = _search(manager, BOILERPLATE)
+    assert [metadata["source"] for _, metadata in hits] == ["b.xml"]
@@ -0,0 +1,163 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from app.vector_stores import VECTOR_STORES, MemoryStore, create_vector_store, detect_vector_backend
+
+
+@pytest.fixture(params=sorted(VECTOR_STORES))
+def open_store(request, tmp_path):
+    """Opens the parametrized backend's store in one directory; every store opened is closed afterwards."""
+    if request.param == "chroma":
+        pytest.importorskip("chromadb")
+    stores = []
+
+    def open_():
+        store = create_vector_store(request.param, str(tmp_path))
+        stores.append(store)
+        return store
+
+    open_.backend = request.param
+    open_.directory = str(tmp_path)
+    yield open_
+    for store in stores:
+        store.close()
+
+
+def _data(rows=30, dim=16, seed=1):
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((rows, dim)).astype(np.float32)
+    # Unit length, so every backend ranks by the same distance
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    texts = [f"text {i}" for i in range(rows)]
+    metadatas = [{"source": f"doc{i % 3}.xml", "chunk": i} for i in range(rows)]
+    return vectors, texts, metadatas
+
+
+def test_new_store_is_empty(open_store):
+    store = open_store()
+    vectors, _, _ = _data()
+    assert store.count() == 0
+    assert store.list_sources() == set()
+    assert store.search(vectors[0], k=3) == [[]]
+
+
+def test_upsert_adds_rows_and_replaces_by_id(open_store):
+    store = open_store()
+    vectors, texts, metadatas = _data()
+    store.upsert([f"id{i}" for i in range(20)], vectors[:20], texts[:20], metadatas[:20])
+    store.upsert(None, vectors[20:], texts[20:], metadatas[20:])
+    assert store.count() == 30
+    assert store.list_sources() == {"doc0.xml", "doc1.xml", "doc2.xml"}
+
+    store.upsert(["id4"], vectors[4:5], ["text 4 replaced"], [metadatas[4]])
+    assert store.count() == 30
+    assert store.search(vectors[4], k=1)[0][0][0] == "text 4 replaced"
+
+
+def test_search_returns_nearest_first(open_store):
+    store = open_store()
+    vectors, texts, metadatas = _data()
+    store.upsert(None, vectors, texts, metadatas)
+    hits = store.search(vectors[[4, 7]], k=5)
+    assert [len(h) for h in hits] == [5, 5]
+    assert hits[0][0][0] == "text 4" and hits[1][0][0] == "text 7"
+    assert hits[0][0][1] == metadatas[4]
+    assert hits[0][0][2] < 1e-2
+    for query, query_hits in zip(vectors[[4, 7]], hits):
+        distances = [distance for _, _, distance in query_hits]
+        assert distances == sorted(distances)
+        # The same neighbours, in the same order, as an exact search
+        exact = np.argsort(((vectors - query) ** 2).sum(axis=1))[:5]
+        assert [text for text, _, _ in query_hits] == [texts[i] for i in exact]
+
+
+def test_search_returns_every_row_when_k_exceeds_count(open_store):
+    store = open_store()
+    vectors, texts, metadatas = _data(rows=3)
+    store.upsert(None, vectors, texts, metadatas)
+    assert sorted(text for text, _, _ in store.search(vectors[0], k=10)[0]) == sorted(texts)
+
+
+def test_delete_by_source(open_store):
+    store = open_store()
+    vectors, texts, metadatas = _data()
+    store.upsert(None, vectors, texts, metadatas)
+    store.delete({"source": "doc1.xml"})
+    assert store.count() == 20
+    assert store.list_sources() == {"doc0.xml", "doc2.xml"}
+    returned = {metadata["source"] for text, metadata, _ in store.search(vectors, k=30)[0]}
+    assert "doc1.xml" not in returned
+
+
+def test_delete_chunks(open_store):
+    store = open_store()
+    vectors, texts, metadatas = _data()
+    store.upsert(None, vectors, texts, metadatas)
+    store.delete_chunks([i for i in range(30) if i % 3 == 2], {"source": "doc2.xml"})
+    assert store.count() == 20
+    assert store.list_sources() == {"doc0.xml", "doc1.xml"}
+
+
+def test_rows_persist_after_reopening(open_store):
+    store = open_store()
+    vectors, texts, metadatas = _data()
+    store.upsert([f"id{i}" for i in range(30)], vectors, texts, metadatas)
+    store.upsert(["id3"], vectors[3:4], ["text 3 replaced"], [metadatas[3]])
+    store.delete({"source": "doc1.xml"})
+    store.close()
+
+    store = open_store()
+    assert store.count() == 20
+    assert store.list_sources() == {"doc0.xml", "doc2.xml"}
+    assert store.search(vectors[3], k=1)[0][0][0] == "text 3 replaced"
+    assert detect_vector_backend(open_store.directory) == open_store.backend
+
+
+def test_clear(open_store):
+    store = open_store()
+    vectors, texts, metadatas = _data()
+    store.upsert(None, vectors, texts, metadatas)
+    store.clear()
+    assert store.count() == 0
+    assert store.list_sources() == set()
+    store.upsert(None, vectors[:2], texts[:2], metadatas[:2])
+    assert store.count() == 2
+
+
+def test_memory_store_ignores_a_torn_append(tmp_path):
+    vectors, texts, metadatas = _data()
+    store = MemoryStore(str(tmp_path))
+    store.upsert(None, vectors[:10], texts[:10], metadatas[:10])
+    # A crash after writing part of the next append, before store.json recorded it
+    with open(store._path("records"), "ab") as f:
+        f.write(b'["half a rec')
+    with open(store._path("vectors"), "ab") as f:
+        f.write(b"\0" * 6)
+
+    store = MemoryStore(str(tmp_path))
+    assert store.count() == 10
+    store.upsert(None, vectors[10:12], texts[10:12], metadatas[10:12])
+    store = MemoryStore(str(tmp_path))
+    assert store.count() == 12
+    assert store.search(vectors[11], k=1)[0][0][0] == "text 11"
+
+
+def test_memory_store_compacts_dead_rows(tmp_path):
+    vectors, texts, metadatas = _data()
+    store = MemoryStore(str(tmp_path), compact_min_rows=10)
+    ids = [f"id{i}" for i in range(30)]
+    for _ in range(3):
+        store.upsert(ids, vectors, texts, metadatas)
+    # 60 replaced rows outnumber the 30 live ones, so the files were rewritten with only the live rows
+    with open(os.path.join(tmp_path, MemoryStore.META_FILE)) as f:
+        meta = json.load(f)
+    assert meta["rows"] == 30 and meta["generation"] > 0
+    assert len([name for name in os.listdir(tmp_path) if name.startswith("records.")]) == 1
+
+    store.delete({"source": "doc1.xml"})
+    store = MemoryStore(str(tmp_path))
+    assert store.count() == 20
+    assert store.list_sources() == {"doc0.xml", "doc2.xml"}
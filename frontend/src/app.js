@@ -27,6 +27,7 @@ import MenuItem from "@mui/material/MenuItem";
 import FormControl from "@mui/material/FormControl";
 import InputLabel from "@mui/material/InputLabel";
 import Paper from "@mui/material/Paper";
+import { readNdjson } from "./ndjson.mjs";
 
 const theme = createTheme({
   palette: {
@@ -226,33 +227,17 @@ function App() {
         throw new Error(`HTTP error! status: ${response.status}`);
       }
 
-      const reader = response.body.getReader();
-      const decoder = new TextDecoder();
-
-      while (true) {
-        const { done, value } = await reader.read();
-        if (done) break;
-        const chunk = decoder.decode(value);
-        const lines = chunk.split("\n");
-        lines.forEach((line) => {
-          if (line) {
-            try {
-              const data = JSON.parse(line);
-              if (data.answer) {
-                setAnswer((prev) => prev + data.answer);
-              }
-              if (data.sources) {
-                setSources(data.sources);
-              }
-              if (data.debug) {
-                setDebugInfo((prev) => prev + data.debug + "\n");
-              }
-            } catch (error) {
-              console.error("Error parsing JSON:", error);
-            }
-          }
-        });
-      }
+      await readNdjson(response.body.getReader(), (data) => {
+        if (data.answer) {
+          setAnswer((prev) => prev + data.answer);
+        }
+        if (data.sources) {
+          setSources(data.sources);
+        }
+        if (data.debug) {
+          setDebugInfo((prev) => prev + data.debug + "\n");
+        }
+      });
     } catch (error) {
       if (error.name === "AbortError") {
         console.log("Fetch aborted");
@@ -425,34 +410,48 @@ function App() {
       const response = await fetch("http://localhost:8000/reset-and-rescan", {
         method: "POST",
       });
-
-      const reader = response.body.getReader();
-      const decoder = new TextDecoder();
-
-      while (true) {
-        const { done, value } = await reader.read();
-        if (done) break;
-        const chunk = decoder.decode(value);
-        const lines = chunk.split("\n");
-        lines.forEach((line) => {
-          if (line) {
-            const data = JSON.parse(line);
-            if (data.status === "Processing") {
-              setResetProgress({
-                progress: parseFloat(data.progress),
-                current: data.current,
-                total: data.total,
-              });
-            } else if (data.status === "Completed") {
-              setSnackbar({
-                open: true,
-                message: "Reset and rescan completed successfully",
-                severity: "success",
-              });
-            }
-          }
-        });
+      if (!response.ok) {
+        throw new Error(`HTTP error! status: ${response.status}`);
       }
+      const { job } = await response.json();
+
+      const stream = await fetch(
+        `http://localhost:8000/jobs/${job.id}/stream`
+      );
+      await readNdjson(
+        stream.body.getReader(),
+        (data) => {
+          if (data.status === "running" || data.status === "pending") {
+            setResetProgress({
+              progress: data.progress,
+              current: data.files_done,
+              total: data.files_total,
+            });
+          } else if (data.status === "completed") {
+            setResetProgress({
+              progress: 100,
+              current: data.files_done,
+              total: data.files_total,
+            });
+            setSnackbar({
+              open: true,
+              message: "Reset and rescan completed successfully",
+              severity: "success",
+            });
+          } else if (data.status === "failed" || data.status === "cancelled") {
+            setSnackbar({
+              open: true,
+              message: `Reset and rescan ${data.status}${
+                data.error ? ": " + data.error : ""
+              }`,
+              severity: data.status === "failed" ? "error" : "info",
+            });
+          }
+        },
+        (error) => {
+          throw error;
+        }
+      );
     } catch (error) {
       console.error("Error during reset and rescan:", error);
       setSnackbar({
@@ -0,0 +1,36 @@
+// Reads newline-delimited JSON from a fetch body reader, calling onEvent with
+// each parsed line. A read can end inside a line, or inside a multi-byte
+// character, so the trailing partial line waits for the next read. Lines that
+// do not parse go to onError, which logs them unless the caller passes its own.
+export async function readNdjson(
+  reader,
+  onEvent,
+  onError = (error) => console.error("Error parsing JSON:", error)
+) {
+  const decoder = new TextDecoder();
+  let buffer = "";
+
+  const handleLine = (line) => {
+    if (!line) {
+      return;
+    }
+    let event;
+    try {
+      event = JSON.parse(line);
+    } catch (error) {
+      onError(error, line);
+      return;
+    }
+    onEvent(event);
+  };
+
+  while (true) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    const lines = buffer.split("\n");
+    buffer = lines.pop();
+    lines.forEach(handleLine);
+  }
+  handleLine(buffer + decoder.decode());
+}
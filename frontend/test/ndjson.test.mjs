@@ -0,0 +1,64 @@
+import { test } from "node:test";
+import assert from "node:assert/strict";
+import { readNdjson } from "../src/ndjson.mjs";
+
+// A fetch body reader that returns `chunks` one read at a time
+function readerOf(chunks) {
+  const queue = chunks.map((chunk) =>
+    typeof chunk === "string" ? new TextEncoder().encode(chunk) : chunk
+  );
+  return {
+    read: async () =>
+      queue.length ? { done: false, value: queue.shift() } : { done: true },
+  };
+}
+
+async function collect(chunks) {
+  const events = [];
+  const errors = [];
+  await readNdjson(readerOf(chunks), (event) => events.push(event), (error, line) => errors.push(line));
+  return { events, errors };
+}
+
+test("parses one event per line", async () => {
+  const { events, errors } = await collect(['{"answer":"Ciao"}\n{"sources":["a.xml"]}\n']);
+  assert.deepEqual(events, [{ answer: "Ciao" }, { sources: ["a.xml"] }]);
+  assert.deepEqual(errors, []);
+});
+
+test("joins a line split across reads", async () => {
+  const { events, errors } = await collect(['{"answer":"Ci', 'ao"}\n{"sour', 'ces":["a.xml"]}\n']);
+  assert.deepEqual(events, [{ answer: "Ciao" }, { sources: ["a.xml"] }]);
+  assert.deepEqual(errors, []);
+});
+
+test("joins a multi-byte character split across reads", async () => {
+  const bytes = new TextEncoder().encode('{"answer":"perché"}\n');
+  // "é" is two bytes; cut between them
+  const cut = bytes.indexOf(0xc3) + 1;
+  const { events } = await collect([bytes.slice(0, cut), bytes.slice(cut)]);
+  assert.deepEqual(events, [{ answer: "perché" }]);
+});
+
+test("handles a last line without a newline", async () => {
+  const { events } = await collect(['{"answer":"a"}\n{"answer', '":"b"}']);
+  assert.deepEqual(events, [{ answer: "a" }, { answer: "b" }]);
+});
+
+test("passes unparseable lines to onError and keeps reading", async () => {
+  const { events, errors } = await collect(['{"answer":"a"}\nnot json\n\n{"answer":"b"}\n']);
+  assert.deepEqual(events, [{ answer: "a" }, { answer: "b" }]);
+  assert.deepEqual(errors, ["not json"]);
+});
+
+test("an onError that throws stops the read", async () => {
+  const reader = readerOf(['{"status":"running"}\n{"status', '\n{"status":"completed"}\n']);
+  const events = [];
+  await assert.rejects(
+    readNdjson(reader, (event) => events.push(event), (error) => {
+      throw error;
+    }),
+    SyntaxError
+  );
+  assert.deepEqual(events, [{ status: "running" }]);
+});